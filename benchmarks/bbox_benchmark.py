@@ -0,0 +1,55 @@
+import logging
+
+import numpy as np
+import torch
+
+from model.meta_architecture.rpn.bbox_transform import bbox_overlaps_batch, bbox_transform_inv
+from model.utils.cython_bbox import bbox_overlaps
+from benchmark_utils import create_arg_parser, create_random_boxes, create_random_gt_boxes, run_benchmark, \
+    time_fn, to_device
+
+logger = logging.getLogger(__name__)
+
+
+def run(args):
+    rng = np.random.RandomState(args.seed)
+    results = {}
+    for num_boxes in args.num_boxes:
+        boxes = torch.from_numpy(create_random_boxes(num_boxes, args.im_height, args.im_width, rng))
+        gt_boxes = create_random_gt_boxes(args.batch_size, args.num_gt_boxes, args.num_classes,
+                                          args.im_height, args.im_width, rng)
+        deltas = torch.from_numpy(rng.normal(0, 0.1, size=(args.batch_size, num_boxes, 4)).astype(np.float32))
+
+        device_boxes = to_device(boxes, args.cuda)
+        device_batch_boxes = to_device(boxes.unsqueeze(0).expand(args.batch_size, num_boxes, 4).contiguous(),
+                                       args.cuda)
+        device_gt_boxes = to_device(gt_boxes, args.cuda)
+        device_deltas = to_device(deltas, args.cuda)
+        np_boxes = boxes.numpy().astype(np.float64)
+        np_gt_boxes = gt_boxes[0, :, :4].numpy().astype(np.float64)
+
+        cases = {'bbox_overlaps_batch': lambda: bbox_overlaps_batch(device_boxes, device_gt_boxes),
+                 'bbox_transform_inv': lambda: bbox_transform_inv(device_batch_boxes, device_deltas, args.batch_size),
+                 'cython_bbox_overlaps': lambda: bbox_overlaps(np_boxes, np_gt_boxes)}
+        for case_name, fn in cases.items():
+            case_key = '{}/{}_boxes'.format(case_name, num_boxes)
+            results[case_key] = time_fn(fn, args.num_repeats, args.num_warmups)
+            logger.info('{}: {:.3f} ms.'.format(case_key, results[case_key]['median_ms']))
+    return results
+
+
+def add_args(parser):
+    # ~17k anchors for a 600x1000 image with 9 anchors per location and stride 16
+    parser.add_argument('--num_boxes', type=int, nargs='+', default=[2000, 17100, 40000])
+    parser.add_argument('--num_gt_boxes', type=int, default=20)
+    parser.add_argument('--num_classes', type=int, default=21)
+    parser.add_argument('--batch_size', type=int, default=1)
+    parser.add_argument('--im_height', type=int, default=600)
+    parser.add_argument('--im_width', type=int, default=1000)
+
+
+if __name__ == '__main__':
+    parser = create_arg_parser('Benchmark the box overlap and transform functions.')
+    add_args(parser)
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    run_benchmark('bbox', run, parser.parse_args())
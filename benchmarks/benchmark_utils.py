@@ -0,0 +1,116 @@
+import argparse
+import json
+import logging
+import platform
+import subprocess
+import time
+
+import numpy as np
+import os
+import torch
+import yaml
+from easydict import EasyDict as edict
+
+logger = logging.getLogger(__name__)
+
+_DEFAULTS_PATH = os.path.join(os.path.dirname(__file__), '..', 'lib', 'utils', 'defaults.yml')
+
+
+def create_arg_parser(description):
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument('--num_repeats', type=int, default=10)
+    parser.add_argument('--num_warmups', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--cuda', action='store_true', help='run the torch benchmarks on the GPU')
+    parser.add_argument('--output_dir', default='benchmark_results')
+    return parser
+
+
+def run_benchmark(benchmark_name, run_fn, args):
+    """Seeds everything, runs run_fn(args) and saves the results it returns."""
+    np.random.seed(args.seed)
+    torch.manual_seed(args.seed)
+    results = run_fn(args)
+    return save_results(benchmark_name, results, args)
+
+
+def load_default_cfg(dataset='pascal_voc'):
+    """The defaults.yml config, without the output directories and seeding of ConfigProvider."""
+    with open(_DEFAULTS_PATH, 'r') as f:
+        cfg = edict(yaml.safe_load(f))
+    for k in ['imdb_name', 'imdbval_name', 'ANCHOR_SCALES', 'ANCHOR_RATIOS', 'MAX_NUM_GT_BOXES']:
+        cfg[k] = cfg[dataset][k]
+    cfg.PIXEL_MEANS = np.array(cfg.PIXEL_MEANS)
+    cfg.EPS = float(cfg.EPS)
+    return cfg
+
+
+def to_device(tensor, is_cuda):
+    return tensor.cuda() if is_cuda else tensor
+
+
+def create_random_boxes(num_boxes, im_height, im_width, rng, min_size=16, max_size=256):
+    """(num_boxes, 4) float32 array of (x1, y1, x2, y2) boxes inside the image."""
+    sizes = rng.uniform(min_size, max_size, size=(num_boxes, 2))
+    sizes = np.minimum(sizes, [im_width - 1, im_height - 1])
+    x1 = rng.uniform(0, im_width - sizes[:, 0])
+    y1 = rng.uniform(0, im_height - sizes[:, 1])
+    return np.stack((x1, y1, x1 + sizes[:, 0], y1 + sizes[:, 1]), axis=1).astype(np.float32)
+
+
+def create_random_gt_boxes(batch_size, num_gt_boxes, num_classes, im_height, im_width, rng):
+    """(batch_size, num_gt_boxes, 5) tensor of (x1, y1, x2, y2, cls) ground truth boxes, as the data loader pads them."""
+    gt_boxes = np.zeros((batch_size, num_gt_boxes, 5), dtype=np.float32)
+    for i in range(batch_size):
+        gt_boxes[i, :, :4] = create_random_boxes(num_gt_boxes, im_height, im_width, rng, min_size=32, max_size=400)
+        gt_boxes[i, :, 4] = rng.randint(1, num_classes, num_gt_boxes)
+    return torch.from_numpy(gt_boxes)
+
+
+def time_fn(fn, num_repeats=10, num_warmups=1):
+    """Returns timing statistics (in milliseconds) of calling fn num_repeats times."""
+    for _ in range(num_warmups):
+        fn()
+    timings = []
+    for _ in range(num_repeats):
+        if torch.cuda.is_available():
+            torch.cuda.synchronize()
+        start = time.perf_counter()
+        fn()
+        if torch.cuda.is_available():
+            torch.cuda.synchronize()
+        timings.append((time.perf_counter() - start) * 1000)
+    timings = np.array(timings)
+    return {'mean_ms': float(timings.mean()),
+            'median_ms': float(np.median(timings)),
+            'min_ms': float(timings.min()),
+            'std_ms': float(timings.std()),
+            'num_repeats': num_repeats}
+
+
+def _get_git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def save_results(benchmark_name, results, args):
+    """Writes the results as JSON, together with the commit and environment they were measured in."""
+    os.makedirs(args.output_dir, exist_ok=True)
+    output_path = os.path.join(args.output_dir, '{}.json'.format(benchmark_name))
+    report = {'benchmark': benchmark_name,
+              'commit': _get_git_commit(),
+              'args': vars(args),
+              'environment': {'python': platform.python_version(),
+                              'torch': torch.__version__,
+                              'numpy': np.__version__,
+                              'cuda': torch.cuda.is_available(),
+                              'machine': platform.machine(),
+                              'num_threads': torch.get_num_threads()},
+              'results': results}
+    with open(output_path, 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+    logger.info('Benchmark results were written to: {}.'.format(output_path))
+    return output_path
@@ -0,0 +1,53 @@
+import argparse
+import glob
+import json
+import logging
+import sys
+
+import os
+
+logger = logging.getLogger(__name__)
+
+
+def load_results(results_dir):
+    results = {}
+    for path in sorted(glob.glob(os.path.join(results_dir, '*.json'))):
+        with open(path, 'r') as f:
+            report = json.load(f)
+        for case_name, stats in report['results'].items():
+            results['{}:{}'.format(report['benchmark'], case_name)] = stats
+    return results
+
+
+def compare_results(baseline_dir, candidate_dir, threshold, stat_name='median_ms'):
+    """Returns the cases that are slower in candidate_dir than in baseline_dir by more than threshold (a fraction)."""
+    baseline = load_results(baseline_dir)
+    candidate = load_results(candidate_dir)
+    regressions = []
+    logger.info('{:<70} {:>12} {:>12} {:>8}'.format('case', 'baseline', 'candidate', 'ratio'))
+    for case_name in sorted(set(baseline) & set(candidate)):
+        baseline_value, candidate_value = baseline[case_name][stat_name], candidate[case_name][stat_name]
+        ratio = candidate_value / baseline_value if baseline_value > 0 else float('inf')
+        is_regression = ratio > 1 + threshold
+        logger.info('{:<70} {:>12.3f} {:>12.3f} {:>7.2f}x{}'.format(
+            case_name, baseline_value, candidate_value, ratio, '  <-- regression' if is_regression else ''))
+        if is_regression:
+            regressions.append(case_name)
+    for case_name in sorted(set(baseline) ^ set(candidate)):
+        logger.info('{:<70} only in {}'.format(case_name, 'baseline' if case_name in baseline else 'candidate'))
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare two benchmark result directories (e.g. of two commits).')
+    parser.add_argument('baseline_dir')
+    parser.add_argument('candidate_dir')
+    parser.add_argument('--threshold', type=float, default=0.1, help='allowed slowdown, as a fraction of the baseline')
+    parser.add_argument('--stat', default='median_ms')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    regressions = compare_results(args.baseline_dir, args.candidate_dir, args.threshold, args.stat)
+    if regressions:
+        logger.error('{} cases regressed by more than {:.0%}.'.format(len(regressions), args.threshold))
+        sys.exit(1)
@@ -0,0 +1,93 @@
+import logging
+
+import numpy as np
+import torch
+
+from model.meta_architecture.nms.nms_cpu import nms_cpu, batched_nms_cpu
+from model.meta_architecture.nms.nms_wrapper import nms, batched_nms
+from benchmark_utils import create_arg_parser, run_benchmark, time_fn, to_device
+
+logger = logging.getLogger(__name__)
+
+
+def python_loop_nms(dets, thresh):
+    """The previous numpy implementation of nms_cpu (with the corrected intersection), kept as a baseline."""
+    dets = dets.numpy()
+    x1 = dets[:, 0]
+    y1 = dets[:, 1]
+    x2 = dets[:, 2]
+    y2 = dets[:, 3]
+    scores = dets[:, 4]
+
+    areas = (x2 - x1 + 1) * (y2 - y1 + 1)
+    order = scores.argsort()[::-1]
+
+    keep = []
+    while order.size > 0:
+        i = order.item(0)
+        keep.append(i)
+        xx1 = np.maximum(x1[i], x1[order[1:]])
+        yy1 = np.maximum(y1[i], y1[order[1:]])
+        xx2 = np.minimum(x2[i], x2[order[1:]])
+        yy2 = np.minimum(y2[i], y2[order[1:]])
+
+        w = np.maximum(0.0, xx2 - xx1 + 1)
+        h = np.maximum(0.0, yy2 - yy1 + 1)
+        inter = w * h
+        ovr = inter / (areas[i] + areas[order[1:]] - inter)
+
+        inds = np.where(ovr <= thresh)[0]
+        order = order[inds + 1]
+
+    return torch.IntTensor(keep)
+
+
+def create_random_dets(num_boxes, im_size=1000, seed=0):
+    """Proposal-like boxes: clustered around a few objects, so that NMS has real work to do."""
+    rng = np.random.RandomState(seed)
+    centers = rng.uniform(0, im_size, size=(max(num_boxes // 50, 1), 2))
+    box_centers = centers[rng.randint(0, len(centers), num_boxes)] + rng.normal(0, 15, size=(num_boxes, 2))
+    box_sizes = rng.uniform(16, 256, size=(num_boxes, 2))
+    dets = np.hstack((box_centers - box_sizes / 2, box_centers + box_sizes / 2, rng.uniform(size=(num_boxes, 1))))
+    return torch.from_numpy(dets.astype(np.float32))
+
+
+def run(args):
+    results = {}
+    for num_boxes in args.num_boxes:
+        dets = create_random_dets(num_boxes, seed=args.seed)
+        idxs = torch.from_numpy(np.random.RandomState(args.seed).randint(0, args.num_classes, num_boxes))
+
+        expected_keep = np.sort(python_loop_nms(dets, args.thresh).numpy())
+        actual_keep = np.sort(nms_cpu(dets, args.thresh).numpy())
+        if not np.array_equal(expected_keep, actual_keep):
+            raise AssertionError('nms_cpu and the python loop NMS disagree for {} boxes.'.format(num_boxes))
+
+        device_dets = to_device(dets, args.cuda)
+        device_idxs = to_device(idxs, args.cuda)
+        cases = {'python_loop_nms': lambda: python_loop_nms(dets, args.thresh),
+                 'nms_cpu': lambda: nms_cpu(dets, args.thresh),
+                 'batched_nms_cpu_{}_classes'.format(args.num_classes):
+                     lambda: batched_nms_cpu(dets, idxs, args.thresh),
+                 'nms': lambda: nms(device_dets, args.thresh),
+                 'batched_nms_{}_classes'.format(args.num_classes):
+                     lambda: batched_nms(device_dets, device_idxs, args.thresh)}
+        for case_name, fn in cases.items():
+            results['{}/{}_boxes'.format(case_name, num_boxes)] = time_fn(fn, args.num_repeats, args.num_warmups)
+        logger.info('{} boxes ({} kept): python loop {:.2f} ms, nms_cpu {:.2f} ms.'.format(
+            num_boxes, len(actual_keep), results['python_loop_nms/{}_boxes'.format(num_boxes)]['median_ms'],
+            results['nms_cpu/{}_boxes'.format(num_boxes)]['median_ms']))
+    return results
+
+
+def add_args(parser):
+    parser.add_argument('--num_boxes', type=int, nargs='+', default=[300, 2000, 6000, 12000])
+    parser.add_argument('--thresh', type=float, default=0.7)
+    parser.add_argument('--num_classes', type=int, default=80)
+
+
+if __name__ == '__main__':
+    parser = create_arg_parser('Benchmark the NMS implementations, and the CPU NMS against the previous python loop.')
+    add_args(parser)
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    run_benchmark('nms', run, parser.parse_args())
@@ -0,0 +1,86 @@
+import logging
+import shutil
+import tempfile
+
+import numpy as np
+import os
+
+from data_manager.classic_detection.datasets.packed_shards import read_record, write_shards
+from data_manager.roi_data_layer.roibatchLoader import roiBatchLoader
+from data_manager.roi_data_layer.roidb import rank_roidb_ratio
+from benchmark_utils import create_arg_parser, load_default_cfg, run_benchmark, time_fn
+from roibatchloader_benchmark import create_roidb
+
+logger = logging.getLogger(__name__)
+
+
+def create_packed_roidb(roidb, pack_dir, shard_max_bytes):
+    """roidb whose images are read from shards in pack_dir, as packed_imdb gives them."""
+    records = write_shards([entry['image'] for entry in roidb], pack_dir, shard_max_bytes)
+    packed_roidb = []
+    for entry, (shard_file_name, offset, length) in zip(roidb, records):
+        entry = dict(entry)
+        entry['image_record'] = (os.path.join(pack_dir, shard_file_name), offset, length)
+        packed_roidb.append(entry)
+    return packed_roidb
+
+
+def run(args):
+    # The images are in the page cache after the warmup, so on a local disk the reads mostly measure the cost of
+    # the system calls. The difference is much larger on network storage, run with --data_dir on it to measure that
+    rng = np.random.RandomState(args.seed)
+    cfg = load_default_cfg()
+    data_dir = tempfile.mkdtemp(prefix='packed_shards_benchmark_', dir=args.data_dir)
+    try:
+        roidb = create_roidb(data_dir, args.num_images, args.num_gt_boxes, args.num_classes, rng)
+        pack_dir = os.path.join(data_dir, 'packed')
+        os.makedirs(pack_dir)
+        packed_roidb = create_packed_roidb(roidb, pack_dir, args.shard_size_mb * 1024 ** 2)
+        read_order = rng.permutation(args.num_images)
+
+        def read_loose_files():
+            for i in read_order:
+                with open(roidb[i]['image'], 'rb') as f:
+                    f.read()
+
+        def read_packed_records():
+            for i in read_order:
+                read_record(packed_roidb[i]['image_record'])
+
+        results = {}
+        for layout_name, read_fn, layout_roidb in [('loose', read_loose_files, roidb),
+                                                   ('packed', read_packed_records, packed_roidb)]:
+            case_key = 'read_bytes_{}/{}_images'.format(layout_name, args.num_images)
+            results[case_key] = time_fn(read_fn, args.num_repeats, args.num_warmups)
+
+            ratio_list, ratio_index = rank_roidb_ratio(layout_roidb)
+            dataset = roiBatchLoader(layout_roidb, ratio_list, ratio_index, 1, args.num_classes, cfg, training=True)
+
+            def load_all_images():
+                for i in range(len(dataset)):
+                    dataset[i]
+
+            case_key = 'roibatchloader_getitem_{}/{}_images'.format(layout_name, args.num_images)
+            results[case_key] = time_fn(load_all_images, args.num_repeats, args.num_warmups)
+        for case_key, case_results in results.items():
+            case_results['median_ms_per_image'] = case_results['median_ms'] / args.num_images
+            logger.info('{}: {:.3f} ms per image.'.format(case_key, case_results['median_ms_per_image']))
+    finally:
+        shutil.rmtree(data_dir)
+    return results
+
+
+def add_args(parser):
+    parser.add_argument('--num_images', type=int, default=200)
+    parser.add_argument('--num_gt_boxes', type=int, default=5)
+    parser.add_argument('--num_classes', type=int, default=21)
+    parser.add_argument('--shard_size_mb', type=int, default=16)
+    parser.add_argument('--data_dir', default=None, help='where to write the images, a temporary directory by default')
+
+
+if __name__ == '__main__':
+    parser = create_arg_parser('Benchmark reading images from loose files against reading them from packed shards.')
+    parser.set_defaults(num_repeats=3)
+    add_args(parser)
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    run_benchmark('packed_shards', run, parser.parse_args())
@@ -0,0 +1,72 @@
+import logging
+import shutil
+import tempfile
+
+import numpy as np
+import os
+from PIL import Image
+
+from data_manager.roi_data_layer.roibatchLoader import roiBatchLoader
+from data_manager.roi_data_layer.roidb import rank_roidb_ratio
+from benchmark_utils import create_arg_parser, create_random_boxes, load_default_cfg, run_benchmark, time_fn
+
+logger = logging.getLogger(__name__)
+
+# (width, height) of typical PASCAL VOC and COCO images, including ones that need cropping
+_IMAGE_SIZES = [(500, 375), (375, 500), (500, 333), (640, 480), (480, 640), (640, 427), (1000, 300)]
+
+
+def create_roidb(data_dir, num_images, num_gt_boxes, num_classes, rng):
+    """Writes random JPEG images to data_dir and returns a roidb with random gt boxes for them."""
+    roidb = []
+    for i in range(num_images):
+        width, height = _IMAGE_SIZES[i % len(_IMAGE_SIZES)]
+        image_path = os.path.join(data_dir, '{:06d}.jpg'.format(i))
+        Image.fromarray(rng.randint(0, 256, size=(height, width, 3)).astype(np.uint8)).save(image_path)
+        roidb.append({'img_id': i,
+                      'image': image_path,
+                      'width': width,
+                      'height': height,
+                      'flipped': bool(i % 2),
+                      'boxes': create_random_boxes(num_gt_boxes, height, width, rng, min_size=32).astype(np.uint16),
+                      'gt_classes': rng.randint(1, num_classes, num_gt_boxes).astype(np.int32)})
+    return roidb
+
+
+def run(args):
+    rng = np.random.RandomState(args.seed)
+    cfg = load_default_cfg()
+    data_dir = tempfile.mkdtemp(prefix='roibatchloader_benchmark_')
+    try:
+        roidb = create_roidb(data_dir, args.num_images, args.num_gt_boxes, args.num_classes, rng)
+        ratio_list, ratio_index = rank_roidb_ratio(roidb)
+
+        results = {}
+        for mode_name, is_training in [('train', True), ('infer', False)]:
+            dataset = roiBatchLoader(roidb, ratio_list, ratio_index, 1, args.num_classes, cfg, training=is_training)
+
+            def load_all_images():
+                for i in range(len(dataset)):
+                    dataset[i]
+
+            case_key = 'roibatchloader_getitem_{}/{}_images'.format(mode_name, args.num_images)
+            results[case_key] = time_fn(load_all_images, args.num_repeats, args.num_warmups)
+            results[case_key]['median_ms_per_image'] = results[case_key]['median_ms'] / args.num_images
+            logger.info('{}: {:.3f} ms per image.'.format(case_key, results[case_key]['median_ms_per_image']))
+    finally:
+        shutil.rmtree(data_dir)
+    return results
+
+
+def add_args(parser):
+    parser.add_argument('--num_images', type=int, default=50)
+    parser.add_argument('--num_gt_boxes', type=int, default=5)
+    parser.add_argument('--num_classes', type=int, default=21)
+
+
+if __name__ == '__main__':
+    parser = create_arg_parser('Benchmark loading and preprocessing images with roiBatchLoader.__getitem__.')
+    parser.set_defaults(num_repeats=3)
+    add_args(parser)
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    run_benchmark('roibatchloader', run, parser.parse_args())
@@ -0,0 +1,53 @@
+import logging
+
+import numpy as np
+
+from data_manager.roi_data_layer.roidb import filter_roidb, rank_roidb_ratio
+from benchmark_utils import create_arg_parser, create_random_boxes, run_benchmark, time_fn
+from roibatchloader_benchmark import _IMAGE_SIZES
+
+logger = logging.getLogger(__name__)
+
+
+def create_roidb(num_images, num_gt_boxes, empty_fraction, rng):
+    """roidb of num_images entries (without images) with up to num_gt_boxes random boxes, empty_fraction of them
+    without any box."""
+    roidb = []
+    for i in range(num_images):
+        width, height = _IMAGE_SIZES[i % len(_IMAGE_SIZES)]
+        num_boxes = 0 if rng.rand() < empty_fraction else rng.randint(1, num_gt_boxes + 1)
+        roidb.append({'width': width,
+                      'height': height,
+                      'boxes': create_random_boxes(num_boxes, height, width, rng, min_size=1).astype(np.uint16)})
+    return roidb
+
+
+def run(args):
+    rng = np.random.RandomState(args.seed)
+    results = {}
+    for num_images in args.num_images:
+        roidb = create_roidb(num_images, args.num_gt_boxes, args.empty_fraction, rng)
+        # filter_roidb returns a new list, the roidb is not modified by the repeats
+        for filter_names in [('empty',), ('empty', 'tiny_boxes', 'extreme_aspect')]:
+            case_key = 'filter_roidb_{}/{}_images'.format('+'.join(filter_names), num_images)
+            results[case_key] = time_fn(lambda: filter_roidb(roidb, filter_names), args.num_repeats, args.num_warmups)
+            logger.info('{}: {:.1f} ms.'.format(case_key, results[case_key]['median_ms']))
+
+        case_key = 'rank_roidb_ratio/{}_images'.format(num_images)
+        results[case_key] = time_fn(lambda: rank_roidb_ratio(roidb), args.num_repeats, args.num_warmups)
+        logger.info('{}: {:.1f} ms.'.format(case_key, results[case_key]['median_ms']))
+    return results
+
+
+def add_args(parser):
+    parser.add_argument('--num_images', type=int, nargs='+', default=[10000, 100000])
+    parser.add_argument('--num_gt_boxes', type=int, default=5)
+    parser.add_argument('--empty_fraction', type=float, default=0.05)
+
+
+if __name__ == '__main__':
+    parser = create_arg_parser('Benchmark filtering the roidb and ranking it by aspect ratio.')
+    parser.set_defaults(num_repeats=3)
+    add_args(parser)
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    run_benchmark('roidb', run, parser.parse_args())
@@ -0,0 +1,90 @@
+import logging
+
+import numpy as np
+import torch
+
+from model.meta_architecture.rpn.anchor_target_layer import _AnchorTargetLayer
+from model.meta_architecture.rpn.proposal_layer import _ProposalLayer
+from model.meta_architecture.rpn.proposal_target_layer_cascade import _ProposalTargetLayer
+from benchmark_utils import create_arg_parser, create_random_gt_boxes, load_default_cfg, run_benchmark, \
+    time_fn, to_device
+
+logger = logging.getLogger(__name__)
+
+
+def create_rpn_outputs(batch_size, num_anchors, feat_height, feat_width, rng):
+    """Random RPN head outputs: (fg/bg probabilities, box deltas, raw scores) over the feature map."""
+    scores = rng.normal(size=(batch_size, 2, num_anchors, feat_height, feat_width)).astype(np.float32)
+    probs = np.exp(scores) / np.exp(scores).sum(axis=1, keepdims=True)
+    probs = probs.reshape(batch_size, 2 * num_anchors, feat_height, feat_width)
+    deltas = rng.normal(0, 0.1, size=(batch_size, 4 * num_anchors, feat_height, feat_width)).astype(np.float32)
+    return torch.from_numpy(probs), torch.from_numpy(deltas), \
+        torch.from_numpy(scores.reshape(batch_size, 2 * num_anchors, feat_height, feat_width))
+
+
+def create_proposals_around_gt(gt_boxes, num_proposals, rng):
+    """(batch_size, num_proposals, 5) rois of (batch_idx, x1, y1, x2, y2) jittered around the gt boxes,
+    so that both foreground and background rois are sampled."""
+    batch_size, num_gt_boxes = gt_boxes.size(0), gt_boxes.size(1)
+    rois = np.zeros((batch_size, num_proposals, 5), dtype=np.float32)
+    for i in range(batch_size):
+        boxes = gt_boxes[i, rng.randint(0, num_gt_boxes, num_proposals), :4].numpy()
+        sizes = np.concatenate((boxes[:, 2:] - boxes[:, :2],) * 2, axis=1)
+        rois[i, :, 0] = i
+        rois[i, :, 1:] = boxes + rng.normal(0, 0.3, size=boxes.shape) * sizes
+    return torch.from_numpy(rois)
+
+
+def run(args):
+    rng = np.random.RandomState(args.seed)
+    cfg = load_default_cfg()
+    feat_stride = cfg.FEAT_STRIDE[0]
+    feat_height, feat_width = args.im_height // feat_stride, args.im_width // feat_stride
+
+    proposal_layer = _ProposalLayer(feat_stride, cfg.ANCHOR_SCALES, cfg.ANCHOR_RATIOS, cfg)
+    anchor_target_layer = _AnchorTargetLayer(feat_stride, cfg.ANCHOR_SCALES, cfg.ANCHOR_RATIOS, cfg)
+    proposal_target_layer = _ProposalTargetLayer(args.num_classes, cfg)
+    num_anchors = proposal_layer._num_anchors
+
+    rpn_cls_prob, rpn_bbox_pred, rpn_cls_score = create_rpn_outputs(
+        args.batch_size, num_anchors, feat_height, feat_width, rng)
+    im_info = torch.FloatTensor([[args.im_height, args.im_width, 1.]] * args.batch_size)
+    gt_boxes = create_random_gt_boxes(args.batch_size, cfg.MAX_NUM_GT_BOXES, args.num_classes,
+                                      args.im_height, args.im_width, rng)
+    num_boxes = torch.LongTensor([cfg.MAX_NUM_GT_BOXES] * args.batch_size)
+    all_rois = create_proposals_around_gt(gt_boxes, cfg.TRAIN.RPN_POST_NMS_TOP_N + cfg.MAX_NUM_GT_BOXES, rng)
+
+    rpn_cls_prob, rpn_bbox_pred, rpn_cls_score, im_info, gt_boxes, num_boxes, all_rois = \
+        [to_device(t, args.cuda) for t in
+         [rpn_cls_prob, rpn_bbox_pred, rpn_cls_score, im_info, gt_boxes, num_boxes, all_rois]]
+
+    # TRAIN.BATCH_SIZE (rois per image) is only set in the model configs
+    cfg.TRAIN.BATCH_SIZE = rois_per_image = args.rois_per_image
+    fg_rois_per_image = int(np.round(cfg.TRAIN.FG_FRACTION * rois_per_image))
+
+    cases = {'proposal_layer_train': lambda: proposal_layer((rpn_cls_prob, rpn_bbox_pred, im_info, 'TRAIN')),
+             'proposal_layer_test': lambda: proposal_layer((rpn_cls_prob, rpn_bbox_pred, im_info, 'TEST')),
+             'anchor_target_layer': lambda: anchor_target_layer((rpn_cls_score, gt_boxes, im_info, num_boxes)),
+             'sample_rois_pytorch': lambda: proposal_target_layer._sample_rois_pytorch(
+                 all_rois, gt_boxes, fg_rois_per_image, rois_per_image, args.num_classes)}
+    results = {}
+    for case_name, fn in cases.items():
+        case_key = '{}/batch_{}_{}x{}'.format(case_name, args.batch_size, args.im_height, args.im_width)
+        results[case_key] = time_fn(fn, args.num_repeats, args.num_warmups)
+        logger.info('{}: {:.3f} ms.'.format(case_key, results[case_key]['median_ms']))
+    return results
+
+
+def add_args(parser):
+    parser.add_argument('--batch_size', type=int, default=1)
+    parser.add_argument('--num_classes', type=int, default=21)
+    parser.add_argument('--rois_per_image', type=int, default=128)
+    parser.add_argument('--im_height', type=int, default=600)
+    parser.add_argument('--im_width', type=int, default=1000)
+
+
+if __name__ == '__main__':
+    parser = create_arg_parser('Benchmark the proposal, anchor target and proposal target layers of the RPN.')
+    add_args(parser)
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    run_benchmark('rpn_layers', run, parser.parse_args())
@@ -0,0 +1,47 @@
+import importlib
+import logging
+import sys
+
+from benchmark_utils import create_arg_parser, run_benchmark
+
+logger = logging.getLogger(__name__)
+
+# benchmark name -> module, every module defines add_args(parser) and run(args)
+BENCHMARKS = {'nms': 'nms_benchmark',
+              'bbox': 'bbox_benchmark',
+              'rpn_layers': 'rpn_layers_benchmark',
+              'voc_eval': 'voc_eval_benchmark',
+              'roibatchloader': 'roibatchloader_benchmark',
+              'packed_shards': 'packed_shards_benchmark',
+              'roidb': 'roidb_benchmark'}
+
+
+def run_all(benchmark_names, argv):
+    """Runs every benchmark with its default sizes and the common args, a failing benchmark doesn't stop the others."""
+    failed_benchmarks = []
+    for benchmark_name in benchmark_names:
+        logger.info('--->>> Running benchmark: {}'.format(benchmark_name))
+        try:
+            module = importlib.import_module(BENCHMARKS[benchmark_name])
+            parser = create_arg_parser(benchmark_name)
+            module.add_args(parser)
+            run_benchmark(benchmark_name, module.run, parser.parse_args(argv))
+        except Exception:
+            logger.error('Benchmark {} failed: '.format(benchmark_name), exc_info=True)
+            failed_benchmarks.append(benchmark_name)
+    return failed_benchmarks
+
+
+if __name__ == '__main__':
+    parser = create_arg_parser('Run all benchmarks, the results of each one are written to <output_dir>/<name>.json.')
+    parser.add_argument('--benchmarks', nargs='+', choices=sorted(BENCHMARKS), default=sorted(BENCHMARKS))
+    args = parser.parse_args()
+    # everything except --benchmarks is passed on to every benchmark
+    argv = ['--num_repeats', str(args.num_repeats), '--num_warmups', str(args.num_warmups),
+            '--seed', str(args.seed), '--output_dir', args.output_dir] + (['--cuda'] if args.cuda else [])
+
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    failed_benchmarks = run_all(args.benchmarks, argv)
+    if failed_benchmarks:
+        logger.error('Failed benchmarks: {}'.format(failed_benchmarks))
+        sys.exit(1)
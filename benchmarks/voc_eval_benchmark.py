@@ -0,0 +1,89 @@
+import logging
+import shutil
+import tempfile
+
+import numpy as np
+import os
+
+from data_manager.classic_detection.datasets.voc_eval import voc_eval
+from benchmark_utils import create_arg_parser, create_random_boxes, run_benchmark, time_fn
+
+logger = logging.getLogger(__name__)
+
+_ANNOTATION_TEMPLATE = '<annotation>{}</annotation>'
+_OBJECT_TEMPLATE = ('<object><name>{}</name><pose>Unspecified</pose><truncated>0</truncated>'
+                    '<difficult>{}</difficult><bndbox><xmin>{}</xmin><ymin>{}</ymin><xmax>{}</xmax>'
+                    '<ymax>{}</ymax></bndbox></object>')
+
+
+def create_voc_dataset(data_dir, num_images, num_gt_boxes, num_dets, classes, rng, im_height=500, im_width=500):
+    """Writes VOC style annotations, an image set file and per class detection files to data_dir."""
+    annotations_dir = os.path.join(data_dir, 'Annotations')
+    os.makedirs(annotations_dir, exist_ok=True)
+    image_names = ['{:06d}'.format(i) for i in range(num_images)]
+    dets_files = {cls: open(os.path.join(data_dir, 'dets_{}.txt'.format(cls)), 'w') for cls in classes}
+    for image_name in image_names:
+        gt_boxes = create_random_boxes(num_gt_boxes, im_height, im_width, rng, min_size=32).astype(int)
+        gt_classes = rng.choice(classes, num_gt_boxes)
+        objects = [_OBJECT_TEMPLATE.format(cls, int(rng.rand() < 0.1), *box) for cls, box in zip(gt_classes, gt_boxes)]
+        with open(os.path.join(annotations_dir, image_name + '.xml'), 'w') as f:
+            f.write(_ANNOTATION_TEMPLATE.format(''.join(objects)))
+
+        # half of the detections are jittered gt boxes, the others are random
+        jittered = gt_boxes[rng.randint(0, num_gt_boxes, num_dets // 2)] + rng.normal(0, 8, size=(num_dets // 2, 4))
+        dets = np.vstack((jittered, create_random_boxes(num_dets - num_dets // 2, im_height, im_width, rng)))
+        dets_classes = np.concatenate((gt_classes[rng.randint(0, num_gt_boxes, num_dets // 2)],
+                                       rng.choice(classes, num_dets - num_dets // 2)))
+        for cls, box, score in zip(dets_classes, dets, rng.uniform(size=num_dets)):
+            dets_files[cls].write('{} {:.3f} {:.1f} {:.1f} {:.1f} {:.1f}\n'.format(image_name, score, *box))
+    for f in dets_files.values():
+        f.close()
+    image_set_file = os.path.join(data_dir, 'test.txt')
+    with open(image_set_file, 'w') as f:
+        f.write('\n'.join(image_names))
+    return os.path.join(annotations_dir, '{}.xml'), os.path.join(data_dir, 'dets_{}.txt'), image_set_file
+
+
+def run(args):
+    rng = np.random.RandomState(args.seed)
+    classes = ['class_{}'.format(i) for i in range(args.num_classes)]
+    data_dir = tempfile.mkdtemp(prefix='voc_eval_benchmark_')
+    annopath, detpath, image_set_file = create_voc_dataset(
+        data_dir, args.num_images, args.num_gt_boxes, args.num_dets, classes, rng)
+    cache_dir = os.path.join(data_dir, 'annotations_cache')
+    # voc_eval joins the image set file path to the cache dir, so an absolute path replaces it
+    cache_file = os.path.join(cache_dir, '%s_annots.pkl' % image_set_file)
+
+    def eval_all_classes(is_cached):
+        if not is_cached and os.path.exists(cache_file):
+            os.remove(cache_file)
+        for cls in classes:
+            voc_eval(detpath, annopath, image_set_file, cls, cache_dir, ovthresh=0.5, use_07_metric=True)
+
+    results = {}
+    suffix = '{}_images_{}_classes'.format(args.num_images, args.num_classes)
+    try:
+        results['voc_eval_parse_annotations/' + suffix] = time_fn(lambda: eval_all_classes(is_cached=False),
+                                                                  args.num_repeats, args.num_warmups)
+        results['voc_eval_cached_annotations/' + suffix] = time_fn(lambda: eval_all_classes(is_cached=True),
+                                                                   args.num_repeats, args.num_warmups)
+    finally:
+        shutil.rmtree(data_dir)
+    for case_key, result in results.items():
+        logger.info('{}: {:.3f} ms.'.format(case_key, result['median_ms']))
+    return results
+
+
+def add_args(parser):
+    parser.add_argument('--num_images', type=int, default=1000)
+    parser.add_argument('--num_classes', type=int, default=20)
+    parser.add_argument('--num_gt_boxes', type=int, default=3)
+    parser.add_argument('--num_dets', type=int, default=100)
+
+
+if __name__ == '__main__':
+    parser = create_arg_parser('Benchmark the PASCAL VOC evaluation on synthetic annotations and detections.')
+    parser.set_defaults(num_repeats=3)
+    add_args(parser)
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    run_benchmark('voc_eval', run, parser.parse_args())
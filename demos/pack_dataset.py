@@ -0,0 +1,23 @@
+import os
+
+from data_manager.classic_detection.datasets.factory import get_imdb
+from data_manager.classic_detection.datasets.packed_imdb import get_pack_dir, pack_imdb
+from utils.config import ConfigProvider
+from utils.logging import set_root_logger
+
+SHARD_MAX_BYTES = 1024 ** 3
+
+if __name__ == '__main__':
+    # Packs the images of the training and evaluation datasets of the config into shards under DATA_DIR/packed.
+    # Train on them by appending '_packed' to the imdb names of the dataset in the config,
+    # e.g. imdb_name: "voc_2007_trainval_packed"
+    config_file = os.path.join(os.getcwd(), 'cfgs', 'vgg16.yml')
+
+    cfg = ConfigProvider()
+    cfg.load(config_file)
+    set_root_logger(cfg.get_log_path())
+
+    for imdb_names in [cfg.imdb_name, cfg.imdbval_name]:
+        for imdb_name in imdb_names.split('+'):
+            source_imdb = get_imdb(imdb_name, data_dir=cfg.DATA_DIR)
+            pack_imdb(source_imdb, get_pack_dir(imdb_name, cfg.DATA_DIR), SHARD_MAX_BYTES)
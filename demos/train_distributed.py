@@ -0,0 +1,18 @@
+import os
+
+from pipeline.faster_rcnn.run_functions.run_classic_pipeline import create_and_train_distributed
+from utils.config import ConfigProvider
+from utils.logging import set_root_logger
+
+if __name__ == '__main__':
+    # Either run it directly to spawn cfg.dist_num_local_processes training processes on this machine, or launch
+    # one process per device with torchrun, e.g. on each of 2 nodes with 4 GPUs:
+    #   torchrun --nnodes 2 --nproc_per_node 4 --rdzv_backend c10d --rdzv_endpoint <host>:29500 train_distributed.py
+    # To train on CPU only set CUDA: False and dist_backend: 'gloo' in the config.
+    config_file = os.path.join(os.getcwd(), 'cfgs', 'vgg16.yml')
+
+    cfg = ConfigProvider()
+    cfg.load(config_file)
+    set_root_logger(cfg.get_log_path())
+
+    create_and_train_distributed(cfg)
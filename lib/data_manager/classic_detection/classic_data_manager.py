@@ -1,15 +1,16 @@
+import numpy as np
 import torch
-from torch.utils.data import DataLoader
+from torch.utils.data import DataLoader, Subset
 from torch.utils.data.sampler import Sampler
 
 from data_manager.data_manager_abstract import DataManager, Mode
-from data_manager.roi_data_layer.roibatchLoader import roiBatchLoader
+from data_manager.roi_data_layer.roibatchLoader import roiBatchLoader, collate_padded_batch
 from data_manager.roi_data_layer.roidb import combined_roidb
 
 
 class DBSampler(Sampler):
     def __init__(self, train_size, batch_size):
-        super(DBSampler, self).__init__(data_source="")
+        # Sampler.__init__ is a no-op, whose data_source argument was removed in later versions of pytorch
         self.data_size = train_size
         self.num_per_batch = int(train_size / batch_size)
         self.batch_size = batch_size
@@ -34,29 +35,106 @@ class DBSampler(Sampler):
         return len(self.rand_num_view)
 
 
+class DistributedDBSampler(Sampler):
+    """DBSampler for the training process rank out of num_replicas.
+
+    All the processes shuffle the whole batches (images of similar aspect ratio) with the same seed and every one
+    takes every num_replicas-th batch. Batches are repeated so that all the processes get the same number of them,
+    the leftover images that don't fill a batch are dropped. The order changes with every iteration over the sampler.
+    """
+    def __init__(self, train_size, batch_size, num_replicas, rank, seed=0):
+        self.num_batches = int(train_size / batch_size)
+        if self.num_batches == 0:
+            raise ValueError("Can't sample batches of {} images out of {} images.".format(batch_size, train_size))
+        self.batch_size = batch_size
+        self.num_replicas = num_replicas
+        self.rank = rank
+        self.seed = seed
+        self.epoch = 0
+        self.num_batches_per_replica = int(np.ceil(self.num_batches / float(num_replicas)))
+        self.range = torch.arange(0, batch_size).view(1, batch_size).long()
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def __iter__(self):
+        generator = torch.Generator()
+        generator.manual_seed(self.seed + self.epoch)
+        self.epoch += 1
+        batch_order = torch.randperm(self.num_batches, generator=generator)
+
+        num_padded_batches = self.num_batches_per_replica * self.num_replicas
+        num_repeats = int(np.ceil(num_padded_batches / float(self.num_batches)))
+        batch_order = batch_order.repeat(num_repeats)[:num_padded_batches]
+
+        replica_batches = batch_order[self.rank:num_padded_batches:self.num_replicas]
+        rand_num = replica_batches.view(-1, 1) * self.batch_size + self.range
+        return iter(rand_num.view(-1))
+
+    def __len__(self):
+        return self.num_batches_per_replica * self.batch_size
+
+
+def shard_positions(num_items, num_shards, shard_id, shard_strategy):
+    """Positions (out of num_items) that belong to shard shard_id.
+
+    'contiguous' gives every shard one consecutive slice, 'strided' takes every num_shards-th position,
+    which keeps the shards balanced when the cost per item drifts along the order.
+    """
+    if not 0 <= shard_id < num_shards:
+        raise ValueError('shard_id should be in [0, {}), got {}.'.format(num_shards, shard_id))
+    if shard_strategy == 'contiguous':
+        return np.array_split(np.arange(num_items), num_shards)[shard_id]
+    elif shard_strategy == 'strided':
+        return np.arange(shard_id, num_items, num_shards)
+    else:
+        raise ValueError("Not valid shard strategy {} - should be 'contiguous' or 'strided'".format(shard_strategy))
+
+
 class ClassicDataManager(DataManager):
-    def __init__(self, mode, imdb_name, num_workers, is_cuda, cfg, batch_size=1):
+    def __init__(self, mode, imdb_name, num_workers, is_cuda, cfg, batch_size=1, shard_id=None,
+                 num_replicas=1, rank=0, sampler_seed=0):
         super(ClassicDataManager, self).__init__(mode, is_cuda)
+        # the flipped images are training examples only, inference predicts each image of the imdb once
         self._imdb, roidb, ratio_list, ratio_index = combined_roidb(
             imdb_name,
-            use_flipped=cfg.TRAIN.USE_FLIPPED,
+            use_flipped=cfg.TRAIN.USE_FLIPPED and self.is_train,
             proposal_method=cfg.TRAIN.PROPOSAL_METHOD,
             training=self.is_train,
-            data_dir=cfg.DATA_DIR)
+            data_dir=cfg.DATA_DIR,
+            filter_names=cfg.TRAIN.roidb_filters,
+            filter_options={'min_box_size': cfg.TRAIN.roidb_filter_min_box_size,
+                            'aspect_ratio_range': cfg.TRAIN.roidb_filter_aspect_ratio_range})
         dataset = roiBatchLoader(roidb, ratio_list, ratio_index, batch_size,
                                  self.imdb.num_classes, cfg, training=self.is_train)
         self.batch_size = batch_size
+        self.shard_id = shard_id
 
         if self.is_train:
             self._train_size = train_size = len(roidb)
-            sampler_batch = DBSampler(train_size, batch_size)
+            if num_replicas > 1:
+                # sampler_seed must be the same in all the processes, so that they agree on how to split the batches
+                sampler_batch = DistributedDBSampler(train_size, batch_size, num_replicas, rank, sampler_seed)
+                self.iters_per_epoch = sampler_batch.num_batches_per_replica
+            else:
+                sampler_batch = DBSampler(train_size, batch_size)
+                self.iters_per_epoch = int(self._train_size / batch_size)
             self._data_loader = DataLoader(dataset, batch_size=batch_size, num_workers=num_workers,
                                            sampler=sampler_batch)
-            self.iters_per_epoch = int(self._train_size / batch_size)
         elif mode == Mode.INFER:
             self.imdb.competition_mode(on=True)
+            if shard_id is None:
+                positions = np.arange(len(dataset))
+            else:
+                # shards are taken in data loader order, so batches still group images of similar aspect ratio
+                positions = shard_positions(len(dataset), cfg.TEST.num_shards, shard_id, cfg.TEST.shard_strategy)
+            roidb_idxs = np.array([dataset.roidb_index_at(p) for p in positions], dtype=np.int64)
+            if shard_id is not None:
+                dataset = Subset(dataset, positions)
             self._data_loader = DataLoader(dataset, batch_size=batch_size, num_workers=num_workers,
-                                           shuffle=False, pin_memory=True)
+                                           shuffle=False, pin_memory=is_cuda, collate_fn=collate_padded_batch)
+            self._image_idxs = np.sort(roidb_idxs)
+            self._infer_image_order = np.searchsorted(self._image_idxs, roidb_idxs)
         else:
             raise Exception("Not valid mode {} - should be TRAIN or TEST".format(mode))
 
@@ -65,10 +143,14 @@ class ClassicDataManager(DataManager):
         self._im_info.data.resize_(data[1].size()).copy_(data[1])
         self._gt_boxes.data.resize_(data[2].size()).copy_(data[2])
         self._num_boxes.data.resize_(data[3].size()).copy_(data[3])
+        self._batch_keys = list(data[4]) if len(data) > 4 else None
         return self._im_data, self._im_info, self._gt_boxes, self._num_boxes
 
     def __len__(self):
-        return len(self._imdb.image_index)
+        # a shard infers on its own images only
+        if self.is_infer and self.shard_id is not None:
+            return len(self._image_idxs)
+        return self._imdb.num_images
 
     @property
     def num_classes(self):
@@ -90,3 +172,13 @@ class ClassicDataManager(DataManager):
     def imdb(self):
         return self._imdb
 
+    @property
+    def infer_image_order(self):
+        """Image indices (into image_idxs) in the order they are yielded by the inference data loader."""
+        return self._infer_image_order
+
+    @property
+    def image_idxs(self):
+        """Sorted imdb indices of the images this data manager infers on, all of them unless it holds a shard."""
+        return self._image_idxs
+
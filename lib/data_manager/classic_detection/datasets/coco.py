@@ -72,6 +72,9 @@ class coco(imdb):
         return osp.join(self._data_path, 'annotations',
                         prefix + '_' + self._image_set + self._year + '.json')
 
+    def get_annotation_sources(self):
+        return [self._get_ann_file()]
+
     def _load_image_set_index(self):
         """
         Load image ids.
@@ -110,7 +113,7 @@ class coco(imdb):
         Return the database of ground-truth regions of interest.
         This function loads/saves from/to a cache file to speed up future calls.
         """
-        cache_file = osp.join(self.cache_path, self.name + '_gt_roidb.pkl')
+        cache_file = self._get_gt_roidb_cache_file()
         if osp.exists(cache_file):
             with open(cache_file, 'rb') as fid:
                 roidb = pickle.load(fid)
@@ -120,8 +123,7 @@ class coco(imdb):
         gt_roidb = [self._load_coco_annotation(index)
                     for index in self._image_index]
 
-        with open(cache_file, 'wb') as fid:
-            pickle.dump(gt_roidb, fid, pickle.HIGHEST_PROTOCOL)
+        ds_utils.dump_pickle_atomically(gt_roidb, cache_file)
         logger.info('Wrote gt roidb to {}.'.format(cache_file))
         return gt_roidb
 
@@ -183,6 +185,14 @@ class coco(imdb):
                 'flipped': False,
                 'seg_areas': seg_areas}
 
+    def get_image_sources(self):
+        # the image sizes are read from the annotations
+        return []
+
+    def get_image_sizes(self):
+        # read from the annotations
+        return [(r['width'], r['height']) for r in self.roidb]
+
     def _get_widths(self):
         return [r['width'] for r in self.roidb]
 
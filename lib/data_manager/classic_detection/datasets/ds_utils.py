@@ -6,7 +6,17 @@
 from __future__ import absolute_import
 from __future__ import division
 
+import hashlib
+import pickle
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
 import numpy as np
+import os
+
+# below this number of items the process pool costs more than it saves
+_MIN_ITEMS_TO_MAP_IN_PROCESSES = 64
+# reading the metadata of files mostly waits on the storage
+_NUM_STAT_THREADS = 32
 
 
 def unique_boxes(boxes, scale=1.0):
@@ -46,3 +56,41 @@ def filter_small_boxes(boxes, min_size):
     h = boxes[:, 3] - boxes[:, 1]
     keep = np.where((w >= min_size) & (h > min_size))[0]
     return keep
+
+
+def map_in_processes(fn, items, num_processes=None):
+    """[fn(item) for item in items], computed on chunks of items by a pool of num_processes processes
+    (one per cpu by default). fn is sent to the processes, so it must be picklable (e.g. a method of an imdb).
+    """
+    items = list(items)
+    num_processes = num_processes or os.cpu_count() or 1
+    if num_processes == 1 or len(items) < _MIN_ITEMS_TO_MAP_IN_PROCESSES:
+        return [fn(item) for item in items]
+    # a few chunks per process balance the load without sending fn too many times
+    chunksize = int(np.ceil(len(items) / float(4 * num_processes)))
+    with ProcessPoolExecutor(max_workers=num_processes) as executor:
+        return list(executor.map(fn, items, chunksize=chunksize))
+
+
+def dump_pickle_atomically(obj, path, open_fn=open):
+    """Pickles obj to path through a temporary file, so that readers never see a partial file."""
+    tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+    with open_fn(tmp_path, 'wb') as fid:
+        pickle.dump(obj, fid, pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+
+
+def _get_file_signature(path):
+    file_stat = os.stat(path)
+    return path, file_stat.st_size, file_stat.st_mtime_ns
+
+
+def get_file_signatures(paths):
+    """(path, size, modification time) of every file, which changes when it is edited or replaced."""
+    with ThreadPoolExecutor(max_workers=_NUM_STAT_THREADS) as executor:
+        return list(executor.map(_get_file_signature, paths))
+
+
+def get_files_fingerprint(paths):
+    """Hash of the paths, sizes and modification times of the files, which changes when any of them is edited."""
+    return hashlib.sha1(repr(get_file_signatures(paths)).encode('utf-8')).hexdigest()[:16]
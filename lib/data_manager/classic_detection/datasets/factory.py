@@ -11,12 +11,17 @@ from __future__ import division
 
 from data_manager.classic_detection.datasets.coco import coco
 from data_manager.classic_detection.datasets.imagenet import imagenet
+from data_manager.classic_detection.datasets.packed_imdb import PACKED_SUFFIX, packed_imdb
 from data_manager.classic_detection.datasets.pascal_voc import pascal_voc
 from data_manager.classic_detection.datasets.vg import vg
 
 
 def get_imdb(db_name, data_dir):
-    """Get an imdb (image database) by name."""
+    """Get an imdb (image database) by name.
+    <name>_packed reads the imdb <name> from its pack (see packed_imdb)."""
+    if db_name.endswith(PACKED_SUFFIX):
+        return packed_imdb(db_name[:-len(PACKED_SUFFIX)], data_dir=data_dir)
+
     __sets = {}
 
     # Set up voc_<year>_<split>
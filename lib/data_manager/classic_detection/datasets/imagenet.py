@@ -7,6 +7,7 @@ import os
 import scipy.io as sio
 import scipy.sparse
 
+from data_manager.classic_detection.datasets import ds_utils
 from data_manager.classic_detection.datasets.imdb import imdb
 
 # --------------------------------------------------------
@@ -150,21 +151,23 @@ class imagenet(imdb):
         Return the database of ground-truth regions of interest.
         This function loads/saves from/to a cache file to speed up future calls.
         """
-        cache_file = os.path.join(self.cache_path, self.name + '_gt_roidb.pkl')
+        cache_file = self._get_gt_roidb_cache_file()
         if os.path.exists(cache_file):
             with open(cache_file, 'rb') as fid:
                 roidb = pickle.load(fid)
             logger.info('{} gt roidb loaded from {}.'.format(self.name, cache_file))
             return roidb
 
-        gt_roidb = [self._load_imagenet_annotation(index)
-                    for index in self.image_index]
-        with open(cache_file, 'wb') as fid:
-            pickle.dump(gt_roidb, fid, pickle.HIGHEST_PROTOCOL)
+        gt_roidb = ds_utils.map_in_processes(self._load_imagenet_annotation, self.image_index)
+        ds_utils.dump_pickle_atomically(gt_roidb, cache_file)
         logger.info('Wrote gt roidb to {}.'.format(cache_file))
 
         return gt_roidb
 
+    def get_annotation_sources(self):
+        return [os.path.join(self._data_path, 'Annotations', self._image_set, index + '.xml')
+                for index in self.image_index]
+
     def _load_imagenet_annotation(self, index):
         """
         Load image and bounding boxes info from txt files of imagenet.
@@ -7,15 +7,32 @@
 from __future__ import absolute_import
 from __future__ import division
 
+import logging
+import pickle
+from concurrent.futures import ThreadPoolExecutor
+
 import PIL
 import numpy as np
 import os
 import os.path as osp
 import scipy.sparse
+
+import data_manager.classic_detection.datasets.ds_utils as ds_utils
 from model.utils.cython_bbox import bbox_overlaps
 
+logger = logging.getLogger(__name__)
+
 ROOT_DIR = osp.join(osp.dirname(__file__), '..', '..')
 
+# opening the images mostly waits on the storage
+_NUM_SIZE_READING_THREADS = 32
+
+
+def _read_image_size(image_path):
+    # PIL only reads the header of the image
+    with PIL.Image.open(image_path) as im:
+        return im.size
+
 
 class imdb(object):
     """Image database."""
@@ -32,6 +49,10 @@ class imdb(object):
         self._obj_proposer = 'gt'
         self._roidb = None
         self._roidb_handler = self.default_roidb
+        # (image path, file size, modification time) -> (width, height), see _read_image_sizes
+        self._image_sizes = None
+        self._annotation_fingerprint = None
+        self._image_fingerprint = None
         # Use this dict for storing dataset specific config options
         self.config = {}
 
@@ -106,9 +127,73 @@ class imdb(object):
         """
         raise NotImplementedError
 
+    def get_annotation_sources(self):
+        """Paths of the files the gt roidb is built from, or None if they are not known, in which case the
+        roidb caches can't be invalidated when the annotations change."""
+        return None
+
+    def get_annotation_fingerprint(self):
+        """Hash that changes whenever one of the annotation sources changes, or None."""
+        if self._annotation_fingerprint is None:
+            sources = self.get_annotation_sources()
+            if sources is not None:
+                self._annotation_fingerprint = ds_utils.get_files_fingerprint(sources)
+        return self._annotation_fingerprint
+
+    def _get_gt_roidb_cache_file(self):
+        """The gt roidb cache, which is specific to the current annotations when their sources are known."""
+        fingerprint = self.get_annotation_fingerprint()
+        if fingerprint is None:
+            return osp.join(self.cache_path, self.name + '_gt_roidb.pkl')
+        return osp.join(self.cache_path, '{}_gt_roidb_{}.pkl'.format(self.name, fingerprint))
+
+    def get_image_sources(self):
+        """Paths of the files the image sizes of the roidb are read from."""
+        return [self.image_path_at(i) for i in range(self.num_images)]
+
+    def get_image_fingerprint(self):
+        """Hash that changes whenever one of the image sources is replaced."""
+        if self._image_fingerprint is None:
+            self._image_fingerprint = ds_utils.get_files_fingerprint(self.get_image_sources())
+        return self._image_fingerprint
+
+    def get_image_sizes(self):
+        """(width, height) of every image."""
+        return self._read_image_sizes([self.image_path_at(i) for i in range(self.num_images)])
+
+    def _read_image_sizes(self, image_paths):
+        """(width, height) of the images at image_paths.
+
+        The images are opened once, in parallel, and their sizes are kept in the imdb cache for the later calls
+        and runs. They are keyed by the signature of the image files, so that a replaced image is read again.
+        """
+        cache_file = osp.join(self.cache_path, self.name + '_image_sizes_by_signature.pkl')
+        if self._image_sizes is None:
+            self._image_sizes = {}
+            if osp.exists(cache_file):
+                with open(cache_file, 'rb') as fid:
+                    self._image_sizes = pickle.load(fid)
+                logger.info('{} image sizes loaded from {}.'.format(self.name, cache_file))
+
+        # the flipped images share the path of their source image
+        unique_paths = sorted(set(image_paths))
+        signatures = dict(zip(unique_paths, ds_utils.get_file_signatures(unique_paths)))
+        missing_signatures = [signatures[path] for path in unique_paths if signatures[path] not in self._image_sizes]
+        if missing_signatures:
+            # the sizes of the previous versions of the replaced images
+            missing_paths = set(signature[0] for signature in missing_signatures)
+            for signature in [s for s in self._image_sizes if s[0] in missing_paths]:
+                del self._image_sizes[signature]
+            with ThreadPoolExecutor(max_workers=_NUM_SIZE_READING_THREADS) as executor:
+                sizes = executor.map(_read_image_size, [signature[0] for signature in missing_signatures])
+                for signature, size in zip(missing_signatures, sizes):
+                    self._image_sizes[signature] = size
+            ds_utils.dump_pickle_atomically(self._image_sizes, cache_file)
+            logger.info('Wrote the sizes of {} images to {}.'.format(len(missing_signatures), cache_file))
+        return [self._image_sizes[signatures[path]] for path in image_paths]
+
     def _get_widths(self):
-        return [PIL.Image.open(self.image_path_at(i)).size[0]
-                for i in range(self.num_images)]
+        return [width for width, _ in self.get_image_sizes()]
 
     def append_flipped_images(self):
         num_images = self.num_images
@@ -0,0 +1,133 @@
+"""imdb whose images and gt roidb are packed into a few large shard files (see pack_imdb)."""
+from __future__ import absolute_import
+from __future__ import division
+
+import logging
+import pickle
+
+import numpy as np
+import os
+
+from .ds_utils import dump_pickle_atomically
+from .imdb import imdb
+from .packed_shards import write_shards
+
+logger = logging.getLogger(__name__)
+
+PACKED_SUFFIX = '_packed'
+_INDEX_FILE = 'index.pkl'
+
+
+def get_pack_dir(source_name, data_dir):
+    return os.path.join(data_dir, 'packed', source_name)
+
+
+def pack_imdb(source_imdb, pack_dir, shard_max_bytes=1024 ** 3):
+    """Packs the encoded images of source_imdb into shards in pack_dir, and its gt roidb into an index next to them.
+
+    The images are written in aspect ratio order, so that the images of a training batch (see rank_roidb_ratio)
+    are close to each other in the shards.
+    """
+    if not os.path.exists(pack_dir):
+        os.makedirs(pack_dir)
+    num_images = source_imdb.num_images
+    image_paths = [source_imdb.image_path_at(i) for i in range(num_images)]
+    image_sizes = source_imdb.get_image_sizes()
+    gt_roidb = source_imdb.gt_roidb()
+
+    ratios = np.array([width / float(height) for width, height in image_sizes])
+    packed_order = np.argsort(ratios, kind='mergesort')
+    packed_records = write_shards([image_paths[i] for i in packed_order], pack_dir, shard_max_bytes)
+    records = [None] * num_images
+    for i, record in zip(packed_order, packed_records):
+        records[i] = record
+
+    index = {'classes': source_imdb.classes,
+             'image_index': list(source_imdb.image_index),
+             'image_ids': [source_imdb.image_id_at(i) for i in range(num_images)],
+             'image_paths': image_paths,
+             'image_sizes': image_sizes,
+             'records': records,
+             'gt_roidb': gt_roidb}
+    dump_pickle_atomically(index, os.path.join(pack_dir, _INDEX_FILE))
+    logger.info('Packed {} images of {} into {} shards in {}.'.format(
+        num_images, source_imdb.name, len(set(r[0] for r in records)), pack_dir))
+
+
+class packed_imdb(imdb):
+    """The imdb source_name, read from the pack written by pack_imdb in get_pack_dir(source_name, data_dir).
+
+    Its roidb entries locate their image with an 'image_record' (see read_record), 'image' keeps the path of the
+    source image. The detections are evaluated by the source imdb, which needs the source annotations.
+    """
+
+    def __init__(self, source_name, data_dir, pack_dir=None):
+        imdb.__init__(self, source_name + PACKED_SUFFIX, data_dir=data_dir)
+        self._source_name = source_name
+        self._pack_dir = get_pack_dir(source_name, data_dir) if pack_dir is None else pack_dir
+        index_path = os.path.join(self._pack_dir, _INDEX_FILE)
+        assert os.path.exists(index_path), \
+            'Pack index does not exist: {}, see demos/pack_dataset.py'.format(index_path)
+        with open(index_path, 'rb') as f:
+            self._index = pickle.load(f)
+        self._classes = self._index['classes']
+        self._image_index = list(self._index['image_index'])
+        self._num_packed_images = len(self._image_index)
+        self._roidb_handler = self.gt_roidb
+        self._source_imdb = None
+        self._competition_mode = False
+
+    def get_annotation_sources(self):
+        return [os.path.join(self._pack_dir, _INDEX_FILE)]
+
+    def get_image_sources(self):
+        # the image sizes are read from the index
+        return []
+
+    def _packed_position(self, i):
+        # flipped images (appended after the packed ones) share the record of their source image
+        return i % self._num_packed_images
+
+    def image_path_at(self, i):
+        return self._index['image_paths'][self._packed_position(i)]
+
+    def image_id_at(self, i):
+        return self._index['image_ids'][self._packed_position(i)]
+
+    def image_record_at(self, i):
+        shard_file_name, offset, length = self._index['records'][self._packed_position(i)]
+        return os.path.join(self._pack_dir, shard_file_name), offset, length
+
+    def gt_roidb(self):
+        gt_roidb = []
+        for i, entry in enumerate(self._index['gt_roidb']):
+            entry = dict(entry)
+            entry['width'], entry['height'] = self._index['image_sizes'][i]
+            entry['image_record'] = self.image_record_at(i)
+            gt_roidb.append(entry)
+        return gt_roidb
+
+    def get_image_sizes(self):
+        return [self._index['image_sizes'][self._packed_position(i)] for i in range(self.num_images)]
+
+    def append_flipped_images(self):
+        imdb.append_flipped_images(self)
+        for i in range(self._num_packed_images, self.num_images):
+            entry = self.roidb[i]
+            entry['width'], entry['height'] = self._index['image_sizes'][self._packed_position(i)]
+            entry['image_record'] = self.image_record_at(i)
+
+    def _get_source_imdb(self):
+        if self._source_imdb is None:
+            from .factory import get_imdb
+            self._source_imdb = get_imdb(self._source_name, data_dir=self._data_dir)
+            self._source_imdb.competition_mode(self._competition_mode)
+        return self._source_imdb
+
+    def evaluate_detections(self, all_boxes, output_dir=None):
+        return self._get_source_imdb().evaluate_detections(all_boxes, output_dir)
+
+    def competition_mode(self, on):
+        self._competition_mode = on
+        if self._source_imdb is not None:
+            self._source_imdb.competition_mode(on)
@@ -0,0 +1,52 @@
+"""Shard files packing many encoded images (or any byte strings) one after the other.
+
+A record (shard_path, offset, length) locates one of them, so that it is read with a single pread of an already
+opened shard instead of an open and a seek per file.
+"""
+from __future__ import absolute_import
+
+import os
+
+_SHARD_FILE_FORMAT = 'shard_{:05d}.bin'
+
+# shard path -> file descriptor, opened once per process. pread doesn't move the offset of the descriptor,
+# so the descriptors inherited by forked data loader workers can be shared
+_shard_fds = {}
+
+
+def write_shards(paths, pack_dir, shard_max_bytes):
+    """Copies the files at paths, in order, into shards of about shard_max_bytes in pack_dir.
+
+    Returns the (shard file name, offset, length) of every file.
+    """
+    records = []
+    shard_id, shard_file, offset = -1, None, 0
+    try:
+        for path in paths:
+            with open(path, 'rb') as f:
+                data = f.read()
+            if shard_file is None or (offset > 0 and offset + len(data) > shard_max_bytes):
+                if shard_file is not None:
+                    shard_file.close()
+                shard_id += 1
+                shard_file = open(os.path.join(pack_dir, _SHARD_FILE_FORMAT.format(shard_id)), 'wb')
+                offset = 0
+            shard_file.write(data)
+            records.append((_SHARD_FILE_FORMAT.format(shard_id), offset, len(data)))
+            offset += len(data)
+    finally:
+        if shard_file is not None:
+            shard_file.close()
+    return records
+
+
+def read_record(record):
+    """The bytes of record (shard_path, offset, length)."""
+    shard_path, offset, length = record
+    fd = _shard_fds.get(shard_path)
+    if fd is None:
+        fd = _shard_fds[shard_path] = os.open(shard_path, os.O_RDONLY)
+    data = os.pread(fd, length, offset)
+    if len(data) != length:
+        raise IOError('Truncated record of {} bytes at {} in {}.'.format(length, offset, shard_path))
+    return data
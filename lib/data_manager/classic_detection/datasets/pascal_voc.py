@@ -93,6 +93,11 @@ class pascal_voc(imdb):
             image_index = [x.strip() for x in f.readlines()]
         return image_index
 
+    def get_annotation_sources(self):
+        image_set_file = os.path.join(self._data_path, 'ImageSets', 'Main', self._image_set + '.txt')
+        return [image_set_file] + [os.path.join(self._data_path, 'Annotations', index + '.xml')
+                                   for index in self.image_index]
+
     def _get_default_path(self):
         """
         Return the default path where PASCAL VOC is expected to be installed.
@@ -105,17 +110,15 @@ class pascal_voc(imdb):
 
         This function loads/saves from/to a cache file to speed up future calls.
         """
-        cache_file = os.path.join(self.cache_path, self.name + '_gt_roidb.pkl')
+        cache_file = self._get_gt_roidb_cache_file()
         if os.path.exists(cache_file):
             with open(cache_file, 'rb') as fid:
                 roidb = pickle.load(fid)
             logger.info('{} gt roidb loaded from {}.'.format(self.name, cache_file))
             return roidb
 
-        gt_roidb = [self._load_pascal_annotation(index)
-                    for index in self.image_index]
-        with open(cache_file, 'wb') as fid:
-            pickle.dump(gt_roidb, fid, pickle.HIGHEST_PROTOCOL)
+        gt_roidb = ds_utils.map_in_processes(self._load_pascal_annotation, self.image_index)
+        ds_utils.dump_pickle_atomically(gt_roidb, cache_file)
         logger.info('Wrote gt roidb to {}.'.format(cache_file))
 
         return gt_roidb
@@ -142,8 +145,7 @@ class pascal_voc(imdb):
             roidb = imdb.merge_roidbs(gt_roidb, ss_roidb)
         else:
             roidb = self._load_selective_search_roidb(None)
-        with open(cache_file, 'wb') as fid:
-            pickle.dump(roidb, fid, pickle.HIGHEST_PROTOCOL)
+        ds_utils.dump_pickle_atomically(roidb, cache_file)
         logger.info('Wrote ss roidb to {}.'.format(cache_file))
 
         return roidb
@@ -4,11 +4,11 @@ import gzip
 import pickle
 import xml.etree.ElementTree as ET
 import logging
-import PIL
 import numpy as np
 import os
 import scipy.sparse
 
+from data_manager.classic_detection.datasets import ds_utils
 from data_manager.classic_detection.datasets.imdb import imdb
 from .vg_eval import vg_eval
 
@@ -85,10 +85,10 @@ class vg(imdb):
 
         if not load_index_from_file or not load_id_from_file:
             self._image_index, self._id_to_dir = self._load_image_set_index()
-            with open(os.path.join(self._data_path, "vg_image_index_{}.p".format(self._image_set)), 'wb') as fp:
-                pickle.dump(self._image_index, fp)
-            with open(os.path.join(self._data_path, "vg_id_to_dir_{}.p".format(self._image_set)), 'wb') as fp:
-                pickle.dump(self._id_to_dir, fp)
+            ds_utils.dump_pickle_atomically(
+                self._image_index, os.path.join(self._data_path, "vg_image_index_{}.p".format(self._image_set)))
+            ds_utils.dump_pickle_atomically(
+                self._id_to_dir, os.path.join(self._data_path, "vg_id_to_dir_{}.p".format(self._image_set)))
 
         self._roidb_handler = self.gt_roidb
 
@@ -145,33 +145,44 @@ class vg(imdb):
             elif self._image_set == "smallval":
                 metadata = metadata[:2000]
 
-        image_index = []
-        id_to_dir = {}
+        image_files = []
+        image_ids = []
         for line in metadata:
             im_file, ann_file = line.split()
-            image_id = int(ann_file.split('/')[-1].split('.')[0])
-            filename = self._annotation_path(image_id)
-            if os.path.exists(filename):
-                # Some images have no bboxes after object filtering, so there
-                # is no xml annotation for these.
-                tree = ET.parse(filename)
-                for obj in tree.findall('object'):
-                    obj_name = obj.find('name').text.lower().strip()
-                    if obj_name in self._class_to_ind:
-                        # We have to actually load and check these to make sure they have
-                        # at least one object actually in vocab
-                        image_index.append(image_id)
-                        id_to_dir[image_id] = im_file.split('/')[0]
-                        break
+            image_files.append(im_file)
+            image_ids.append(int(ann_file.split('/')[-1].split('.')[0]))
+
+        has_vocab_objects = ds_utils.map_in_processes(self._has_vocab_objects, image_ids)
+        image_index = []
+        id_to_dir = {}
+        for im_file, image_id, has_vocab_object in zip(image_files, image_ids, has_vocab_objects):
+            if has_vocab_object:
+                image_index.append(image_id)
+                id_to_dir[image_id] = im_file.split('/')[0]
         return image_index, id_to_dir
 
+    def _has_vocab_objects(self, image_id):
+        filename = self._annotation_path(image_id)
+        if not os.path.exists(filename):
+            # Some images have no bboxes after object filtering, so there
+            # is no xml annotation for these.
+            return False
+        tree = ET.parse(filename)
+        for obj in tree.findall('object'):
+            obj_name = obj.find('name').text.lower().strip()
+            if obj_name in self._class_to_ind:
+                # We have to actually load and check these to make sure they have
+                # at least one object actually in vocab
+                return True
+        return False
+
     def gt_roidb(self):
         """
         Return the database of ground-truth regions of interest.
 
         This function loads/saves from/to a cache file to speed up future calls.
         """
-        cache_file = os.path.join(self.cache_path, self.name + '_gt_roidb.pkl')
+        cache_file = self._get_gt_roidb_cache_file()
         if os.path.exists(cache_file):
             fid = gzip.open(cache_file, 'rb')
             roidb = pickle.load(fid)
@@ -179,16 +190,20 @@ class vg(imdb):
             logger.info('{} gt roidb loaded from {}.'.format(self.name, cache_file))
             return roidb
 
-        gt_roidb = [self._load_vg_annotation(index)
-                    for index in self.image_index]
-        fid = gzip.open(cache_file, 'wb')
-        pickle.dump(gt_roidb, fid, pickle.HIGHEST_PROTOCOL)
-        fid.close()
+        # reads the sizes of all the images at once, in parallel
+        self._read_image_sizes([self.image_path_from_index(index) for index in self.image_index])
+        gt_roidb = ds_utils.map_in_processes(self._load_vg_annotation, self.image_index)
+        ds_utils.dump_pickle_atomically(gt_roidb, cache_file, open_fn=gzip.open)
         logger.info('Wrote gt roidb to {}.'.format(cache_file))
         return gt_roidb
 
+    def get_annotation_sources(self):
+        vocab_files = [os.path.join(self._data_path, self._version, vocab_file)
+                       for vocab_file in ['objects_vocab.txt', 'attributes_vocab.txt', 'relations_vocab.txt']]
+        return vocab_files + [self._image_split_path()] + [self._annotation_path(index) for index in self.image_index]
+
     def _get_size(self, index):
-        return PIL.Image.open(self.image_path_from_index(index)).size
+        return self._read_image_sizes([self.image_path_from_index(index)])[0]
 
     def _annotation_path(self, index):
         return os.path.join(self._data_path, 'xml', str(index) + '.xml')
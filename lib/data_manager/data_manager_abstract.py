@@ -36,6 +36,7 @@ class DataManager(ABC):
         self._im_data, self._im_info, self._gt_boxes, self._num_boxes = create_input_tensors()
 
         self._data_iter = None
+        self._batch_keys = None
 
     @abstractmethod
     def transform_data_tensors(self, data):
@@ -70,5 +71,11 @@ class DataManager(ABC):
     def data_loader(self):
         raise NotImplementedError
 
+    @property
+    def batch_keys(self):
+        """Keys identifying the input images of the last batch (e.g. for caching their features), if the data
+        manager provides them."""
+        return self._batch_keys
+
     def prepare_iter_for_new_epoch(self):
         self._data_iter = iter(self.data_loader)
@@ -0,0 +1,152 @@
+"""A read-only roidb stored in columns of memory mapped .npy files."""
+from __future__ import absolute_import
+from __future__ import division
+
+import hashlib
+import logging
+import shutil
+
+import numpy as np
+import os
+
+logger = logging.getLogger(__name__)
+
+
+def get_is_crowd(entry):
+    """Boolean array of the crowd boxes of the roidb entry."""
+    # crowd boxes (coco) have an overlap of -1 with all the classes
+    if entry.get('gt_overlaps') is None:
+        return np.zeros(len(entry['boxes']), dtype=bool)
+    return np.any(entry['gt_overlaps'].toarray() <= -1.0, axis=1)
+
+
+def _encode_strings(strings):
+    # bytes take a quarter of the space of numpy unicode strings
+    return np.array([s.encode('utf-8') for s in strings])
+
+
+def _to_columns(roidb):
+    # the image columns have a row per image, the box columns (boxes, gt_classes and is_crowd) a row per box:
+    # the boxes of image i are the rows box_offsets[i]:box_offsets[i + 1]
+    columns = {
+        'width': np.array([entry['width'] for entry in roidb], dtype=np.int32),
+        'height': np.array([entry['height'] for entry in roidb], dtype=np.int32),
+        'flipped': np.array([entry['flipped'] for entry in roidb], dtype=bool),
+        'need_crop': np.array([entry['need_crop'] for entry in roidb], dtype=bool),
+        'img_id': np.array([entry['img_id'] for entry in roidb]),
+        'image': _encode_strings([entry['image'] for entry in roidb]),
+        'box_offsets': np.concatenate(([0], np.cumsum([len(entry['boxes']) for entry in roidb]))).astype(np.int64),
+        'boxes': np.concatenate([np.asarray(entry['boxes'], dtype=np.float32).reshape(-1, 4) for entry in roidb]),
+        'gt_classes': np.concatenate([np.asarray(entry['gt_classes'], dtype=np.int32) for entry in roidb]),
+        'is_crowd': np.concatenate([get_is_crowd(entry) for entry in roidb]),
+    }
+    records = [entry.get('image_record') for entry in roidb]
+    if any(record is not None for record in records):
+        # packed images (see packed_imdb), the shard paths are stored once. A combined roidb may mix packed and
+        # loose images, the records of the loose ones have shard -1
+        shards = sorted(set(record[0] for record in records if record is not None))
+        shard_ids = {shard: i for i, shard in enumerate(shards)}
+        records = [(-1, 0, 0) if record is None else (shard_ids[record[0]], record[1], record[2])
+                   for record in records]
+        columns['record_shard'] = np.array([record[0] for record in records], dtype=np.int32)
+        columns['record_offset'] = np.array([record[1] for record in records], dtype=np.int64)
+        columns['record_length'] = np.array([record[2] for record in records], dtype=np.int64)
+        columns['record_shards'] = _encode_strings(shards)
+    return columns
+
+
+class ColumnarRoidb(object):
+    """Read-only roidb whose images and boxes are concatenated into columns, read memory mapped from roidb_dir.
+
+    Indexing it gives the dict entry of an image, as in a list of dicts roidb, with the columns needed to train
+    and predict ('gt_overlaps' becomes the per box 'is_crowd'). The data loader workers share the pages of the
+    columns instead of unpickling a copy of every entry, and only roidb_dir is pickled.
+    Arrays written along with the roidb (e.g. its aspect ratio order) are read with column.
+    """
+
+    def __init__(self, roidb_dir):
+        self.roidb_dir = roidb_dir
+        self._columns = {}
+        for file_name in os.listdir(roidb_dir):
+            if file_name.endswith('.npy'):
+                # plain read-only arrays over the memory maps
+                column = np.load(os.path.join(roidb_dir, file_name), mmap_mode='r')
+                self._columns[file_name[:-len('.npy')]] = np.asarray(column)
+        self._has_records = 'record_shards' in self._columns
+        if self._has_records:
+            self._record_shards = [s.decode('utf-8') for s in self._columns['record_shards']]
+
+    @classmethod
+    def write(cls, roidb, roidb_dir, **arrays):
+        """Writes the list of dicts roidb and arrays to roidb_dir.
+
+        Several processes may write roidb_dir at once, readers never see it partially written.
+        """
+        columns = _to_columns(roidb)
+        columns.update(arrays)
+        cls._write_columns(columns, roidb_dir)
+        return cls(roidb_dir)
+
+    @classmethod
+    def from_roidb(cls, roidb, cache_dir, name, **arrays):
+        """Writes the list of dicts roidb and arrays to a sub directory of cache_dir, named after name and their
+        content. The directory is reused when it exists.
+        """
+        columns = _to_columns(roidb)
+        columns.update(arrays)
+        content_hash = hashlib.sha1()
+        for column_name in sorted(columns):
+            content_hash.update(column_name.encode('utf-8'))
+            content_hash.update(np.ascontiguousarray(columns[column_name]).tobytes())
+        roidb_dir = os.path.join(cache_dir, '{}_{}'.format(name, content_hash.hexdigest()[:16]))
+        if not os.path.exists(roidb_dir):
+            cls._write_columns(columns, roidb_dir)
+        return cls(roidb_dir)
+
+    @staticmethod
+    def _write_columns(columns, roidb_dir):
+        # written to a temporary directory first, so that readers never see a partial roidb
+        tmp_dir = '{}.{}.tmp'.format(roidb_dir, os.getpid())
+        os.makedirs(tmp_dir)
+        for column_name, column in columns.items():
+            np.save(os.path.join(tmp_dir, column_name + '.npy'), column)
+        try:
+            os.rename(tmp_dir, roidb_dir)
+            logger.info('Wrote columnar roidb of {} images to {}.'.format(len(columns['width']), roidb_dir))
+        except OSError:
+            # written by another process in the meantime
+            shutil.rmtree(tmp_dir)
+
+    def __getstate__(self):
+        return {'roidb_dir': self.roidb_dir}
+
+    def __setstate__(self, state):
+        self.__init__(state['roidb_dir'])
+
+    def column(self, name):
+        """The column name, with a row per image or per box."""
+        return self._columns[name]
+
+    def __len__(self):
+        return len(self._columns['width'])
+
+    def __getitem__(self, i):
+        columns = self._columns
+        box_start, box_end = columns['box_offsets'][i], columns['box_offsets'][i + 1]
+        entry = {'width': int(columns['width'][i]),
+                 'height': int(columns['height'][i]),
+                 'flipped': bool(columns['flipped'][i]),
+                 'need_crop': int(columns['need_crop'][i]),
+                 'img_id': columns['img_id'][i].item(),
+                 'image': columns['image'][i].decode('utf-8'),
+                 'boxes': columns['boxes'][box_start:box_end],
+                 'gt_classes': columns['gt_classes'][box_start:box_end],
+                 'is_crowd': columns['is_crowd'][box_start:box_end]}
+        if self._has_records and columns['record_shard'][i] >= 0:
+            entry['image_record'] = (self._record_shards[columns['record_shard'][i]],
+                                     int(columns['record_offset'][i]), int(columns['record_length'][i]))
+        return entry
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
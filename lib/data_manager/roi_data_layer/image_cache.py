@@ -0,0 +1,68 @@
+"""Cache of the decoded and resized input images of the data loaders."""
+from __future__ import absolute_import
+from __future__ import division
+
+import numpy as np
+
+from utils.npy_file_cache import NpyFileCache, RamCache
+
+IMAGE_CACHE_DTYPES = ['uint8', 'float16']
+
+
+def is_image_cache_enabled(cfg):
+    """Whether one of the tiers of the ImageCache is enabled in cfg."""
+    return int(cfg.image_cache_ram_gb * 1024 ** 3) > 0 or bool(cfg.image_cache_dir)
+
+
+def create_image_cache(cfg):
+    """The ImageCache configured in cfg, or None when both of its tiers are disabled."""
+    if not is_image_cache_enabled(cfg):
+        return None
+    ram_max_bytes = int(cfg.image_cache_ram_gb * 1024 ** 3)
+    return ImageCache(ram_max_bytes, cfg.image_cache_dir or None, int(cfg.image_cache_disk_gb * 1024 ** 3),
+                      cfg.image_cache_dtype)
+
+
+class ImageCache(object):
+    """Decoded, flipped and resized images (BGR, before the mean subtraction), in two tiers.
+
+    Images are looked up in RAM first (every data loader worker holds its own ram_max_bytes), then in cache_dir,
+    which all the workers and training processes share. Both tiers evict the least recently used images first.
+    Images are stored as dtype, 'uint8' rounds the resized pixel values.
+    """
+
+    def __init__(self, ram_max_bytes, cache_dir=None, disk_max_bytes=0, dtype='uint8'):
+        if dtype not in IMAGE_CACHE_DTYPES:
+            raise ValueError("Not valid image cache dtype {} - should be one of {}".format(dtype, IMAGE_CACHE_DTYPES))
+        self.dtype = dtype
+        self._ram_cache = RamCache(ram_max_bytes) if ram_max_bytes > 0 else None
+        self._disk_cache = NpyFileCache(cache_dir, disk_max_bytes) if cache_dir else None
+
+    @staticmethod
+    def get_key(image_signature, flipped, target_size, max_size):
+        """image_signature (see get_image_signature) changes with the image file, so that the disk tier never serves
+        a replaced image."""
+        return '{}|{}|{}|{}'.format(image_signature, int(flipped), target_size, max_size)
+
+    def get(self, key):
+        """The cached image of key as float32, or None."""
+        im = None
+        if self._ram_cache is not None:
+            im = self._ram_cache.get(key)
+        if im is None and self._disk_cache is not None:
+            im = self._disk_cache.get(key)
+            if im is not None and self._ram_cache is not None:
+                self._ram_cache.put(key, im)
+        return None if im is None else im.astype(np.float32)
+
+    def put(self, key, im):
+        """Caches the float image im, and returns it as get will (i.e. rounded for 'uint8')."""
+        if self.dtype == 'uint8':
+            stored_im = np.clip(np.round(im), 0, 255).astype(np.uint8)
+        else:
+            stored_im = im.astype(np.float16)
+        if self._ram_cache is not None:
+            self._ram_cache.put(key, stored_im)
+        if self._disk_cache is not None:
+            self._disk_cache.put(key, stored_im)
+        return stored_im.astype(np.float32)
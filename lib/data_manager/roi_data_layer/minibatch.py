@@ -9,16 +9,21 @@
 from __future__ import absolute_import
 from __future__ import division
 
+import io
+import os
+
 import numpy as np
 import numpy.random as npr
 from scipy.misc import imread
 
+from data_manager.classic_detection.datasets.packed_shards import read_record
 from model.utils.blob import prep_im_for_blob, im_list_to_blob
 
 
 def get_minibatch(roidb, num_classes,
-                  batch_size, scales, use_all_gt, pixel_mean, max_size):
-    """Given a roidb, construct a minibatch sampled from it."""
+                  batch_size, scales, use_all_gt, pixel_mean, max_size, image_cache=None):
+    """Given a roidb, construct a minibatch sampled from it.
+    The resized images are looked up in (and added to) image_cache, if given."""
     num_images = len(roidb)
     # Sample random scales to use for each image in this batch
     random_scale_inds = npr.randint(0, high=len(scales), size=num_images)
@@ -26,7 +31,7 @@ def get_minibatch(roidb, num_classes,
         'num_images ({}) must divide BATCH_SIZE ({})'.format(num_images, batch_size)
 
     # Get the input image blob, formatted for caffe
-    im_blob, im_scales = _get_image_blob(roidb, random_scale_inds, scales, pixel_mean, max_size)
+    im_blob, im_scales = _get_image_blob(roidb, random_scale_inds, scales, pixel_mean, max_size, image_cache)
 
     blobs = {'data': im_blob}
 
@@ -39,7 +44,12 @@ def get_minibatch(roidb, num_classes,
         gt_inds = np.where(roidb[0]['gt_classes'] != 0)[0]
     else:
         # For the COCO ground truth boxes, exclude the ones that are ''iscrowd''
-        gt_inds = np.where((roidb[0]['gt_classes'] != 0) & np.all(roidb[0]['gt_overlaps'].toarray() > -1.0, axis=1))[0]
+        if 'is_crowd' in roidb[0]:
+            # a ColumnarRoidb entry
+            is_crowd = roidb[0]['is_crowd']
+        else:
+            is_crowd = ~np.all(roidb[0]['gt_overlaps'].toarray() > -1.0, axis=1)
+        gt_inds = np.where((roidb[0]['gt_classes'] != 0) & ~is_crowd)[0]
     gt_boxes = np.empty((len(gt_inds), 5), dtype=np.float32)
     gt_boxes[:, 0:4] = roidb[0]['boxes'][gt_inds, :] * im_scales[0]
     gt_boxes[:, 4] = roidb[0]['gt_classes'][gt_inds]
@@ -53,7 +63,7 @@ def get_minibatch(roidb, num_classes,
     return blobs
 
 
-def _get_image_blob(roidb, scale_inds, scales, pixel_mean, max_size):
+def _get_image_blob(roidb, scale_inds, scales, pixel_mean, max_size, image_cache=None):
     """Builds an input blob from the images in the roidb at the specified
     scales.
     """
@@ -62,19 +72,12 @@ def _get_image_blob(roidb, scale_inds, scales, pixel_mean, max_size):
     processed_ims = []
     im_scales = []
     for i in range(num_images):
-        im = imread(roidb[i]['image'])
-
-        if len(im.shape) == 2:
-            im = im[:, :, np.newaxis]
-            im = np.concatenate((im, im, im), axis=2)
-        # flip the channel, since the original one using cv2
-        # rgb -> bgr
-        im = im[:, :, ::-1]
-
-        if roidb[i]['flipped']:
-            im = im[:, ::-1, :]
         target_size = scales[scale_inds[i]]
-        im, im_scale = prep_im_for_blob(im, pixel_mean, target_size, max_size)
+        if image_cache is None:
+            im, im_scale = prep_im_for_blob(_read_image(roidb[i]), pixel_mean, target_size, max_size)
+        else:
+            im, im_scale = _get_cached_image(roidb[i], target_size, max_size, image_cache)
+            im -= pixel_mean
         im_scales.append(im_scale)
         processed_ims.append(im)
 
@@ -82,3 +85,44 @@ def _get_image_blob(roidb, scale_inds, scales, pixel_mean, max_size):
     blob = im_list_to_blob(processed_ims)
 
     return blob, im_scales
+
+
+def get_image_signature(roidb_entry):
+    """Identifies the file content the image of roidb_entry is read from, and changes when it is replaced."""
+    if 'image_record' in roidb_entry:
+        shard_path, offset, length = roidb_entry['image_record']
+        location = '{}:{}:{}'.format(shard_path, offset, length)
+    else:
+        shard_path = location = roidb_entry['image']
+    file_stat = os.stat(shard_path)
+    return '{}|{}|{}'.format(location, file_stat.st_size, file_stat.st_mtime_ns)
+
+
+def _read_image(roidb_entry):
+    if 'image_record' in roidb_entry:
+        # packed into a shard (see packed_imdb)
+        im = imread(io.BytesIO(read_record(roidb_entry['image_record'])))
+    else:
+        im = imread(roidb_entry['image'])
+
+    if len(im.shape) == 2:
+        im = im[:, :, np.newaxis]
+        im = np.concatenate((im, im, im), axis=2)
+    # flip the channel, since the original one using cv2
+    # rgb -> bgr
+    im = im[:, :, ::-1]
+
+    if roidb_entry['flipped']:
+        im = im[:, ::-1, :]
+    return im
+
+
+def _get_cached_image(roidb_entry, target_size, max_size, image_cache):
+    """The resized image of roidb_entry before the mean subtraction, and its scale."""
+    key = image_cache.get_key(get_image_signature(roidb_entry), roidb_entry['flipped'], target_size, max_size)
+    im = image_cache.get(key)
+    if im is not None:
+        # the scale prep_im_for_blob computed when the image was cached
+        return im, float(target_size) / float(min(roidb_entry['height'], roidb_entry['width']))
+    im, im_scale = prep_im_for_blob(_read_image(roidb_entry), 0., target_size, max_size)
+    return image_cache.put(key, im), im_scale
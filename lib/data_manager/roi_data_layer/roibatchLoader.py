@@ -8,7 +8,8 @@ import numpy as np
 import torch
 import torch.utils.data as data
 
-from data_manager.roi_data_layer.minibatch import get_minibatch
+from data_manager.roi_data_layer.image_cache import create_image_cache
+from data_manager.roi_data_layer.minibatch import get_image_signature, get_minibatch
 
 
 class roiBatchLoader(data.Dataset):
@@ -25,6 +26,7 @@ class roiBatchLoader(data.Dataset):
         self.ratio_index = ratio_index
         self.batch_size = batch_size
         self.data_size = len(self.ratio_list)
+        self._image_cache = create_image_cache(cfg)
 
         # given the ratio_list, we want to make the ratio same for each batch.
         self.ratio_list_batch = torch.Tensor(self.data_size).zero_()
@@ -45,11 +47,15 @@ class roiBatchLoader(data.Dataset):
 
             self.ratio_list_batch[left_idx:(right_idx + 1)] = target_ratio
 
+    def roidb_index_at(self, index):
+        # batched inference walks the roidb in aspect ratio order, so that the
+        # images of each batch need as little padding as possible.
+        if self.training or self.batch_size > 1:
+            return int(self.ratio_index[index])
+        return index
+
     def __getitem__(self, index):
-        if self.training:
-            index_ratio = int(self.ratio_index[index])
-        else:
-            index_ratio = index
+        index_ratio = self.roidb_index_at(index)
 
         # get the anchor index for current sample index
         # here we set the anchor index to the last one
@@ -58,7 +64,7 @@ class roiBatchLoader(data.Dataset):
         blobs = get_minibatch(minibatch_db, self._num_classes,
                               self.cfg.TRAIN.batch_size, self.cfg.TRAIN.SCALES,
                               self.cfg.TRAIN.USE_ALL_GT,
-                              self.cfg.PIXEL_MEANS, self.cfg.TRAIN.MAX_SIZE)
+                              self.cfg.PIXEL_MEANS, self.cfg.TRAIN.MAX_SIZE, self._image_cache)
         data = torch.from_numpy(blobs['data'])
         im_info = torch.from_numpy(blobs['im_info'])
         # we need to random shuffle the bounding box.
@@ -78,6 +84,7 @@ class roiBatchLoader(data.Dataset):
 
             # if the image need to crop, crop to the target size.
             ratio = self.ratio_list_batch[index]
+            crop_start = 0
 
             if self._roidb[index_ratio]['need_crop']:
                 if ratio < 1:
@@ -107,6 +114,7 @@ class roiBatchLoader(data.Dataset):
                                 y_s = np.random.choice(range(min_y, min_y + y_s_add))
                     # crop the image
                     data = data[:, y_s:(y_s + trim_size), :, :]
+                    crop_start = y_s
 
                     # shift y coordiante of gt_boxes
                     gt_boxes[:, 1] = gt_boxes[:, 1] - float(y_s)
@@ -143,6 +151,7 @@ class roiBatchLoader(data.Dataset):
                                 x_s = np.random.choice(range(min_x, min_x + x_s_add))
                     # crop the image
                     data = data[:, :, x_s:(x_s + trim_size), :]
+                    crop_start = x_s
 
                     # shift x coordiante of gt_boxes
                     gt_boxes[:, 0] = gt_boxes[:, 0] - float(x_s)
@@ -189,7 +198,13 @@ class roiBatchLoader(data.Dataset):
             padding_data = padding_data.permute(2, 0, 1).contiguous()
             im_info = im_info.view(3)
 
-            return padding_data, im_info, gt_boxes_padding, num_boxes
+            # identifies the exact input image (image file, flip, scale, crop and padding), e.g. for caching its
+            # features. Images that need a crop are cropped at random, so they repeat less often
+            cache_key = '{}|{}|{:.6f}|{}|{}x{}'.format(
+                get_image_signature(self._roidb[index_ratio]), int(self._roidb[index_ratio]['flipped']),
+                float(blobs['im_info'][0, 2]), crop_start, padding_data.size(1), padding_data.size(2))
+
+            return padding_data, im_info, gt_boxes_padding, num_boxes, cache_key
 
         else:
             data = data.permute(0, 3, 1, 2).contiguous().view(3, data_height, data_width)
@@ -200,3 +215,22 @@ class roiBatchLoader(data.Dataset):
 
     def __len__(self):
         return len(self._roidb)
+
+
+def collate_padded_batch(batch):
+    """Collate inference samples of different sizes into a single batch.
+
+    Every image is zero-padded (bottom and right) to the largest height and width
+    in the batch, im_info keeps the original size of each image so proposals are
+    still clipped to the real image boundaries.
+    """
+    max_height = max(sample[0].size(1) for sample in batch)
+    max_width = max(sample[0].size(2) for sample in batch)
+    padded_data = torch.FloatTensor(len(batch), 3, max_height, max_width).zero_()
+    for i, sample in enumerate(batch):
+        data = sample[0]
+        padded_data[i, :, :data.size(1), :data.size(2)] = data
+    im_info = torch.stack([sample[1] for sample in batch], 0)
+    gt_boxes = torch.stack([sample[2] for sample in batch], 0)
+    num_boxes = torch.LongTensor([sample[3] for sample in batch])
+    return padded_data, im_info, gt_boxes, num_boxes
@@ -2,16 +2,23 @@
 from __future__ import absolute_import
 from __future__ import division
 
+import copy
+import hashlib
 import logging
 
-import PIL
 import numpy as np
+import os
 
 import data_manager.classic_detection.datasets.imdb as dataset_imdb
 from data_manager.classic_detection.datasets.factory import get_imdb
+from data_manager.roi_data_layer.columnar_roidb import ColumnarRoidb, get_is_crowd
 
 logger = logging.getLogger(__name__)
 
+# to be increased whenever the roidb preparation (flipping, prepare_roidb, filter_roidb, rank_roidb_ratio) changes,
+# so that the cached roidbs are rebuilt
+_ROIDB_CACHE_VERSION = 1
+
 
 def prepare_roidb(imdb):
     """Enrich the imdb's roidb by adding some derived quantities that
@@ -22,14 +29,15 @@ def prepare_roidb(imdb):
     """
 
     roidb = imdb.roidb
-    if not (imdb.name.startswith('coco')):
-        sizes = [PIL.Image.open(imdb.image_path_at(i)).size
-                 for i in range(imdb.num_images)]
+    # the sizes are read from the images, unless the imdb already has them (e.g. coco, from its annotations)
+    read_sizes = not all('width' in entry and 'height' in entry for entry in roidb)
+    if read_sizes:
+        sizes = imdb.get_image_sizes()
 
     for i in range(len(imdb.image_index)):
         roidb[i]['img_id'] = imdb.image_id_at(i)
         roidb[i]['image'] = imdb.image_path_at(i)
-        if not (imdb.name.startswith('coco')):
+        if read_sizes:
             roidb[i]['width'] = sizes[i][0]
             roidb[i]['height'] = sizes[i][1]
         # need gt_overlaps as a dense array for argmax
@@ -49,50 +57,129 @@ def prepare_roidb(imdb):
         assert all(max_classes[nonzero_inds] != 0)
 
 
+def get_roidb_arrays(roidb, with_boxes=False):
+    """Arrays of the 'width', 'height' and 'num_boxes' of every image of roidb, in a single pass over its entries.
+
+    with_boxes adds the box columns 'boxes' (concatenated, as float32) and 'is_crowd', and 'box_image' (the
+    position in roidb of the image of every box).
+    """
+    num_images = len(roidb)
+    arrays = {'width': np.empty(num_images, dtype=np.int64),
+              'height': np.empty(num_images, dtype=np.int64),
+              'num_boxes': np.empty(num_images, dtype=np.int64)}
+    boxes, is_crowd = [], []
+    for i, entry in enumerate(roidb):
+        arrays['width'][i] = entry['width']
+        arrays['height'][i] = entry['height']
+        arrays['num_boxes'][i] = len(entry['boxes'])
+        if with_boxes:
+            boxes.append(np.asarray(entry['boxes'], dtype=np.float32).reshape(-1, 4))
+            is_crowd.append(get_is_crowd(entry))
+    if with_boxes:
+        arrays['boxes'] = np.concatenate(boxes) if boxes else np.zeros((0, 4), dtype=np.float32)
+        arrays['is_crowd'] = np.concatenate(is_crowd) if is_crowd else np.zeros(0, dtype=bool)
+        arrays['box_image'] = np.repeat(np.arange(num_images), arrays['num_boxes'])
+    return arrays
+
+
 def rank_roidb_ratio(roidb):
+    """Sets the 'need_crop' of the roidb entries whose aspect ratio is out of [0.5, 2], and returns the clipped
+    ratios in increasing order with the positions of their images."""
     # rank roidb based on the ratio between width and height.
     ratio_large = 2  # largest ratio to preserve.
     ratio_small = 0.5  # smallest ratio to preserve.
 
-    ratio_list = []
-    for i in range(len(roidb)):
-        width = roidb[i]['width']
-        height = roidb[i]['height']
-        ratio = width / float(height)
-
-        if ratio > ratio_large:
-            roidb[i]['need_crop'] = 1
-            ratio = ratio_large
-        elif ratio < ratio_small:
-            roidb[i]['need_crop'] = 1
-            ratio = ratio_small
-        else:
-            roidb[i]['need_crop'] = 0
-
-        ratio_list.append(ratio)
+    arrays = get_roidb_arrays(roidb)
+    ratio_list = arrays['width'] / arrays['height'].astype(np.float64)
+    need_crop = (ratio_list > ratio_large) | (ratio_list < ratio_small)
+    for entry, entry_need_crop in zip(roidb, need_crop.tolist()):
+        entry['need_crop'] = int(entry_need_crop)
+    ratio_list = np.clip(ratio_list, ratio_small, ratio_large)
 
-    ratio_list = np.array(ratio_list)
     ratio_index = np.argsort(ratio_list)
     return ratio_list[ratio_index], ratio_index
 
 
-def filter_roidb(roidb):
-    # filter the image without bounding box.
+def _has_boxes(arrays, options):
+    return arrays['num_boxes'] > 0
+
+
+def _has_large_enough_box(arrays, options):
+    # boxes are in inclusive pixel coordinates
+    sizes = arrays['boxes'][:, 2:] - arrays['boxes'][:, :2] + 1
+    large_enough = np.all(sizes >= options['min_box_size'], axis=1)
+    return np.bincount(arrays['box_image'][large_enough], minlength=len(arrays['num_boxes'])) > 0
+
+
+def _has_non_crowd_box(arrays, options):
+    return np.bincount(arrays['box_image'][~arrays['is_crowd']], minlength=len(arrays['num_boxes'])) > 0
+
+
+def _has_moderate_aspect_ratio(arrays, options):
+    ratios = arrays['width'] / arrays['height'].astype(np.float64)
+    min_aspect_ratio, max_aspect_ratio = options['aspect_ratio_range']
+    return (ratios >= min_aspect_ratio) & (ratios <= max_aspect_ratio)
+
+
+# filter name -> (function of the get_roidb_arrays of a roidb and of the filter options, returning the images to
+# keep, whether it needs the box arrays). More filters can be registered here
+ROIDB_FILTERS = {
+    'empty': (_has_boxes, False),  # images without boxes
+    'tiny_boxes': (_has_large_enough_box, True),  # images whose boxes are all smaller than min_box_size
+    'all_crowd': (_has_non_crowd_box, True),  # images whose boxes are all crowd boxes (coco)
+    'extreme_aspect': (_has_moderate_aspect_ratio, False),  # images with an aspect ratio out of aspect_ratio_range
+}
+
+DEFAULT_FILTER_OPTIONS = {'min_box_size': 2, 'aspect_ratio_range': [0.125, 8.0]}
+
+
+def filter_roidb(roidb, filter_names=('empty',), filter_options=None):
+    """The entries of roidb kept by all the ROIDB_FILTERS filter_names, computed together from a single
+    get_roidb_arrays pass. filter_options update DEFAULT_FILTER_OPTIONS."""
+    for filter_name in filter_names:
+        if filter_name not in ROIDB_FILTERS:
+            raise ValueError("Not valid roidb filter {} - should be one of {}".format(filter_name,
+                                                                                      sorted(ROIDB_FILTERS)))
+    options = dict(DEFAULT_FILTER_OPTIONS, **(filter_options or {}))
+    arrays = get_roidb_arrays(roidb, with_boxes=any(ROIDB_FILTERS[name][1] for name in filter_names))
+
     logger.info('Before filtering, there are %d images...' % (len(roidb)))
-    i = 0
-    while i < len(roidb):
-        if len(roidb[i]['boxes']) == 0:
-            del roidb[i]
-            i -= 1
-        i += 1
+    keep = np.ones(len(roidb), dtype=bool)
+    for filter_name in filter_names:
+        filter_keep = ROIDB_FILTERS[filter_name][0](arrays, options)
+        logger.info('Filter {} removes {} images.'.format(filter_name, int(np.sum(~filter_keep))))
+        keep &= filter_keep
+    roidb = [roidb[i] for i in np.flatnonzero(keep)]
 
     logger.info('After filtering, there are %d images...' % (len(roidb)))
     return roidb
 
 
-def combined_roidb(imdb_names, data_dir, use_flipped, proposal_method, training=True):
+def get_roidb_cache_key(imdbs, use_flipped, proposal_method, training, filter_names=(), filter_options=None):
+    """Hash of everything the roidb that combined_roidb prepares from imdbs depends on (including the image files,
+    whose sizes it holds), or None when the annotation sources of one of the imdbs are not known."""
+    imdb_keys = []
+    for imdb in imdbs:
+        fingerprint = imdb.get_annotation_fingerprint()
+        if fingerprint is None:
+            return None
+        imdb_keys.append((imdb.name, list(imdb.classes), fingerprint, imdb.get_image_fingerprint(),
+                          sorted(imdb.config.items())))
+    filter_options = sorted(dict(DEFAULT_FILTER_OPTIONS, **(filter_options or {})).items())
+    key_values = (_ROIDB_CACHE_VERSION, imdb_keys, use_flipped, proposal_method, training, list(filter_names),
+                  filter_options)
+    return hashlib.sha1(repr(key_values).encode('utf-8')).hexdigest()[:16]
+
+
+def combined_roidb(imdb_names, data_dir, use_flipped, proposal_method, training=True, filter_names=('empty',),
+                   filter_options=None):
     """
     Combine multiple roidbs
+
+    In training, the images are filtered by filter_names with filter_options (see filter_roidb).
+
+    The prepared roidb and its aspect ratio order are cached under the imdbs cache path, keyed by
+    get_roidb_cache_key, so that later runs only read them.
     """
 
     def get_training_roidb(imdb):
@@ -109,28 +196,43 @@ def combined_roidb(imdb_names, data_dir, use_flipped, proposal_method, training=
 
         return imdb.roidb
 
-    def get_roidb(imdb_name):
-        imdb = get_imdb(imdb_name, data_dir=data_dir)
+    def get_roidb(imdb):
         logger.info('Loaded dataset `{}` for training.'.format(imdb.name))
         imdb.set_proposal_method(proposal_method)
         logger.info('Set proposal method: {}.'.format(proposal_method))
         roidb = get_training_roidb(imdb)
         return roidb
 
-    roidbs = [get_roidb(s) for s in imdb_names.split('+')]
-    roidb = roidbs[0]
-
-    if len(roidbs) > 1:
-        for r in roidbs[1:]:
-            roidb.extend(r)
-        tmp = get_imdb(imdb_names.split('+')[1], data_dir=data_dir)
-        imdb = dataset_imdb.imdb(imdb_names, data_dir=data_dir, classes=tmp.classes)
+    imdbs = [get_imdb(s, data_dir=data_dir) for s in imdb_names.split('+')]
+    if len(imdbs) > 1:
+        imdb = dataset_imdb.imdb(imdb_names, data_dir=data_dir, classes=imdbs[1].classes)
     else:
-        imdb = get_imdb(imdb_names, data_dir=data_dir)
+        imdb = imdbs[0]
+
+    if not training:
+        filter_names = ()
+    cache_key = get_roidb_cache_key(imdbs, use_flipped, proposal_method, training, filter_names, filter_options)
+    roidb_dir = os.path.join(imdb.cache_path, 'columnar_roidb', '{}_{}'.format(imdb_names, cache_key))
+    if cache_key is not None and os.path.exists(roidb_dir):
+        roidb = ColumnarRoidb(roidb_dir)
+        logger.info('Loaded the roidb of {} images from {}.'.format(len(roidb), roidb_dir))
+        return imdb, roidb, np.array(roidb.column('ratio_list')), np.array(roidb.column('ratio_index'))
+
+    # the images are flipped in copies of the loaded imdbs (which share their parsed annotations), so that the
+    # returned imdb keeps the loaded images only
+    roidbs = [get_roidb(copy.copy(i)) for i in imdbs]
+    roidb = roidbs[0]
+    for r in roidbs[1:]:
+        roidb.extend(r)
 
-    if training:
-        roidb = filter_roidb(roidb)
+    if filter_names:
+        roidb = filter_roidb(roidb, filter_names, filter_options)
 
     ratio_list, ratio_index = rank_roidb_ratio(roidb)
+    # shared by the data loader workers instead of being pickled into each of them
+    if cache_key is not None:
+        roidb = ColumnarRoidb.write(roidb, roidb_dir, ratio_list=ratio_list, ratio_index=ratio_index)
+    else:
+        roidb = ColumnarRoidb.from_roidb(roidb, os.path.join(imdb.cache_path, 'columnar_roidb'), imdb_names)
 
     return imdb, roidb, ratio_list, ratio_index
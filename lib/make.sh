@@ -1,12 +1,25 @@
 #!/usr/bin/env bash
 
+# Cython extensions (bbox overlaps and the CPU NMS), needed on CPU-only machines too
+python setup.py build_ext --inplace
+rm -rf build
+
+if ! command -v nvcc > /dev/null 2>&1; then
+    # CPU-only machine: the Cython extensions above are built, add the CPU roi poolers. There is no GPU NMS.
+    echo 'nvcc was not found, built the Cython extensions, building the CPU roi poolers (set CUDA: False in your config).'
+    for roi_pooler in roi_pooling roi_align roi_crop; do
+        cd model/meta_architecture/roi_poolers/$roi_pooler
+        python build.py
+        cd ../../../../
+    done
+    exit 0
+fi
+
 echo 'Please write the CUDA architecture of your GPU (e.g. 60 for P100, 61 for 1080Ti, 37 for K80,'
 echo 'find other GPUs here: http://arnon.dk/matching-sm-architectures-arch-and-gencode-for-various-nvidia-cards/)'
 read cuda_arch_num
 
 CUDA_PATH=/usr/local/cuda/
-python setup.py build_ext --inplace
-rm -rf build
 
 CUDA_ARCH="-gencode arch=compute_$cuda_arch_num,code=sm_$cuda_arch_num"
 echo $CUDA_ARCH
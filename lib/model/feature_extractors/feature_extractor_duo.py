@@ -49,6 +49,29 @@ class FeatureExtractorDuo(ABC):
         def layer_mapping_to_pretrained(self):
             raise NotImplementedError
 
+        @property
+        def num_frozen_layers(self):
+            """Number of leading layers of the model without trainable parameters or batch norm statistics,
+            whose outputs don't change during training."""
+            num_frozen_layers = 0
+            for layer in self._model:
+                if any(p.requires_grad for p in layer.parameters()) or \
+                        any(m.training for m in layer.modules() if isinstance(m, _BatchNorm)):
+                    break
+                num_frozen_layers += 1
+            return num_frozen_layers
+
+        def forward_frozen(self, input):
+            """Output of the frozen layers, the input of forward_trainable."""
+            return self._model[:self.num_frozen_layers](input)
+
+        def forward_trainable(self, frozen_features):
+            """The rest of the forward pass, forward_trainable(forward_frozen(x)) == forward(x)."""
+            return self._forward_layers(frozen_features, self.num_frozen_layers)
+
+        def _forward_layers(self, x, first_layer):
+            return self._model[first_layer:](x)
+
     @property
     @abstractmethod
     def rpn_feature_extractor(self):
@@ -63,6 +86,11 @@ class FeatureExtractorDuo(ABC):
     def convert_pretrained_state_dict(self, pretrained_state_dict):
         return NotImplementedError
 
+    def set_checkpointed_stages(self, stage_names):
+        """Stages whose activations are recomputed in the backward pass instead of being kept."""
+        if stage_names:
+            raise NotImplementedError('{} does not support activation checkpointing'.format(type(self).__name__))
+
 
 def create_empty_duo(net_name, net_variant, frozen_blocks):
     fe_cls = _get_feature_extractor_duo_cls(net_name)
@@ -82,7 +110,7 @@ def create_duo_from_ckpt(net_name, net_variant, frozen_blocks, pretrained_model_
     if pretrained_model_path is None or not os.path.exists(pretrained_model_path):
         raise ValueError('Pretrained model path given does not exist')
     fe_duo = create_empty_duo(net_name, net_variant, frozen_blocks=frozen_blocks)
-    orig_state_dict = torch.load(os.path.abspath(pretrained_model_path))
+    orig_state_dict = torch.load(os.path.abspath(pretrained_model_path), map_location=lambda storage, loc: storage)
     zipped_subnets_and_state_dicts = fe_duo.convert_pretrained_state_dict(orig_state_dict)
     for fe_subnet, new_state_dict in zipped_subnets_and_state_dicts:
         fe_subnet.load_state_dict(new_state_dict, strict=False)
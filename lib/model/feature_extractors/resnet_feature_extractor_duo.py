@@ -6,7 +6,7 @@ from torchvision.models import resnet101
 from torchvision.models.resnet import resnet50, resnet152
 
 from model.feature_extractors.feature_extractor_duo import FeatureExtractorDuo
-from model.utils.net_utils import global_average_pooling
+from model.utils.net_utils import global_average_pooling, run_checkpointed_blocks
 
 
 class ResNetFeatureExtractorDuo(FeatureExtractorDuo):
@@ -31,6 +31,19 @@ class ResNetFeatureExtractorDuo(FeatureExtractorDuo):
     def rpn_feature_extractor(self):
         return self._rpn_feature_extractor
 
+    def set_checkpointed_stages(self, stage_names):
+        """Stages (of 'layer1' to 'layer4', layer4 runs on every pooled RoI) whose residual blocks keep only
+        their input for the backward pass, and recompute the rest of their activations in it.
+        The parameters and the outputs don't change, so it can be set on a trained model as well.
+        """
+        stage_names = set(stage_names or [])
+        unknown_stages = stage_names - {'layer1', 'layer2', 'layer3', 'layer4'}
+        if unknown_stages:
+            raise ValueError('Unexpected ResNet stages {} - should be of layer1 to layer4'.format(
+                sorted(unknown_stages)))
+        self._rpn_feature_extractor.checkpointed_stages = stage_names - {'layer4'}
+        self._fast_rcnn_feature_extractor.checkpointed_stages = stage_names & {'layer4'}
+
     @property
     def fast_rcnn_feature_extractor(self):
         return self._fast_rcnn_feature_extractor
@@ -55,6 +68,7 @@ class ResNetFeatureExtractorDuo(FeatureExtractorDuo):
             ResNetFeatureExtractorDuo._freeze_layers(self._model, self._frozen_blocks)
             self._model.apply(self._freeze_batch_norm_layers)
             self._output_num_channels = self.get_output_num_channels(self._model[-1][-1].conv3)
+            self.checkpointed_stages = set()
 
         @property
         def output_num_channels(self):
@@ -66,7 +80,17 @@ class ResNetFeatureExtractorDuo(FeatureExtractorDuo):
             return mapping_dict
 
         def forward(self, input):
-            return self._model(input)
+            return self._forward_layers(input, 0)
+
+        def _forward_layers(self, x, first_layer):
+            if not self.checkpointed_stages:
+                return self._model[first_layer:](x)
+            for layer_name, layer in list(zip(self._ordered_layer_names, self._model))[first_layer:]:
+                if layer_name.rstrip('.') in self.checkpointed_stages:
+                    x = run_checkpointed_blocks(layer, x)
+                else:
+                    x = layer(x)
+            return x
 
         def train(self, mode=True):
             super(ResNetFeatureExtractorDuo._RPNFeatureExtractor, self).train(mode)
@@ -84,8 +108,12 @@ class ResNetFeatureExtractorDuo(FeatureExtractorDuo):
 
             self._model.apply(self._freeze_batch_norm_layers)
             self._output_num_channels = self.get_output_num_channels(self._model[-1][-1].conv3)
+            self.checkpointed_stages = set()
 
         def forward(self, input):
+            if 'layer4' in self.checkpointed_stages:
+                # the activations of layer4 grow with the number of RoIs, which makes it the most worth recomputing
+                return global_average_pooling(run_checkpointed_blocks(self._model[0], input))
             return global_average_pooling(self._model(input))
 
         @property
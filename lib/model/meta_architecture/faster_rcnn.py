@@ -9,6 +9,7 @@ from model.feature_extractors.feature_extractor_duo import create_empty_duo
 from model.meta_architecture.roi_poolers.roi_pooler_factory import create_roi_pooler
 from model.meta_architecture.rpn.proposal_target_layer_cascade import _ProposalTargetLayer
 from model.meta_architecture.rpn.rpn import _RPN
+from model.utils.mixed_precision import run_in_fp32
 from model.utils.net_utils import _smooth_l1_loss, normal_init
 from utils.config import ConfigProvider
 
@@ -55,6 +56,7 @@ class FasterRCNN(nn.Module):
 
         self.faster_rcnn_loss_cls = 0
         self.faster_rcnn_loss_bbox = 0
+        self._feature_cache = None
 
     @classmethod
     def create_with_random_normal_init(cls, feature_extractor_duo, cfg, num_classes):
@@ -67,13 +69,33 @@ class FasterRCNN(nn.Module):
         configured_normal_init(faster_rcnn.fast_rcnn_bbox_head, stddev=0.001)
         return faster_rcnn
 
-    def forward(self, im_data, im_info, gt_boxes, num_boxes):
+    def set_feature_cache(self, feature_cache):
+        """Caches the outputs of the frozen layers of the RPN feature extractor in training (see FeatureCache),
+        so that they are computed once per input image. The cache_keys of the images are then given to forward."""
+        self._feature_cache = feature_cache
+
+    def _extract_base_feature_map(self, im_data, cache_keys):
+        if self._feature_cache is None or cache_keys is None or not self.training:
+            return self.rpn_fe(im_data)
+        frozen_feature_maps = [self._feature_cache.get(key) for key in cache_keys]
+        if any(feature_map is None for feature_map in frozen_feature_maps):
+            with torch.no_grad():
+                frozen_feature_map = self.rpn_fe.forward_frozen(im_data)
+            for key, cached, feature_map in zip(cache_keys, frozen_feature_maps, frozen_feature_map):
+                if cached is None:
+                    self._feature_cache.put(key, feature_map)
+        else:
+            frozen_feature_map = torch.stack(frozen_feature_maps, 0).to(im_data.device)
+        # the cached feature maps may have been computed in a different precision
+        return self.rpn_fe.forward_trainable(Variable(frozen_feature_map.type_as(im_data)))
+
+    def forward(self, im_data, im_info, gt_boxes, num_boxes, cache_keys=None):
         batch_size = im_data.size(0)
         im_info = im_info.data
         gt_boxes = gt_boxes.data
         num_boxes = num_boxes.data
 
-        base_feature_map = self.rpn_fe(im_data)
+        base_feature_map = self._extract_base_feature_map(im_data, cache_keys)
 
         rois, rpn_loss_cls, rpn_loss_bbox = self.rpn_and_nms(base_feature_map, im_info, gt_boxes, num_boxes)
 
@@ -95,7 +117,8 @@ class FasterRCNN(nn.Module):
 
         rois = Variable(rois)
 
-        pooled_rois = self.roi_pooler(base_feature_map, rois.view(-1, 5))
+        # the RoI pooling extensions only support fp32
+        pooled_rois = run_in_fp32(self.roi_pooler)(base_feature_map, rois.view(-1, 5))
 
         def run_fast_rcnn():
             fast_rcnn_feature_map = self.fast_rcnn_feature_extractor(pooled_rois)
@@ -111,12 +134,12 @@ class FasterRCNN(nn.Module):
                 bbox_pred = bbox_pred_select.squeeze(1)
 
             cls_score = self.fast_rcnn_cls_head(fast_rcnn_feature_map)
-            cls_prob = F.softmax(cls_score)
+            cls_prob = F.softmax(cls_score.float())
             return bbox_pred, cls_score, cls_prob
         bbox_pred, cls_score, cls_prob = run_fast_rcnn()
 
         if self.training:
-            self.faster_rcnn_loss_cls = F.cross_entropy(cls_score, rois_label)
+            self.faster_rcnn_loss_cls = F.cross_entropy(cls_score.float(), rois_label)
             self.faster_rcnn_loss_bbox = _smooth_l1_loss(bbox_pred, rois_target, rois_inside_ws, rois_outside_ws)
         else:
             self.faster_rcnn_loss_cls = 0
@@ -129,12 +152,13 @@ class FasterRCNN(nn.Module):
                self.faster_rcnn_loss_cls, self.faster_rcnn_loss_bbox, rois_label
 
     @classmethod
-    def create_from_ckpt(cls, ckpt_path):
-        state_dict = torch.load(os.path.abspath(ckpt_path))
+    def create_from_ckpt(cls, ckpt_path, checkpointed_stages=()):
+        state_dict = torch.load(os.path.abspath(ckpt_path), map_location=lambda storage, loc: storage)
         loaded_cfg = ConfigProvider()
         loaded_cfg.create_from_dict(state_dict['ckpt_cfg'])
         feature_extractor_duo = create_empty_duo(
             loaded_cfg.net, loaded_cfg.net_variant, loaded_cfg.TRAIN.frozen_blocks)
+        feature_extractor_duo.set_checkpointed_stages(checkpointed_stages)
         model = FasterRCNN(feature_extractor_duo, loaded_cfg, state_dict['model_cfg_params']['num_classes'])
         model.load_state_dict(state_dict['model'])
         return model, loaded_cfg
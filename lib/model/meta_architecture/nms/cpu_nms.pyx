@@ -0,0 +1,116 @@
+# --------------------------------------------------------
+# Fast R-CNN
+# Copyright (c) 2015 Microsoft
+# Licensed under The MIT License [see LICENSE for details]
+# Written by Ross Girshick
+# --------------------------------------------------------
+
+cimport cython
+import numpy as np
+cimport numpy as np
+
+DTYPE = np.float32
+ctypedef np.float32_t DTYPE_t
+
+cdef inline DTYPE_t max_c(DTYPE_t a, DTYPE_t b) nogil:
+    return a if a >= b else b
+
+cdef inline DTYPE_t min_c(DTYPE_t a, DTYPE_t b) nogil:
+    return a if a <= b else b
+
+
+def cpu_nms(np.ndarray[DTYPE_t, ndim=2] dets, float thresh):
+    """
+    Parameters
+    ----------
+    dets: (N, 5) ndarray of float32 (x1, y1, x2, y2, score)
+    thresh: boxes overlapping a kept box with IoU > thresh are suppressed
+    Returns
+    -------
+    keep: (K,) ndarray of int64 indices of the kept boxes, by descending score
+    """
+    cdef np.ndarray[np.int64_t, ndim=1] idxs = np.zeros(dets.shape[0], dtype=np.int64)
+    return cpu_batched_nms_c(dets, idxs, thresh)
+
+
+def cpu_batched_nms(np.ndarray[DTYPE_t, ndim=2] dets, np.ndarray[np.int64_t, ndim=1] idxs, float thresh):
+    """
+    Same as cpu_nms, but a box can only be suppressed by a box with the same idx (e.g. class).
+    """
+    return cpu_batched_nms_c(dets, idxs, thresh)
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.initializedcheck(False)
+cdef np.ndarray[np.int64_t, ndim=1] cpu_batched_nms_c(
+        np.ndarray[DTYPE_t, ndim=2] dets,
+        np.ndarray[np.int64_t, ndim=1] idxs,
+        float thresh):
+    # stable sort, so already sorted input keeps the order of equal scores
+    cdef np.ndarray[np.int64_t, ndim=1] order = np.argsort(-dets[:, 4], kind='mergesort').astype(np.int64)
+    # boxes are gathered in score order, so that the inner loop reads memory sequentially
+    cdef DTYPE_t[::1] x1 = np.ascontiguousarray(dets[order, 0])
+    cdef DTYPE_t[::1] y1 = np.ascontiguousarray(dets[order, 1])
+    cdef DTYPE_t[::1] x2 = np.ascontiguousarray(dets[order, 2])
+    cdef DTYPE_t[::1] y2 = np.ascontiguousarray(dets[order, 3])
+    cdef DTYPE_t[::1] areas = np.ascontiguousarray(
+        (dets[order, 2] - dets[order, 0] + 1) * (dets[order, 3] - dets[order, 1] + 1))
+
+    cdef Py_ssize_t N = dets.shape[0]
+    # positions (in score order) grouped by idx, still in score order within every group,
+    # so that every group is suppressed on its own and never scans the boxes of the other groups
+    cdef np.ndarray[np.int64_t, ndim=1] sorted_idxs = idxs[order]
+    cdef np.int64_t[::1] grouped = np.argsort(sorted_idxs, kind='mergesort').astype(np.int64)
+    cdef np.int64_t[::1] group_starts = np.flatnonzero(
+        np.concatenate(([True], sorted_idxs[grouped[1:]] != sorted_idxs[grouped[:N - 1]], [True]))).astype(np.int64) \
+        if N > 0 else np.zeros(1, dtype=np.int64)
+    cdef Py_ssize_t num_groups = group_starts.shape[0] - 1
+
+    # positions of the boxes of the current group that were not suppressed yet, compacted in place
+    cdef np.int64_t[::1] remaining = np.empty(N, dtype=np.int64)
+    cdef np.int64_t[::1] keep = np.empty(N, dtype=np.int64)
+    cdef Py_ssize_t num_remaining
+    cdef Py_ssize_t num_kept = 0
+    cdef Py_ssize_t num_survived, _g, _k
+
+    cdef np.int64_t i, j
+    cdef DTYPE_t ix1, iy1, ix2, iy2, iarea
+    cdef DTYPE_t xx1, yy1, xx2, yy2
+    cdef DTYPE_t w, h, inter
+
+    with nogil:
+        for _g in range(num_groups):
+            num_remaining = group_starts[_g + 1] - group_starts[_g]
+            for _k in range(num_remaining):
+                remaining[_k] = grouped[group_starts[_g] + _k]
+            while num_remaining > 0:
+                i = remaining[0]
+                keep[num_kept] = i
+                num_kept += 1
+                ix1 = x1[i]
+                iy1 = y1[i]
+                ix2 = x2[i]
+                iy2 = y2[i]
+                iarea = areas[i]
+                num_survived = 0
+                for _k in range(1, num_remaining):
+                    j = remaining[_k]
+                    xx1 = max_c(ix1, x1[j])
+                    yy1 = max_c(iy1, y1[j])
+                    xx2 = min_c(ix2, x2[j])
+                    yy2 = min_c(iy2, y2[j])
+                    w = xx2 - xx1 + 1
+                    h = yy2 - yy1 + 1
+                    # disjoint boxes (the common case) never get suppressed
+                    if w > 0 and h > 0:
+                        inter = w * h
+                        # same as inter / union > thresh, without the division
+                        if inter > thresh * (iarea + areas[j] - inter):
+                            continue
+                    remaining[num_survived] = j
+                    num_survived += 1
+                num_remaining = num_survived
+
+    # the kept boxes of all groups, by descending score
+    return order[np.sort(np.asarray(keep[:num_kept]))]
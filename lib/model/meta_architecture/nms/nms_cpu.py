@@ -1,11 +1,40 @@
 from __future__ import absolute_import
 
+import logging
+
 import numpy as np
 import torch
 
+try:
+    from model.meta_architecture.nms.cython_nms import cpu_nms, cpu_batched_nms
+except ImportError:
+    cpu_nms = cpu_batched_nms = None
+
+logger = logging.getLogger(__name__)
+
+if cpu_nms is None:
+    logger.warning('The compiled CPU NMS (cython_nms) is not built, falling back to the slower numpy NMS. '
+                   'Build it with lib/make.sh.')
+
 
 def nms_cpu(dets, thresh):
-    dets = dets.numpy()
+    dets = np.ascontiguousarray(dets.cpu().numpy(), dtype=np.float32)
+    keep = cpu_nms(dets, thresh) if cpu_nms is not None else _nms_numpy(dets, thresh)
+    return torch.from_numpy(keep).int()
+
+
+def batched_nms_cpu(dets, idxs, thresh):
+    dets = np.ascontiguousarray(dets.cpu().numpy(), dtype=np.float32)
+    idxs = np.ascontiguousarray(idxs.cpu().numpy(), dtype=np.int64)
+    if cpu_batched_nms is not None:
+        keep = cpu_batched_nms(dets, idxs, thresh)
+    else:
+        keep = _batched_nms_numpy(dets, idxs, thresh)
+    return torch.from_numpy(keep).int()
+
+
+def _nms_numpy(dets, thresh):
+    # same boxes and order as cpu_nms
     x1 = dets[:, 0]
     y1 = dets[:, 1]
     x2 = dets[:, 2]
@@ -13,7 +42,7 @@ def nms_cpu(dets, thresh):
     scores = dets[:, 4]
 
     areas = (x2 - x1 + 1) * (y2 - y1 + 1)
-    order = scores.argsort()[::-1]
+    order = np.argsort(-scores, kind='mergesort')
 
     keep = []
     while order.size > 0:
@@ -21,8 +50,8 @@ def nms_cpu(dets, thresh):
         keep.append(i)
         xx1 = np.maximum(x1[i], x1[order[1:]])
         yy1 = np.maximum(y1[i], y1[order[1:]])
-        xx2 = np.maximum(x2[i], x2[order[1:]])
-        yy2 = np.maximum(y2[i], y2[order[1:]])
+        xx2 = np.minimum(x2[i], x2[order[1:]])
+        yy2 = np.minimum(y2[i], y2[order[1:]])
 
         w = np.maximum(0.0, xx2 - xx1 + 1)
         h = np.maximum(0.0, yy2 - yy1 + 1)
@@ -32,6 +61,11 @@ def nms_cpu(dets, thresh):
         inds = np.where(ovr <= thresh)[0]
         order = order[inds + 1]
 
-    return torch.IntTensor(keep)
+    return np.array(keep, dtype=np.int64)
 
 
+def _batched_nms_numpy(dets, idxs, thresh):
+    # same boxes and order as cpu_batched_nms
+    keep = [np.flatnonzero(idxs == idx)[_nms_numpy(dets[idxs == idx], thresh)] for idx in np.unique(idxs)]
+    keep = np.sort(np.concatenate(keep)) if keep else np.zeros(0, dtype=np.int64)
+    return keep[np.argsort(-dets[keep, 4], kind='mergesort')]
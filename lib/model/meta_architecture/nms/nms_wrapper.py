@@ -6,17 +6,37 @@
 # --------------------------------------------------------
 
 import torch
-from model.meta_architecture.nms.nms_cpu import nms_cpu
+from model.meta_architecture.nms.nms_cpu import nms_cpu, batched_nms_cpu
 if torch.cuda.is_available():
     from model.meta_architecture.nms.nms_gpu import nms_gpu
 
 
 def nms(dets, thresh, force_cpu=False):
-    """Dispatch to either CPU or GPU NMS implementations."""
+    """Dispatch to either CPU or GPU NMS implementations, CPU tensors always go to the CPU implementation."""
     if dets.shape[0] == 0:
         return []
     # ---numpy version---
     # original: return gpu_nms(dets, thresh, device_id=cfg.GPU_ID)
     # ---pytorch version---
 
-    return nms_gpu(dets, thresh) if force_cpu == False else nms_cpu(dets, thresh)
+    use_gpu_nms = dets.is_cuda and not force_cpu
+    return nms_gpu(dets, thresh) if use_gpu_nms else nms_cpu(dets, thresh)
+
+
+def batched_nms(dets, idxs, thresh, force_cpu=False):
+    """Class-aware NMS over the boxes of many groups (e.g. classes) in a single call.
+
+    dets is a (N, 5) tensor of (x1, y1, x2, y2, score) sorted by descending score and idxs holds the group
+    index of every box. Each group is shifted to its own disjoint coordinate range, so that boxes of
+    different groups never overlap and one NMS call suppresses each group independently.
+    On CPU the compiled kernel compares group indices directly instead.
+    """
+    if dets.shape[0] == 0:
+        return []
+    if not dets.is_cuda or force_cpu:
+        return batched_nms_cpu(dets, idxs, thresh)
+    max_coordinate = dets[:, :4].max()
+    offsets = idxs.type_as(dets) * (max_coordinate + 1)
+    shifted_dets = dets.clone()
+    shifted_dets[:, :4] += offsets.view(-1, 1).expand(dets.size(0), 4)
+    return nms(shifted_dets, thresh, force_cpu)
@@ -6,20 +6,21 @@ from torch.utils.ffi import create_extension
 
 sources = ['src/roi_crop.c']
 headers = ['src/roi_crop.h']
+extra_objects = []
 defines = []
 with_cuda = False
 
+this_file = os.path.dirname(os.path.realpath(__file__))
+print(this_file)
+
 if torch.cuda.is_available():
     print('Including CUDA code.')
     sources += ['src/roi_crop_cuda.c']
     headers += ['src/roi_crop_cuda.h']
     defines += [('WITH_CUDA', None)]
     with_cuda = True
-
-this_file = os.path.dirname(os.path.realpath(__file__))
-print(this_file)
-extra_objects = ['src/roi_crop_cuda_kernel.cu.o']
-extra_objects = [os.path.join(this_file, fname) for fname in extra_objects]
+    extra_objects = ['src/roi_crop_cuda_kernel.cu.o']
+    extra_objects = [os.path.join(this_file, fname) for fname in extra_objects]
 
 ffi = create_extension(
     '_ext.roi_crop',
@@ -10,7 +10,10 @@ class RoICropFunction(Function):
         output = input2.new(input2.size()[0], input1.size()[1], input2.size()[1], input2.size()[2]).zero_()
         assert output.get_device() == input1.get_device(), "output and input1 must on the same device"
         assert output.get_device() == input2.get_device(), "output and input2 must on the same device"
-        roi_crop.BilinearSamplerBHWD_updateOutput_cuda(input1, input2, output)
+        if input1.is_cuda:
+            roi_crop.BilinearSamplerBHWD_updateOutput_cuda(input1, input2, output)
+        else:
+            roi_crop.BilinearSamplerBHWD_updateOutput(input1, input2, output)
         return output
 
     def backward(self, grad_output):
@@ -21,7 +21,7 @@ class RoIPoolFunction(Function):
         ctx.argmax = features.new(num_rois, num_channels, ctx.pooled_height, ctx.pooled_width).zero_().int()
         ctx.rois = rois
         if not features.is_cuda:
-            _features = features.permute(0, 2, 3, 1)
+            _features = features.permute(0, 2, 3, 1).contiguous()
             roi_pooling.roi_pooling_forward(ctx.pooled_height, ctx.pooled_width, ctx.spatial_scale,
                                             _features, rois, output)
         else:
@@ -0,0 +1,56 @@
+from __future__ import absolute_import
+
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import torch
+
+from .generate_anchors import generate_anchors
+
+
+class AnchorGenerator(object):
+    """Creates the anchors of every location of a feature map, as used by the proposal and anchor target layers.
+
+    The anchors only depend on the size of the feature map, so they are created once per
+    (feat_height, feat_width, feat_stride, tensor type, device) and kept in an LRU cache of cache_size grids,
+    ready on the device. The returned tensors are shared and should not be modified in place.
+    The cache is shared between the replicas of nn.DataParallel, so it is guarded by a lock.
+    """
+
+    def __init__(self, feat_stride, scales, ratios, cache_size=32):
+        self.feat_stride = feat_stride
+        self.base_anchors = torch.from_numpy(generate_anchors(scales=np.array(scales), ratios=np.array(ratios))).float()
+        self.num_anchors = self.base_anchors.size(0)
+        self._cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def grid_anchors(self, feat_height, feat_width, like_tensor):
+        """Returns a (feat_height * feat_width * num_anchors, 4) tensor of the same type and device as like_tensor,
+        ordered by location (row major) and then by anchor, as the RPN outputs are reshaped.
+        """
+        device_idx = like_tensor.get_device() if like_tensor.is_cuda else -1
+        key = (feat_height, feat_width, self.feat_stride, like_tensor.type(), device_idx)
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key]
+
+        shift_x = (torch.arange(0, feat_width) * self.feat_stride).float().view(1, feat_width)
+        shift_y = (torch.arange(0, feat_height) * self.feat_stride).float().view(feat_height, 1)
+        shift_x = shift_x.expand(feat_height, feat_width).contiguous().view(-1)
+        shift_y = shift_y.expand(feat_height, feat_width).contiguous().view(-1)
+        shifts = torch.stack((shift_x, shift_y, shift_x, shift_y), 1)
+
+        num_locations = shifts.size(0)
+        anchors = self.base_anchors.view(1, self.num_anchors, 4) + shifts.view(num_locations, 1, 4)
+        anchors = anchors.view(num_locations * self.num_anchors, 4).type_as(like_tensor)
+        if like_tensor.is_cuda:
+            anchors = anchors.cuda(device_idx)
+
+        with self._lock:
+            self._cache[key] = anchors
+            if len(self._cache) > self._cache_size:
+                self._cache.popitem(last=False)
+        return anchors
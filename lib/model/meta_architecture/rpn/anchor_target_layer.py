@@ -1,11 +1,10 @@
 from __future__ import absolute_import
 
-import numpy as np
 import torch
 import torch.nn as nn
 
+from .anchor_generator import AnchorGenerator
 from .bbox_transform import bbox_overlaps_batch, bbox_transform_batch
-from .generate_anchors import generate_anchors
 
 # --------------------------------------------------------
 # Faster R-CNN
@@ -25,14 +24,15 @@ class _AnchorTargetLayer(nn.Module):
         Assign anchors to ground-truth targets. Produces anchor classification
         labels and bounding-box regression targets.
     """
-    def __init__(self, feat_stride, scales, ratios, cfg):
+    def __init__(self, feat_stride, scales, ratios, cfg, anchor_generator=None):
         super(_AnchorTargetLayer, self).__init__()
 
         self._feat_stride = feat_stride
         self._scales = scales
-        anchor_scales = scales
-        self._anchors = torch.from_numpy(generate_anchors(scales=np.array(anchor_scales), ratios=np.array(ratios))).float()
-        self._num_anchors = self._anchors.size(0)
+        if anchor_generator is None:
+            anchor_generator = AnchorGenerator(feat_stride, scales, ratios)
+        self._anchor_generator = anchor_generator
+        self._num_anchors = anchor_generator.num_anchors
 
         # allow boxes to sit over the edge by a small amount
         self._allowed_border = 0  # default is 0
@@ -57,21 +57,10 @@ class _AnchorTargetLayer(nn.Module):
         batch_size = gt_boxes.size(0)
 
         feat_height, feat_width = rpn_cls_score.size(2), rpn_cls_score.size(3)
-        shift_x = np.arange(0, feat_width) * self._feat_stride
-        shift_y = np.arange(0, feat_height) * self._feat_stride
-        shift_x, shift_y = np.meshgrid(shift_x, shift_y)
-        shifts = torch.from_numpy(np.vstack((shift_x.ravel(), shift_y.ravel(),
-                                  shift_x.ravel(), shift_y.ravel())).transpose())
-        shifts = shifts.contiguous().type_as(rpn_cls_score).float()
+        all_anchors = self._anchor_generator.grid_anchors(feat_height, feat_width, gt_boxes)
 
         A = self._num_anchors
-        K = shifts.size(0)
-
-        self._anchors = self._anchors.type_as(gt_boxes)  # move to specific gpu.
-        all_anchors = self._anchors.view(1, A, 4) + shifts.view(K, 1, 4)
-        all_anchors = all_anchors.view(K * A, 4)
-
-        total_anchors = int(K * A)
+        total_anchors = all_anchors.size(0)
 
         keep = ((all_anchors[:, 0] >= -self._allowed_border) &
                 (all_anchors[:, 1] >= -self._allowed_border) &
@@ -99,8 +88,7 @@ class _AnchorTargetLayer(nn.Module):
         gt_max_overlaps[gt_max_overlaps == 0] = 1e-5
         keep = torch.sum(overlaps.eq(gt_max_overlaps.view(batch_size, 1, -1).expand_as(overlaps)), 2)
 
-        if torch.sum(keep) > 0:
-            labels[keep > 0] = 1
+        labels[keep > 0] = 1
 
         # fg label: above threshold IOU
         labels[max_overlaps >= self.cfg.TRAIN.RPN_POSITIVE_OVERLAP] = 1
@@ -110,29 +98,12 @@ class _AnchorTargetLayer(nn.Module):
 
         num_fg = int(self.cfg.TRAIN.RPN_FG_FRACTION * self.cfg.TRAIN.RPN_BATCHSIZE)
 
-        sum_fg = torch.sum((labels == 1).int(), 1)
-        sum_bg = torch.sum((labels == 0).int(), 1)
-
-        for i in range(batch_size):
-            # subsample positive labels if we have too many
-            if sum_fg[i] > num_fg:
-                fg_inds = torch.nonzero(labels[i] == 1).view(-1)
-                # torch.randperm seems has a bug on multi-gpu setting that cause the segfault.
-                # See https://github.com/pytorch/pytorch/issues/1868 for more details.
-                # use numpy instead.
-                rand_num = torch.from_numpy(np.random.permutation(fg_inds.size(0))).type_as(gt_boxes).long()
-                disable_inds = fg_inds[rand_num[:fg_inds.size(0)-num_fg]]
-                labels[i][disable_inds] = -1
-
-            num_bg = self.cfg.TRAIN.RPN_BATCHSIZE - torch.sum((labels == 1).int(), 1)[i]
+        # subsample positive labels if we have too many
+        _subsample_labels(labels, 1, labels.new(batch_size).fill_(num_fg).long())
 
-            # subsample negative labels if we have too many
-            if sum_bg[i] > num_bg:
-                bg_inds = torch.nonzero(labels[i] == 0).view(-1)
-
-                rand_num = torch.from_numpy(np.random.permutation(bg_inds.size(0))).type_as(gt_boxes).long()
-                disable_inds = bg_inds[rand_num[:bg_inds.size(0)-num_bg]]
-                labels[i][disable_inds] = -1
+        # subsample negative labels if we have too many
+        num_bg = self.cfg.TRAIN.RPN_BATCHSIZE - torch.sum((labels == 1).long(), 1).view(-1)
+        _subsample_labels(labels, 0, num_bg)
 
         offset = torch.arange(0, batch_size)*gt_boxes.size(1)
 
@@ -143,7 +114,7 @@ class _AnchorTargetLayer(nn.Module):
         bbox_inside_weights[labels == 1] = self.cfg.TRAIN.RPN_BBOX_INSIDE_WEIGHTS[0]
 
         if self.cfg.TRAIN.RPN_POSITIVE_WEIGHT < 0:
-            num_examples = torch.sum(labels[i] >= 0)
+            num_examples = torch.sum(labels[batch_size - 1] >= 0)
             positive_weights = 1.0 / num_examples
             negative_weights = 1.0 / num_examples
         else:
@@ -153,32 +124,26 @@ class _AnchorTargetLayer(nn.Module):
         bbox_outside_weights[labels == 1] = positive_weights
         bbox_outside_weights[labels == 0] = negative_weights
 
-        labels = _unmap(labels, total_anchors, inds_inside, batch_size, fill=-1)
-        bbox_targets = _unmap(bbox_targets, total_anchors, inds_inside, batch_size, fill=0)
-        bbox_inside_weights = _unmap(bbox_inside_weights, total_anchors, inds_inside, batch_size, fill=0)
-        bbox_outside_weights = _unmap(bbox_outside_weights, total_anchors, inds_inside, batch_size, fill=0)
+        labels, bbox_targets, bbox_inside_weights, bbox_outside_weights = _unmap(
+            (labels, bbox_targets, bbox_inside_weights, bbox_outside_weights), (-1, 0, 0, 0),
+            total_anchors, inds_inside)
 
         outputs = []
 
-        labels = labels.view(batch_size, height, width, A).permute(0, 3, 1, 2).contiguous()
+        labels = labels.contiguous().view(batch_size, height, width, A).permute(0, 3, 1, 2).contiguous()
         labels = labels.view(batch_size, 1, A * height, width)
         outputs.append(labels)
 
-        bbox_targets = bbox_targets.view(batch_size, height, width, A*4).permute(0, 3, 1, 2)\
+        bbox_targets = bbox_targets.contiguous().view(batch_size, height, width, A*4).permute(0, 3, 1, 2)\
             .contiguous()
         outputs.append(bbox_targets)
 
-        anchors_count = bbox_inside_weights.size(1)
-        bbox_inside_weights = bbox_inside_weights.view(batch_size, anchors_count, 1)\
-            .expand(batch_size, anchors_count, 4)
-
+        bbox_inside_weights = bbox_inside_weights.unsqueeze(2).expand(batch_size, total_anchors, 4)
         bbox_inside_weights = bbox_inside_weights.contiguous().view(batch_size, height, width, 4*A)\
             .permute(0, 3, 1, 2).contiguous()
-
         outputs.append(bbox_inside_weights)
 
-        bbox_outside_weights = bbox_outside_weights.view(batch_size, anchors_count, 1)\
-            .expand(batch_size, anchors_count, 4)
+        bbox_outside_weights = bbox_outside_weights.unsqueeze(2).expand(batch_size, total_anchors, 4)
         bbox_outside_weights = bbox_outside_weights.contiguous().view(batch_size, height, width, 4*A)\
             .permute(0, 3, 1, 2).contiguous()
         outputs.append(bbox_outside_weights)
@@ -194,17 +159,42 @@ class _AnchorTargetLayer(nn.Module):
         pass
 
 
-def _unmap(data, count, inds, batch_size, fill=0):
-    """ Unmap a subset of item (data) back to the original set of items (of
-    size count) """
+def _subsample_labels(labels, label, max_nums):
+    """Randomly sets all but max_nums[i] of the labels of image i that equal label to -1 (dont care), in place.
 
-    if data.dim() == 2:
-        ret = torch.Tensor(batch_size, count).fill_(fill).type_as(data)
-        ret[:, inds] = data
-    else:
-        ret = torch.Tensor(batch_size, count, data.size(2)).fill_(fill).type_as(data)
-        ret[:, inds, :] = data
-    return ret
+    Every candidate gets a random key and the max_nums[i] largest keys are sampled, so all the images
+    are subsampled at once on the device of labels.
+    """
+    is_label = labels == label
+    num_samples = min(int(max_nums.max()), labels.size(1))
+    is_sampled = labels.new(labels.size()).zero_()
+    if num_samples > 0:
+        keys = labels.new(labels.size()).uniform_().masked_fill_(is_label == 0, -1)
+        _, sampled_idxs = torch.topk(keys, num_samples, 1)
+        # topk is sorted, so the first max_nums[i] columns are the samples of image i
+        ranks = torch.arange(0, num_samples).view(1, num_samples).type_as(max_nums)
+        is_sampled.scatter_(1, sampled_idxs, (ranks < max_nums.view(-1, 1)).type_as(labels))
+    labels[is_label & (is_sampled == 0)] = -1
+
+
+def _unmap(datas, fills, count, inds):
+    """ Unmap subsets of items (datas, each of shape (batch_size, len(inds)[, C])) back to the original
+    sets of items (of size count), with a single copy into one buffer """
+    batch_size = datas[0].size(0)
+    datas = [data if data.dim() == 3 else data.unsqueeze(2) for data in datas]
+    widths = [data.size(2) for data in datas]
+    ret = datas[0].new(batch_size, count, sum(widths))
+    start = 0
+    for width, fill in zip(widths, fills):
+        ret[:, :, start:start + width].fill_(fill)
+        start += width
+    ret.index_copy_(1, inds, torch.cat(datas, 2))
+    rets = []
+    start = 0
+    for width in widths:
+        rets.append(ret[:, :, start] if width == 1 else ret[:, :, start:start + width])
+        start += width
+    return rets
 
 
 def _compute_targets_batch(ex_rois, gt_rois):
@@ -10,6 +10,8 @@
 
 import torch
 
+from model.utils.mixed_precision import run_in_fp32
+
 
 def bbox_transform(ex_rois, gt_rois):
     ex_widths = ex_rois[:, 2] - ex_rois[:, 0] + 1.0
@@ -74,6 +76,7 @@ def bbox_transform_batch(ex_rois, gt_rois):
     return targets
 
 
+@run_in_fp32
 def bbox_transform_inv(reference_boxes, deltas_from_ref, batch_size):
     widths = reference_boxes[:, :, 2] - reference_boxes[:, :, 0] + 1.0
     heights = reference_boxes[:, :, 3] - reference_boxes[:, :, 1] + 1.0
@@ -165,6 +168,7 @@ def bbox_overlaps(anchors, gt_boxes):
     return overlaps
 
 
+@run_in_fp32
 def bbox_overlaps_batch(anchors, gt_boxes):
     """
     anchors: (N, 4) ndarray of float
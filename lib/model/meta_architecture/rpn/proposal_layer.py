@@ -1,12 +1,11 @@
 from __future__ import absolute_import
 
-import numpy as np
 import torch
 import torch.nn as nn
 
-from model.meta_architecture.nms.nms_wrapper import nms
+from model.meta_architecture.nms.nms_wrapper import batched_nms
+from .anchor_generator import AnchorGenerator
 from .bbox_transform import bbox_transform_inv, clip_boxes
-from .generate_anchors import generate_anchors
 
 # --------------------------------------------------------
 # Faster R-CNN
@@ -27,13 +26,14 @@ class _ProposalLayer(nn.Module):
     transformations to a set of regular boxes (called "anchors").
     """
 
-    def __init__(self, feat_stride, scales, ratios, cfg):
+    def __init__(self, feat_stride, scales, ratios, cfg, anchor_generator=None):
         super(_ProposalLayer, self).__init__()
 
         self._feat_stride = feat_stride
-        self._anchors = torch.from_numpy(
-            generate_anchors(scales=np.array(scales), ratios=np.array(ratios))).float()
-        self._num_anchors = self._anchors.size(0)
+        if anchor_generator is None:
+            anchor_generator = AnchorGenerator(feat_stride, scales, ratios)
+        self._anchor_generator = anchor_generator
+        self._num_anchors = anchor_generator.num_anchors
         self.cfg = cfg
 
     def forward(self, input):
@@ -65,19 +65,9 @@ class _ProposalLayer(nn.Module):
         batch_size = bbox_deltas.size(0)
 
         feat_height, feat_width = scores.size(2), scores.size(3)
-        shift_x = np.arange(0, feat_width) * self._feat_stride
-        shift_y = np.arange(0, feat_height) * self._feat_stride
-        shift_x, shift_y = np.meshgrid(shift_x, shift_y)
-        shifts = torch.from_numpy(np.vstack((shift_x.ravel(), shift_y.ravel(),
-                                  shift_x.ravel(), shift_y.ravel())).transpose())
-        shifts = shifts.contiguous().type_as(scores).float()
-
-        A = self._num_anchors
-        K = shifts.size(0)
-
-        self._anchors = self._anchors.type_as(scores)
-        anchors = self._anchors.view(1, A, 4) + shifts.view(K, 1, 4)
-        anchors = anchors.view(1, K * A, 4).expand(batch_size, K * A, 4)
+        anchors = self._anchor_generator.grid_anchors(feat_height, feat_width, scores)
+        num_all_anchors = anchors.size(0)
+        anchors = anchors.view(1, num_all_anchors, 4).expand(batch_size, num_all_anchors, 4)
 
         # Transpose and reshape predicted bbox transformations to get them
         # into the same order as the anchors:
@@ -94,57 +84,53 @@ class _ProposalLayer(nn.Module):
 
         # 2. clip predicted boxes to image
         proposals = clip_boxes(proposals, im_info, batch_size)
-        # proposals = clip_boxes_batch(proposals, im_info, batch_size)
-
-        # assign the score to 0 if it's non keep.
-        # keep = self._filter_boxes(proposals, min_size * im_info[:, 2])
-
-        # trim keep index to make it euqal over batch
-        # keep_idx = torch.cat(tuple(keep_idx), 0)
 
-        # scores_keep = scores.view(-1)[keep_idx].view(batch_size, trim_size)
-        # proposals_keep = proposals.view(-1, 4)[keep_idx, :].contiguous().view(batch_size, trim_size, 4)
-        
-        # _, order = torch.sort(scores_keep, 1, True)
-        
-        scores_keep = scores
-        proposals_keep = proposals
-        _, order = torch.sort(scores_keep, 1, True)
+        # 3. remove predicted boxes with either height or width < threshold
+        # (NOTE: convert min_size to input image scale stored in im_info[2])
+        # the scores of removed boxes are pushed below all probabilities, so they are only picked by the top k
+        # when an image has less than pre_nms_topN valid boxes, and they are dropped right after it.
+        is_valid = self._filter_boxes(proposals, min_size * im_info[:, 2])
+        scores = scores.masked_fill(is_valid == 0, -1)
+
+        # 4. sort all (proposal, score) pairs by score from highest to lowest
+        # 5. take top pre_nms_topN (e.g. 6000)
+        if 0 < pre_nms_topN < scores.size(1):
+            scores_keep, order = torch.topk(scores, pre_nms_topN, 1)
+        else:
+            scores_keep, order = torch.sort(scores, 1, True)
+        num_keep = order.size(1)
+        proposals_keep = proposals.gather(1, order.unsqueeze(2).expand(batch_size, num_keep, 4))
+        img_idxs = torch.arange(0, batch_size).view(batch_size, 1).expand(batch_size, num_keep).type_as(order)
 
         output = scores.new(batch_size, post_nms_topN, 5).zero_()
-        for i in range(batch_size):
-            # 3. remove predicted boxes with either height or width < threshold
-            # (NOTE: convert min_size to input image scale stored in im_info[2])
-            proposals_single = proposals_keep[i]
-            scores_single = scores_keep[i]
-
-            # 4. sort all (proposal, score) pairs by score from highest to lowest
-            # 5. take top pre_nms_topN (e.g. 6000)
-            order_single = order[i]
-
-            if 0 < pre_nms_topN < scores_keep.numel():
-                order_single = order_single[:pre_nms_topN]
-
-            proposals_single = proposals_single[order_single, :]
-            scores_single = scores_single[order_single].view(-1, 1)
-
-            # 6. apply nms (e.g. threshold = 0.7)
-            # 7. take after_nms_topN (e.g. 300)
-            # 8. return the top proposals (-> RoIs top)
-
-            keep_idx_i = nms(torch.cat((proposals_single, scores_single), 1),
-                             nms_thresh, force_cpu=not self.cfg.USE_GPU_NMS)
-            keep_idx_i = keep_idx_i.long().view(-1)
-
-            if post_nms_topN > 0:
-                keep_idx_i = keep_idx_i[:post_nms_topN]
-            proposals_single = proposals_single[keep_idx_i, :]
-            scores_single = scores_single[keep_idx_i, :]
-
-            # padding 0 at the end.
-            num_proposal = proposals_single.size(0)
-            output[i, :, 0] = i
-            output[i, :num_proposal, 1:] = proposals_single
+        output[:, :, 0] = torch.arange(0, batch_size).view(batch_size, 1).type_as(output)
+
+        valid_idxs = torch.nonzero(scores_keep.view(-1) >= 0).view(-1)
+        if valid_idxs.numel() == 0:
+            return output
+        scores_keep = scores_keep.contiguous().view(-1)[valid_idxs]
+        proposals_keep = proposals_keep.contiguous().view(-1, 4)[valid_idxs]
+        img_idxs = img_idxs.contiguous().view(-1)[valid_idxs]
+
+        # 6. apply nms (e.g. threshold = 0.7) to the proposals of all images in a single call,
+        # every image is its own nms group, so the proposals need to be sorted over all images
+        scores_keep, order = torch.sort(scores_keep, 0, True)
+        proposals_keep = proposals_keep[order]
+        img_idxs = img_idxs[order]
+        keep_idx = batched_nms(torch.cat((proposals_keep, scores_keep.view(-1, 1)), 1), img_idxs,
+                               nms_thresh, force_cpu=not self.cfg.USE_GPU_NMS)
+        keep_idx = keep_idx.long().view(-1)
+        proposals_keep = proposals_keep[keep_idx]
+        img_idxs = img_idxs[keep_idx]
+
+        # 7. take after_nms_topN (e.g. 300)
+        # 8. return the top proposals (-> RoIs top), padded with 0 at the end of every image
+        # the kept proposals are still sorted by score, so the rank of a proposal in its image is a running count
+        is_img = (img_idxs.view(-1, 1) == torch.arange(0, batch_size).view(1, batch_size).type_as(img_idxs)).long()
+        ranks = is_img.cumsum(0).gather(1, img_idxs.view(-1, 1)).view(-1) - 1
+        top_idxs = torch.nonzero(ranks < post_nms_topN).view(-1)
+        rois = torch.cat((img_idxs[top_idxs].view(-1, 1).type_as(output), proposals_keep[top_idxs]), 1)
+        output.view(-1, 5).index_copy_(0, img_idxs[top_idxs] * post_nms_topN + ranks[top_idxs], rois)
 
         return output
 
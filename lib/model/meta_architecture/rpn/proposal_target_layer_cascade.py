@@ -74,21 +74,10 @@ class _ProposalTargetLayer(nn.Module):
             bbox_target (ndarray): b x N x 4K blob of regression targets
             bbox_inside_weights (ndarray): b x N x 4K blob of loss weights
         """
-        batch_size = labels_batch.size(0)
-        rois_per_image = labels_batch.size(1)
-        clss = labels_batch
-        bbox_targets = bbox_target_data.new(batch_size, rois_per_image, 4).zero_()
-        bbox_inside_weights = bbox_target_data.new(bbox_targets.size()).zero_()
-
-        for b in range(batch_size):
-            # assert clss[b].sum() > 0
-            if clss[b].sum() == 0:
-                continue
-            inds = torch.nonzero(clss[b] > 0).view(-1)
-            for i in range(inds.numel()):
-                ind = inds[i]
-                bbox_targets[b, ind, :] = bbox_target_data[b, ind, :]
-                bbox_inside_weights[b, ind, :] = self.BBOX_INSIDE_WEIGHTS
+        # the targets and weights of the background RoIs (label 0) are zero
+        is_bg = (labels_batch == 0).unsqueeze(2).expand_as(bbox_target_data)
+        bbox_targets = bbox_target_data.masked_fill(is_bg, 0)
+        bbox_inside_weights = self.BBOX_INSIDE_WEIGHTS.view(1, 1, 4).expand_as(bbox_target_data).masked_fill(is_bg, 0)
 
         return bbox_targets, bbox_inside_weights
 
@@ -125,82 +114,50 @@ class _ProposalTargetLayer(nn.Module):
         num_proposal = overlaps.size(1)
         num_boxes_per_img = overlaps.size(2)
 
-        offset = torch.arange(0, batch_size)*gt_boxes.size(1)
-        offset = offset.view(-1, 1).type_as(gt_assignment) + gt_assignment
+        labels = gt_boxes[:, :, 4].gather(1, gt_assignment)
 
-        labels = gt_boxes[:, :, 4].contiguous().view(-1)\
-            .index(offset.view(-1)).view(batch_size, -1)
+        is_fg = max_overlaps >= self.cfg.TRAIN.FG_THRESH
+        # Select background RoIs as those within [BG_THRESH_LO, BG_THRESH_HI)
+        is_bg = (max_overlaps < self.cfg.TRAIN.BG_THRESH_HI) & (max_overlaps >= self.cfg.TRAIN.BG_THRESH_LO)
+        fg_num_rois = torch.sum(is_fg.long(), 1)
+        bg_num_rois = torch.sum(is_bg.long(), 1)
+        has_fg = (fg_num_rois > 0).long()
+        has_bg = (bg_num_rois > 0).long()
+        if torch.sum((1 - has_fg) * (1 - has_bg)) > 0:
+            raise ValueError("bg_num_rois = 0 and fg_num_rois = 0, this should not happen!")
+
+        # The fg RoIs of every image in a random order (followed by the other RoIs), and the same for bg.
+        # Random keys are drawn on the device, instead of a numpy permutation per image.
+        fg_perm = self._random_order(is_fg, max_overlaps)
+        bg_perm = self._random_order(is_bg, max_overlaps)
 
-        labels_batch = labels.new(batch_size, rois_per_image).zero_()
-        rois_batch = all_rois.new(batch_size, rois_per_image, 5).zero_()
-        gt_rois_batch = all_rois.new(batch_size, rois_per_image, 5).zero_()
         # Guard against the case when an image has fewer than max_fg_rois_per_image
-        # foreground RoIs
-        for i in range(batch_size):
-            fg_inds = torch.nonzero(max_overlaps[i] >= self.cfg.TRAIN.FG_THRESH).view(-1)
-            fg_num_rois = fg_inds.numel()
-
-            # Select background RoIs as those within [BG_THRESH_LO, BG_THRESH_HI)
-            bg_inds = torch.nonzero((max_overlaps[i] < self.cfg.TRAIN.BG_THRESH_HI) &
-                                    (max_overlaps[i] >= self.cfg.TRAIN.BG_THRESH_LO)).view(-1)
-            bg_num_rois = bg_inds.numel()
-
-            if fg_num_rois > 0 and bg_num_rois > 0:
-                # sampling fg
-                fg_rois_per_this_image = min(fg_rois_per_image, fg_num_rois)
-                
-                # torch.randperm seems has a bug on multi-gpu setting that cause the segfault. 
-                # See https://github.com/pytorch/pytorch/issues/1868 for more details.
-                # use numpy instead.
-                # rand_num = torch.randperm(fg_num_rois).long().cuda()
-                rand_num = torch.from_numpy(np.random.permutation(fg_num_rois)).type_as(gt_boxes).long()
-                fg_inds = fg_inds[rand_num[:fg_rois_per_this_image]]
-
-                # sampling bg
-                bg_rois_per_this_image = rois_per_image - fg_rois_per_this_image
-
-                # Seems torch.rand has a bug, it will generate very large number and make an error. 
-                # We use numpy rand instead. 
-                # rand_num = (torch.rand(bg_rois_per_this_image) * bg_num_rois).long().cuda()
-                rand_num = np.floor(np.random.rand(bg_rois_per_this_image) * bg_num_rois)
-                rand_num = torch.from_numpy(rand_num).type_as(gt_boxes).long()
-                bg_inds = bg_inds[rand_num]
-
-            elif fg_num_rois > 0 and bg_num_rois == 0:
-                # sampling fg
-                # rand_num = torch.floor(torch.rand(rois_per_image) * fg_num_rois).long().cuda()
-                rand_num = np.floor(np.random.rand(rois_per_image) * fg_num_rois)
-                rand_num = torch.from_numpy(rand_num).type_as(gt_boxes).long()
-                fg_inds = fg_inds[rand_num]
-                fg_rois_per_this_image = rois_per_image
-                bg_rois_per_this_image = 0
-
-            elif bg_num_rois > 0 and fg_num_rois == 0:
-                # sampling bg
-                # rand_num = torch.floor(torch.rand(rois_per_image) * bg_num_rois).long().cuda()
-                rand_num = np.floor(np.random.rand(rois_per_image) * bg_num_rois)
-                rand_num = torch.from_numpy(rand_num).type_as(gt_boxes).long()
-
-                bg_inds = bg_inds[rand_num]
-                bg_rois_per_this_image = rois_per_image
-                fg_rois_per_this_image = 0
-            else:
-                raise ValueError("bg_num_rois = 0 and fg_num_rois = 0, this should not happen!")
-                
-            # The indices that we're selecting (both fg and bg)
-            keep_inds = torch.cat([fg_inds, bg_inds], 0)
-
-            # Select sampled values from various arrays:
-            labels_batch[i].copy_(labels[i][keep_inds])
-
-            # Clamp labels for the background RoIs to 0
-            if fg_rois_per_this_image < rois_per_image:
-                labels_batch[i][fg_rois_per_this_image:] = 0
-
-            rois_batch[i] = all_rois[i][keep_inds]
-            rois_batch[i, :, 0] = i
-
-            gt_rois_batch[i] = gt_boxes[i][gt_assignment[i][keep_inds]]
+        # foreground RoIs: when there are bg RoIs, the fg RoIs are sampled without replacement and the
+        # rest of the image is filled with bg RoIs sampled with replacement, otherwise all the RoIs are
+        # sampled with replacement from the only kind there is.
+        fg_rois_per_this_image = has_fg * (has_bg * torch.clamp(fg_num_rois, max=fg_rois_per_image) +
+                                           (1 - has_bg) * rois_per_image)
+        slots = torch.arange(0, rois_per_image).view(1, -1).type_as(fg_num_rois).expand(batch_size, rois_per_image)
+        is_fg_slot = (slots < fg_rois_per_this_image.view(-1, 1)).long()
+
+        # the fg slots past the fg RoIs of an image are masked out below, but must still index one of its RoIs
+        fg_positions = has_bg.view(-1, 1) * torch.clamp(slots, max=num_proposal - 1) + \
+            (1 - has_bg.view(-1, 1)) * self._random_positions(fg_num_rois, rois_per_image, max_overlaps)
+        bg_positions = self._random_positions(bg_num_rois, rois_per_image, max_overlaps)
+
+        # The indices that we're selecting (both fg and bg)
+        keep_inds = is_fg_slot * fg_perm.gather(1, fg_positions) + \
+            (1 - is_fg_slot) * bg_perm.gather(1, bg_positions)
+
+        # Select sampled values from various arrays:
+        # Clamp labels for the background RoIs to 0
+        labels_batch = labels.gather(1, keep_inds) * is_fg_slot.type_as(labels)
+
+        rois_batch = all_rois.gather(1, keep_inds.unsqueeze(2).expand(batch_size, rois_per_image, 5))
+        rois_batch[:, :, 0] = torch.arange(0, batch_size).view(-1, 1).type_as(rois_batch)
+
+        gt_inds = gt_assignment.gather(1, keep_inds)
+        gt_rois_batch = gt_boxes.gather(1, gt_inds.unsqueeze(2).expand(batch_size, rois_per_image, 5))
 
         bbox_target_data = self._compute_targets_pytorch(
                 rois_batch[:, :, 1:5], gt_rois_batch[:, :, :4])
@@ -209,3 +166,18 @@ class _ProposalTargetLayer(nn.Module):
             self._get_bbox_regression_labels_pytorch(bbox_target_data, labels_batch, num_classes)
 
         return labels_batch, rois_batch, bbox_targets, bbox_inside_weights
+
+    @staticmethod
+    def _random_order(mask, like_tensor):
+        """Per row, the indices of the entries of mask in a random order, followed by the other indices."""
+        keys = like_tensor.new(mask.size()).uniform_().masked_fill_(mask == 0, -1)
+        _, order = torch.sort(keys, 1, True)
+        return order
+
+    @staticmethod
+    def _random_positions(nums, num_samples, like_tensor):
+        """(len(nums), num_samples) positions drawn uniformly with replacement from [0, nums[i]) in row i
+        (0 where nums[i] is 0)."""
+        rand = like_tensor.new(nums.size(0), num_samples).uniform_()
+        positions = torch.floor(rand * nums.view(-1, 1).type_as(rand)).long()
+        return torch.min(positions, torch.clamp(nums - 1, min=0).view(-1, 1).expand_as(positions))
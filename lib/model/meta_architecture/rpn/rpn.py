@@ -6,6 +6,7 @@ import torch.nn.functional as F
 from torch.autograd import Variable
 
 from model.utils.net_utils import _smooth_l1_loss
+from .anchor_generator import AnchorGenerator
 from .anchor_target_layer import _AnchorTargetLayer
 from .proposal_layer import _ProposalLayer
 
@@ -33,11 +34,16 @@ class _RPN(nn.Module):
         self.nc_bbox_out = len(self.anchor_scales) * len(self.anchor_ratios) * 4
         self.RPN_bbox_pred = nn.Conv2d(512, self.nc_bbox_out, 1, 1, 0)
 
+        # anchors are shared by the proposal and anchor target layers
+        anchor_generator = AnchorGenerator(self.feat_stride, self.anchor_scales, self.anchor_ratios)
+
         # define proposal layer
-        self.RPN_proposal = _ProposalLayer(self.feat_stride, self.anchor_scales, self.anchor_ratios, cfg)
+        self.RPN_proposal = _ProposalLayer(self.feat_stride, self.anchor_scales, self.anchor_ratios, cfg,
+                                           anchor_generator)
 
         # define anchor target layer
-        self.RPN_anchor_target = _AnchorTargetLayer(self.feat_stride, self.anchor_scales, self.anchor_ratios, cfg)
+        self.RPN_anchor_target = _AnchorTargetLayer(self.feat_stride, self.anchor_scales, self.anchor_ratios, cfg,
+                                                    anchor_generator)
 
         self.rpn_loss_cls = 0
         self.rpn_loss_box = 0
@@ -61,7 +67,7 @@ class _RPN(nn.Module):
         rpn_cls_score = self.RPN_cls_score(rpn_conv1)
 
         rpn_cls_score_reshape = self.reshape(rpn_cls_score, 2)
-        rpn_cls_prob_reshape = F.softmax(rpn_cls_score_reshape)
+        rpn_cls_prob_reshape = F.softmax(rpn_cls_score_reshape.float())
         rpn_cls_prob = self.reshape(rpn_cls_prob_reshape, self.nc_score_out)
 
         # get rpn offsets to the anchor boxes
@@ -90,7 +96,7 @@ class _RPN(nn.Module):
             rpn_cls_score = torch.index_select(rpn_cls_score.view(-1, 2), 0, rpn_keep)
             rpn_label = torch.index_select(rpn_label.view(-1), 0, rpn_keep.data)
             rpn_label = Variable(rpn_label.long())
-            self.rpn_loss_cls = F.cross_entropy(rpn_cls_score, rpn_label)
+            self.rpn_loss_cls = F.cross_entropy(rpn_cls_score.float(), rpn_label)
             fg_cnt = torch.sum(rpn_label.data.ne(0))
 
             rpn_bbox_targets, rpn_bbox_inside_weights, rpn_bbox_outside_weights = rpn_data[1:]
@@ -0,0 +1,22 @@
+import hashlib
+
+import torch
+
+from utils.npy_file_cache import NpyFileCache
+
+
+def get_cache_namespace(*values):
+    """Short name that changes with any of values, for the sub directory of features computed in the same way."""
+    return hashlib.sha1(repr(values).encode('utf-8')).hexdigest()[:16]
+
+
+class FeatureCache(NpyFileCache):
+    """NpyFileCache of feature map tensors, read back on the CPU."""
+
+    def get(self, key):
+        """The cached tensor of key, or None."""
+        array = super(FeatureCache, self).get(key)
+        return None if array is None else torch.from_numpy(array)
+
+    def put(self, key, tensor):
+        super(FeatureCache, self).put(key, tensor.detach().cpu().numpy())
@@ -0,0 +1,150 @@
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+import torch
+
+logger = logging.getLogger(__name__)
+
+# submodules of FasterRCNN that are timed, '' is the whole forward pass
+FASTER_RCNN_STAGES = ['',
+                      'rpn_fe',
+                      'rpn_and_nms',
+                      'rpn_and_nms.RPN_proposal',
+                      'rpn_and_nms.RPN_anchor_target',
+                      'rpn_proposal_target',
+                      'roi_pooler',
+                      'fast_rcnn_feature_extractor',
+                      'fast_rcnn_bbox_head',
+                      'fast_rcnn_cls_head']
+
+_PERCENTILES = [50, 90, 99]
+_MB = 1024. ** 2
+
+
+def _reset_peak_mem():
+    # older versions of pytorch can't reset the peak, it is then the peak since the start of the process
+    if hasattr(torch.cuda, 'reset_peak_memory_stats'):
+        torch.cuda.reset_peak_memory_stats()
+    elif hasattr(torch.cuda, 'reset_max_memory_allocated'):
+        torch.cuda.reset_max_memory_allocated()
+
+
+class ForwardProfiler(object):
+    """Records the latency and peak GPU memory of every stage of a model's forward pass.
+
+    Forward hooks are registered on the given submodules, so the model itself is not changed and the profiler
+    can be detached at any time. On CUDA every hook synchronizes the device, which makes the timings exact
+    but slows the forward pass down, so it should only be attached while profiling.
+    Peak memory of a stage includes the stages nested in it.
+    """
+
+    def __init__(self, model, is_cuda, stage_names=FASTER_RCNN_STAGES, max_trace_events=100000):
+        self._is_cuda = is_cuda
+        self._max_trace_events = max_trace_events
+        modules = dict(model.named_modules())
+        self._stages = OrderedDict((name if name else 'forward', modules[name])
+                                   for name in stage_names if name in modules)
+        self._hook_handles = []
+        self._open_stages = threading.local()
+        self._start_time = time.perf_counter()
+        self._iteration = -1
+        self._trace_events = []
+        self.reset()
+
+    def attach(self):
+        for stage_name, module in self._stages.items():
+            self._hook_handles.append(module.register_forward_pre_hook(self._create_pre_hook(stage_name)))
+            self._hook_handles.append(module.register_forward_hook(self._create_post_hook(stage_name)))
+        return self
+
+    def detach(self):
+        for handle in self._hook_handles:
+            handle.remove()
+        self._hook_handles = []
+
+    def reset(self):
+        """Clears the aggregated statistics, the chrome trace is kept."""
+        self._latencies = OrderedDict((stage_name, []) for stage_name in self._stages)
+        self._peak_mems = OrderedDict((stage_name, []) for stage_name in self._stages)
+
+    def _get_stack(self):
+        if not hasattr(self._open_stages, 'stack'):
+            self._open_stages.stack = []
+        return self._open_stages.stack
+
+    def _create_pre_hook(self, stage_name):
+        def pre_hook(module, inputs):
+            stack = self._get_stack()
+            if not stack:
+                self._iteration += 1
+            if self._is_cuda:
+                torch.cuda.synchronize()
+                if stack:
+                    # the enclosing stage already reached this peak, before it is reset for the nested one
+                    stack[-1]['peak_mem'] = max(stack[-1]['peak_mem'], torch.cuda.max_memory_allocated())
+                _reset_peak_mem()
+            stack.append({'start': time.perf_counter(), 'peak_mem': 0})
+        return pre_hook
+
+    def _create_post_hook(self, stage_name):
+        def post_hook(module, inputs, outputs):
+            stack = self._get_stack()
+            if self._is_cuda:
+                torch.cuda.synchronize()
+            end = time.perf_counter()
+            stage = stack.pop()
+            latency = end - stage['start']
+            self._latencies[stage_name].append(latency)
+            args = {'iteration': self._iteration}
+            if self._is_cuda:
+                peak_mem = max(stage['peak_mem'], torch.cuda.max_memory_allocated())
+                if stack:
+                    stack[-1]['peak_mem'] = max(stack[-1]['peak_mem'], peak_mem)
+                self._peak_mems[stage_name].append(peak_mem / _MB)
+                args['peak_mem_mb'] = peak_mem / _MB
+            if len(self._trace_events) < self._max_trace_events:
+                self._trace_events.append({'name': stage_name, 'ph': 'X', 'pid': 0,
+                                           'tid': threading.get_ident(),
+                                           'ts': (stage['start'] - self._start_time) * 1e6,
+                                           'dur': latency * 1e6,
+                                           'args': args})
+        return post_hook
+
+    def summary(self):
+        """Returns {stage_name: {'count', 'mean_ms', 'p50_ms', 'p90_ms', 'p99_ms'[, 'max_peak_mem_mb']}}."""
+        stats = OrderedDict()
+        for stage_name, latencies in self._latencies.items():
+            if not latencies:
+                continue
+            latencies_ms = np.array(latencies) * 1000
+            stage_stats = OrderedDict([('count', len(latencies_ms)), ('mean_ms', float(latencies_ms.mean()))])
+            for p, value in zip(_PERCENTILES, np.percentile(latencies_ms, _PERCENTILES)):
+                stage_stats['p{}_ms'.format(p)] = float(value)
+            if self._peak_mems[stage_name]:
+                stage_stats['max_peak_mem_mb'] = float(np.max(self._peak_mems[stage_name]))
+            stats[stage_name] = stage_stats
+        return stats
+
+    def log_summary(self, train_logger=None, step=None):
+        """Logs the summary, and writes it to train_logger (as profiling/<stage>/<stat> scalars) if given."""
+        stats = self.summary()
+        logged_string = "Forward pass profile:"
+        for stage_name, stage_stats in stats.items():
+            logged_string += "\n\t\t{0}: {1}".format(
+                stage_name, ", ".join("{0}: {1:.2f}".format(k, v) for k, v in stage_stats.items() if k != 'count'))
+            if train_logger is not None:
+                for stat_name, value in stage_stats.items():
+                    if stat_name != 'count':
+                        train_logger.scalar_summary('profiling/{}/{}'.format(stage_name, stat_name), value, step)
+        logger.info(logged_string)
+        return stats
+
+    def export_chrome_trace(self, trace_path):
+        """Writes the recorded stages in the Chrome trace format (open it in chrome://tracing or Perfetto)."""
+        with open(trace_path, 'w') as f:
+            json.dump({'traceEvents': self._trace_events, 'displayTimeUnit': 'ms'}, f)
+        logger.info("Forward pass trace was written to: {}.".format(trace_path))
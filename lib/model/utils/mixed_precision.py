@@ -0,0 +1,80 @@
+import contextlib
+import functools
+
+import torch
+
+# values of TRAIN.precision, and the name of the torch dtype autocast runs the eligible ops in, looked up when
+# used, the older versions of pytorch (which can only train in fp32) don't have them
+PRECISION_DTYPES = {'fp32': None,
+                    'fp16': 'float16',
+                    'bf16': 'bfloat16'}
+
+
+def _get_device_type(is_cuda):
+    return 'cuda' if is_cuda else 'cpu'
+
+
+def _check_precision(precision, is_cuda):
+    if precision not in PRECISION_DTYPES:
+        raise ValueError("Unexpected precision {} - should be one of {}".format(precision, list(PRECISION_DTYPES)))
+    if precision != 'fp32' and not hasattr(torch, 'autocast'):
+        raise RuntimeError("Precision {} needs pytorch >= 1.10 (torch.autocast), found pytorch {}".format(
+            precision, torch.__version__))
+    if precision == 'fp16' and not is_cuda:
+        raise ValueError("fp16 training is only supported on the GPU, use bf16 on the CPU")
+
+
+def autocast(precision, is_cuda):
+    """Context manager that runs the forward pass in the given precision, a no-op for fp32."""
+    _check_precision(precision, is_cuda)
+    if precision == 'fp32':
+        return contextlib.ExitStack()
+    return torch.autocast(device_type=_get_device_type(is_cuda), dtype=getattr(torch, PRECISION_DTYPES[precision]))
+
+
+def create_grad_scaler(precision, is_cuda):
+    """Dynamic loss scaling, only enabled for fp16 (bf16 has the range of fp32 and doesn't underflow).
+
+    None for fp32 on the versions of pytorch without a GradScaler.
+    """
+    _check_precision(precision, is_cuda)
+    enabled = precision == 'fp16'
+    if hasattr(torch, 'amp') and hasattr(torch.amp, 'GradScaler'):
+        return torch.amp.GradScaler(_get_device_type(is_cuda), enabled=enabled)
+    if hasattr(torch.cuda, 'amp') and hasattr(torch.cuda.amp, 'GradScaler'):
+        return torch.cuda.amp.GradScaler(enabled=enabled)
+    return None
+
+
+def _is_autocast_enabled(device_type):
+    try:
+        return torch.is_autocast_enabled(device_type)
+    except TypeError:
+        # older versions of pytorch have one function per device type
+        if device_type == 'cuda':
+            return torch.is_autocast_enabled()
+        return hasattr(torch, 'is_autocast_cpu_enabled') and torch.is_autocast_cpu_enabled()
+
+
+def _to_fp32(value):
+    if torch.is_tensor(value) and value.is_floating_point() and value.dtype != torch.float32:
+        return value.float()
+    return value
+
+
+def run_in_fp32(fn):
+    """Decorator for precision sensitive functions: runs fn with autocast disabled and its low precision tensor
+    arguments cast to fp32. Doesn't change anything when autocast is not enabled.
+    """
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        if not hasattr(torch, 'autocast'):
+            return fn(*args, **kwargs)
+        enabled_device_types = [device_type for device_type in ['cuda', 'cpu'] if _is_autocast_enabled(device_type)]
+        if not enabled_device_types:
+            return fn(*args, **kwargs)
+        with contextlib.ExitStack() as stack:
+            for device_type in enabled_device_types:
+                stack.enter_context(torch.autocast(device_type=device_type, enabled=False))
+            return fn(*[_to_fp32(arg) for arg in args], **{k: _to_fp32(v) for k, v in kwargs.items()})
+    return wrapper
@@ -1,5 +1,10 @@
+import inspect
+
 import numpy as np
 import torch
+from torch.utils.checkpoint import checkpoint
+
+from model.utils.mixed_precision import run_in_fp32
 
 
 def clip_gradient(model, clip_norm):
@@ -24,6 +29,7 @@ def decay_lr_in_optimizer(epoch, lr_decay_step, optimizer, decay=0.1):
     return optimizer
 
 
+@run_in_fp32
 def _smooth_l1_loss(bbox_pred, bbox_targets, bbox_inside_weights, bbox_outside_weights,
                     sigma=1.0, dim=[1]):
     sigma_2 = sigma ** 2
@@ -52,3 +58,19 @@ def global_average_pooling(input):
 
 def remove_last_layer_from_network(model):
     return list(model._modules.values())[:-1]
+
+
+# the non-reentrant implementation supports inputs that don't require grad, e.g. after frozen blocks
+_CHECKPOINT_KWARGS = {'use_reentrant': False} if 'use_reentrant' in inspect.signature(checkpoint).parameters else {}
+
+
+def run_checkpointed_blocks(blocks, x):
+    """Runs the blocks (e.g. an nn.Sequential) one after the other, keeping only the input of every block for the
+    backward pass, which recomputes the activations inside the block. Without autograd it is a plain forward pass.
+    """
+    for block in blocks:
+        if torch.is_grad_enabled() and (x.requires_grad or any(p.requires_grad for p in block.parameters())):
+            x = checkpoint(block, x, **_CHECKPOINT_KWARGS)
+        else:
+            x = block(x)
+    return x
@@ -2,31 +2,37 @@ import logging
 
 import os
 import torch
-
-from model.meta_architecture.faster_rcnn import FasterRCNN
+import torch.nn as nn
+from torch.nn.parallel import DistributedDataParallel
 
 
 logger = logging.getLogger(__name__)
 
 
-def save_session_to_ckpt(model, optimizer, cfg, epoch):
-    if cfg.mGPUs:
-        model_state_dict = model.module.state_dict()
-    else:
-        model_state_dict = model.state_dict()
+def save_session_to_ckpt(model, optimizer, cfg, epoch, grad_scaler=None):
+    if isinstance(model, (nn.DataParallel, DistributedDataParallel)):
+        model = model.module
+    model_state_dict = model.state_dict()
     save_to = cfg.get_ckpt_path(epoch)
     logger.info('--->>> Saving model checkpoint to: {}'.format(save_to))
     torch.save({'last_performed_epoch': epoch,
                 'model': model_state_dict,
                 'model_cfg_params': model.cfg_params,
                 'optimizer': optimizer.state_dict(),
+                'grad_scaler': grad_scaler.state_dict() if grad_scaler is not None else None,
                 'ckpt_cfg': cfg.get_state_dict()}, save_to)
 
 
-def load_session_from_ckpt(ckpt_path):
+def load_session_from_ckpt(ckpt_path, checkpointed_stages=()):
+    # imported here, saving a session doesn't need the model (and its compiled roi poolers)
+    from model.meta_architecture.faster_rcnn import FasterRCNN
+
     logger.info('--->>> Loading session from checkpoint: {}'.format(ckpt_path))
-    state_dict = torch.load(os.path.abspath(ckpt_path))
-    model, loaded_cfg = FasterRCNN.create_from_ckpt(ckpt_path)
+    state_dict = torch.load(os.path.abspath(ckpt_path), map_location=lambda storage, loc: storage)
+    model, loaded_cfg = FasterRCNN.create_from_ckpt(ckpt_path, checkpointed_stages)
+    # the precision is in the config of the checkpoint, checkpoints from before it was configurable are fp32
+    if 'precision' not in loaded_cfg.TRAIN:
+        loaded_cfg.TRAIN.precision = 'fp32'
 
     def create_optimizer_from_ckpt_fn(trainable_params):
         optimizer = torch.optim.SGD(params=trainable_params, momentum=loaded_cfg.TRAIN.MOMENTUM)
@@ -34,4 +40,4 @@ def load_session_from_ckpt(ckpt_path):
         return optimizer
 
     last_performed_epoch = state_dict['last_performed_epoch']
-    return model, create_optimizer_from_ckpt_fn, loaded_cfg, last_performed_epoch
+    return model, create_optimizer_from_ckpt_fn, loaded_cfg, last_performed_epoch, state_dict.get('grad_scaler')
@@ -6,7 +6,8 @@ import numpy as np
 import os
 import torch
 
-from model.meta_architecture.nms.nms_wrapper import nms
+from model.meta_architecture.nms.nms_wrapper import batched_nms
+from pipeline.faster_rcnn.raw_preds_io import load_raw_preds
 
 logger = logging.getLogger(__name__)
 
@@ -15,72 +16,147 @@ def faster_rcnn_postprocessing(data_manager, model, cfg, num_epoch):
     start_time = time.time()
     num_images = len(data_manager)
     num_classes = data_manager.num_classes
-    preds_file_path = cfg.get_preds_path(num_epoch)
-    logger.info("--->>> Starting postprocessing from :{}".format(preds_file_path))
-    with open(preds_file_path, 'rb') as f:
-        raw_preds = pickle.load(f)
+    preds_dir_path = cfg.get_preds_path(num_epoch, data_manager.shard_id)
+    logger.info("--->>> Starting postprocessing from :{}".format(preds_dir_path))
+    raw_preds = load_raw_preds(preds_dir_path)
     bbox_coords = raw_preds['bbox_coords']
     cls_probs = raw_preds['cls_probs']
 
-    bbox_coords = torch.from_numpy(bbox_coords).cuda()
-    cls_probs = torch.from_numpy(cls_probs).cuda()
-
-    def keep_boxes_above_thresh_per_cls(probs, coords, curr_cls):
-        nonzero_idxs = torch.nonzero(probs[:, curr_cls] > cfg.TEST.DETECTION_THRESH)
-        nonzero_idxs = nonzero_idxs.view(-1)
-        if nonzero_idxs.numel() > 0:
-            filtered_probs = probs[:, curr_cls][nonzero_idxs]
-            if model.cfg_params['is_class_agnostic']:
-                filtered_coords = coords[nonzero_idxs, :]
-            else:
-                coord_idxs_curr_cls = range(curr_cls * 4, (curr_cls + 1) * 4, 1)
-                filtered_coords = coords[nonzero_idxs][:, coord_idxs_curr_cls]
-        else:
-            filtered_coords = np.array([[]])
-            filtered_probs = np.array([[]])
-        return filtered_coords, filtered_probs
-
-    def run_nms_on_unsorted_boxes(probs, coords):
-        if probs.size == 0:
-            return np.transpose(np.array([[], [], [], [], []]))
-        _, sorted_probs_idxs = torch.sort(probs, 0, True)
-        detections_to_keep = torch.cat((coords, probs.unsqueeze(1)), 1)
-        detections_to_keep = detections_to_keep[sorted_probs_idxs]
-        idxs_to_keep = nms(detections_to_keep, cfg.TEST.NMS)
-        detections_to_keep = detections_to_keep[idxs_to_keep.view(-1).long()]
-        return detections_to_keep.cpu().numpy()
-
-    def keep_top_k_detections_in_image(image_detections):
-        k = cfg.TEST.max_per_image
-        if k > 0:
-            cls_probs_per_image = np.hstack([image_detections[c][:, -1] for c in range(1, num_classes)])
-            if len(cls_probs_per_image) > k:
-                prob_thresh = np.sort(cls_probs_per_image)[-k]
-                for c in range(1, num_classes):
-                    boxes_idxs_to_keep = np.where(image_detections[c][:, -1] >= prob_thresh)[0]
-                    image_detections[c] = image_detections[c][boxes_idxs_to_keep, :]
-        return image_detections
-
     postprocessed_detections = np.empty(shape=(num_classes, num_images), dtype='object')
     for i in range(num_images):
-        curr_coords = bbox_coords[i]
-        curr_cls_probs = cls_probs[i]
-        pp_start = time.time()
-        detections_after_nms = np.empty(num_classes, dtype='object')
-        for j in range(1, num_classes):
-            coords_after_thresh, probs_after_thresh = keep_boxes_above_thresh_per_cls(curr_cls_probs, curr_coords, j)
-            detections_after_nms[j] = run_nms_on_unsorted_boxes(probs_after_thresh, coords_after_thresh)
-        postprocessed_detections[:, i] = keep_top_k_detections_in_image(detections_after_nms)
+        curr_coords = torch.from_numpy(np.array(bbox_coords[i]))
+        curr_cls_probs = torch.from_numpy(np.array(cls_probs[i]))
+        if cfg.CUDA:
+            curr_coords = curr_coords.cuda()
+            curr_cls_probs = curr_cls_probs.cuda()
+        postprocessed_detections[:, i] = postprocess_image_preds(
+            curr_cls_probs, curr_coords, num_classes, model.cfg_params['is_class_agnostic'], cfg)
         pp_end = time.time()
 
         if i % cfg.TEST.disp_interval == 0 and i > 0:
             logger.info('Postprocessing in-progress: {0}/{1}: '
                         'avg time per image: {2:.4f} s.'.format(i, num_images, (pp_end-start_time) / (i+1)))
 
-    pp_dets_path = cfg.get_postprocessed_detections_path(num_epoch)
-    with open(pp_dets_path, 'wb') as f:
-        pickle.dump(postprocessed_detections, f)
+    save_postprocessed_detections(postprocessed_detections, cfg, num_epoch,
+                                  data_manager.shard_id, data_manager.image_idxs)
 
     end_time = time.time()
     logger.info("----------- Total postprocessing time {:.4f}s. -----------".format(end_time - start_time))
 
+
+def postprocess_image_preds(cls_probs, bbox_coords, num_classes, is_class_agnostic, cfg):
+    """Turns the raw predictions of a single image into its final detections.
+
+    Boxes are thresholded by cfg.TEST.DETECTION_THRESH and suppressed with cfg.TEST.NMS per class,
+    after which only the cfg.TEST.max_per_image top scoring detections over all classes are kept.
+    All classes go through a single sort and a single class-aware NMS call.
+    Returns an array of length num_classes, holding a #dets x 5 (x1, y1, x2, y2, score) array per class.
+    """
+    image_detections = np.empty(num_classes, dtype='object')
+
+    def keep_boxes_above_thresh():
+        roi_and_cls_idxs = torch.nonzero(cls_probs[:, 1:] > cfg.TEST.DETECTION_THRESH)
+        if roi_and_cls_idxs.numel() == 0:
+            return None, None, None
+        roi_idxs = roi_and_cls_idxs[:, 0]
+        cls_idxs = roi_and_cls_idxs[:, 1] + 1
+        filtered_probs = cls_probs.contiguous().view(-1)[roi_idxs * num_classes + cls_idxs]
+        if is_class_agnostic:
+            filtered_coords = bbox_coords[roi_idxs]
+        else:
+            filtered_coords = bbox_coords.contiguous().view(-1, 4)[roi_idxs * num_classes + cls_idxs]
+        return filtered_coords, filtered_probs, cls_idxs
+
+    def run_class_aware_nms_on_unsorted_boxes(coords, probs, cls_idxs):
+        sorted_probs, sorted_probs_idxs = torch.sort(probs, 0, True)
+        detections_to_keep = torch.cat((coords[sorted_probs_idxs], sorted_probs.unsqueeze(1)), 1)
+        cls_idxs = cls_idxs[sorted_probs_idxs]
+        idxs_to_keep = batched_nms(detections_to_keep, cls_idxs, cfg.TEST.NMS).view(-1).long()
+        return detections_to_keep[idxs_to_keep], cls_idxs[idxs_to_keep]
+
+    def keep_top_k_detections_in_image(detections, cls_idxs):
+        k = cfg.TEST.max_per_image
+        if 0 < k < detections.size(0):
+            # detections are sorted by score, ties with the k-th score are kept as well
+            prob_thresh = detections[k - 1, 4]
+            idxs_to_keep = torch.nonzero(detections[:, 4] >= prob_thresh).view(-1)
+            detections = detections[idxs_to_keep]
+            cls_idxs = cls_idxs[idxs_to_keep]
+        return detections, cls_idxs
+
+    coords_after_thresh, probs_after_thresh, cls_idxs = keep_boxes_above_thresh()
+    if coords_after_thresh is None:
+        for j in range(1, num_classes):
+            image_detections[j] = np.zeros((0, 5), dtype=np.float32)
+        return image_detections
+
+    detections, cls_idxs = run_class_aware_nms_on_unsorted_boxes(coords_after_thresh, probs_after_thresh, cls_idxs)
+    detections, cls_idxs = keep_top_k_detections_in_image(detections, cls_idxs)
+
+    detections = detections.cpu().numpy()
+    cls_idxs = cls_idxs.cpu().numpy()
+    for j in range(1, num_classes):
+        image_detections[j] = detections[cls_idxs == j]
+    return image_detections
+
+
+def save_postprocessed_detections(postprocessed_detections, cfg, num_epoch, shard_id=None, image_idxs=None):
+    pp_dets_path = cfg.get_postprocessed_detections_path(num_epoch, shard_id)
+    if shard_id is not None:
+        # a shard only holds the columns of its own images, merge_shard_detections puts them in place
+        postprocessed_detections = {'image_idxs': image_idxs, 'detections': postprocessed_detections}
+    with open(pp_dets_path, 'wb') as f:
+        pickle.dump(postprocessed_detections, f)
+
+
+def merge_shard_detections(data_manager, cfg, num_epoch):
+    """Assembles the postprocessed detections of all cfg.TEST.num_shards shards into the
+    [num_classes, num_images] array the evaluators expect, and saves it as the detections of the epoch.
+    """
+    num_images = data_manager.num_images
+    postprocessed_detections = np.empty(shape=(data_manager.num_classes, num_images), dtype='object')
+    is_merged = np.zeros(num_images, dtype=np.bool_)
+    for shard_id in range(cfg.TEST.num_shards):
+        shard_path = cfg.get_postprocessed_detections_path(num_epoch, shard_id)
+        if not os.path.exists(shard_path):
+            raise ValueError('Detections of shard {}/{} are missing: {}.'.format(
+                shard_id, cfg.TEST.num_shards, shard_path))
+        with open(shard_path, 'rb') as f:
+            shard = pickle.load(f)
+        postprocessed_detections[:, shard['image_idxs']] = shard['detections']
+        is_merged[shard['image_idxs']] = True
+    if not is_merged.all():
+        raise ValueError('Shards cover only {}/{} images.'.format(int(is_merged.sum()), num_images))
+
+    save_postprocessed_detections(postprocessed_detections, cfg, num_epoch)
+    logger.info("Detections of {} shards were merged to: {}.".format(
+        cfg.TEST.num_shards, cfg.get_postprocessed_detections_path(num_epoch)))
+
+
+class FusedPostprocessingWriter(object):
+    """Drop-in replacement for RawPredsWriter that postprocesses every batch right after the forward pass.
+
+    Only the final detections are kept (and saved on close), so the raw predictions never leave the device.
+    """
+
+    def __init__(self, num_images, num_classes, is_class_agnostic, cfg, num_epoch, shard_id=None, image_idxs=None):
+        self._num_classes = num_classes
+        self._is_class_agnostic = is_class_agnostic
+        self._cfg = cfg
+        self._num_epoch = num_epoch
+        self._shard_id = shard_id
+        self._image_idxs = image_idxs
+        self._postprocessed_detections = np.empty(shape=(num_classes, num_images), dtype='object')
+        self.output_path = cfg.get_postprocessed_detections_path(num_epoch, shard_id)
+
+    def write(self, im_idxs, bbox_coords, cls_probs):
+        for i, im_idx in enumerate(im_idxs):
+            self._postprocessed_detections[:, im_idx] = postprocess_image_preds(
+                cls_probs[i], bbox_coords[i], self._num_classes, self._is_class_agnostic, self._cfg)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        save_postprocessed_detections(self._postprocessed_detections, self._cfg, self._num_epoch,
+                                      self._shard_id, self._image_idxs)
@@ -1,5 +1,4 @@
 import logging
-import pickle
 import time
 
 import numpy as np
@@ -7,6 +6,9 @@ import os
 import torch
 
 from model.meta_architecture.rpn.bbox_transform import bbox_transform_inv, clip_boxes
+from model.utils.forward_profiler import ForwardProfiler
+from pipeline.faster_rcnn.faster_rcnn_postprocessing import FusedPostprocessingWriter
+from pipeline.faster_rcnn.raw_preds_io import RawPredsWriter
 
 logger = logging.getLogger(__name__)
 
@@ -15,17 +17,24 @@ def faster_rcnn_prediction(data_manager, model, cfg, epoch_num):
     logger.info("--->>> Starting prediction...")
     num_images = len(data_manager)
     model.eval()
-    raw_preds = {
-        'bbox_coords': np.zeros((num_images, cfg.TEST.RPN_POST_NMS_TOP_N, model.num_predicted_coords),
-                                dtype=np.float32),
-        'cls_probs': np.zeros((num_images, cfg.TEST.RPN_POST_NMS_TOP_N, model.cfg_params['num_classes']),
-                              dtype=np.float32)
-    }
+    if cfg.TEST.fuse_postprocessing:
+        preds_writer = FusedPostprocessingWriter(num_images, model.cfg_params['num_classes'],
+                                                 model.cfg_params['is_class_agnostic'], cfg, epoch_num,
+                                                 data_manager.shard_id, data_manager.image_idxs)
+    else:
+        preds_writer = RawPredsWriter(cfg.get_preds_path(epoch_num, data_manager.shard_id), num_images,
+                                      cfg.TEST.RPN_POST_NMS_TOP_N, model.num_predicted_coords,
+                                      model.cfg_params['num_classes'])
 
+    profiler = ForwardProfiler(model, cfg.CUDA).attach() if cfg.profile_forward else None
     pred_start = time.time()
     data_manager.prepare_iter_for_new_epoch()
-    for i in range(num_images):
+    image_order = data_manager.infer_image_order
+    num_predicted_images = 0
+    while num_predicted_images < num_images:
         im_data, im_info, gt_boxes, num_boxes = next(data_manager)
+        batch_size = im_data.size(0)
+        im_idxs = image_order[num_predicted_images:num_predicted_images + batch_size]
         curr_pred_start = time.time()
         rois, cls_prob, bbox_pred, rpn_loss_cls, rpn_loss_bbox, \
             faster_rcnn_loss_cls, faster_rcnn_loss_bbox, rois_label = \
@@ -38,36 +47,40 @@ def faster_rcnn_prediction(data_manager, model, cfg, epoch_num):
 
             def unnormalize_preds():
                 deltas_from_proposals = bbox_pred.data
-                means = torch.FloatTensor(cfg.TRAIN.BBOX_NORMALIZE_MEANS).cuda()
-                stds = torch.FloatTensor(cfg.TRAIN.BBOX_NORMALIZE_STDS).cuda()
+                means = torch.FloatTensor(cfg.TRAIN.BBOX_NORMALIZE_MEANS).type_as(deltas_from_proposals)
+                stds = torch.FloatTensor(cfg.TRAIN.BBOX_NORMALIZE_STDS).type_as(deltas_from_proposals)
                 unnormalized_deltas = deltas_from_proposals.view(-1, 4) * stds + means
                 return unnormalized_deltas
             unnormalized_deltas = unnormalize_preds()
-            reshaped_deltas = unnormalized_deltas.view(1, -1, model.num_predicted_coords)
-            preds_in_img_coords = bbox_transform_inv(rpn_proposals, reshaped_deltas, 1)
-            preds_clipped_to_img_size = clip_boxes(preds_in_img_coords, im_info.data, 1)
-            inference_scaling_factor = im_info.data[0][2]
-            bbox_coords = preds_clipped_to_img_size / inference_scaling_factor
+            reshaped_deltas = unnormalized_deltas.view(batch_size, -1, model.num_predicted_coords)
+            preds_in_img_coords = bbox_transform_inv(rpn_proposals, reshaped_deltas, batch_size)
+            preds_clipped_to_img_size = clip_boxes(preds_in_img_coords, im_info.data, batch_size)
+            inference_scaling_factors = im_info.data[:, 2].contiguous().view(batch_size, 1, 1)
+            bbox_coords = preds_clipped_to_img_size / inference_scaling_factors
 
             return bbox_coords
 
         bbox_coords = transform_preds_to_img_coords()
-        cls_probs = cls_probs.squeeze()
-        bbox_coords = bbox_coords.squeeze()
         curr_pred_end = time.time()
         pred_time = curr_pred_end - curr_pred_start
-        avg_pred_time = (curr_pred_end - pred_start) / (i+1)
 
-        raw_preds['bbox_coords'][i, ...] = bbox_coords.cpu().numpy()
-        raw_preds['cls_probs'][i, ...] = cls_probs.cpu().numpy()
+        preds_writer.write(im_idxs, bbox_coords, cls_probs)
 
-        if i % cfg.TEST.disp_interval == 0 and i > 0:
+        prev_num_predicted_images = num_predicted_images
+        num_predicted_images += batch_size
+        avg_pred_time = (curr_pred_end - pred_start) / num_predicted_images
+        if num_predicted_images // cfg.TEST.disp_interval > prev_num_predicted_images // cfg.TEST.disp_interval:
+            preds_writer.flush()
             logger.info('Prediction in-progress {0}/{1}: '
-                        'avg per image: {2:.3f} s.'.format(i, num_images, avg_pred_time))
+                        'avg per image: {2:.3f} s.'.format(num_predicted_images, num_images, avg_pred_time))
 
-    preds_file_path = cfg.get_preds_path(epoch_num)
-    with open(preds_file_path, 'wb') as f:
-        pickle.dump(raw_preds, f, pickle.HIGHEST_PROTOCOL)
+    preds_writer.close()
+    logger.info("Predictions were written to: {}.".format(preds_writer.output_path))
+    if profiler is not None:
+        profiler.detach()
+        profiler.log_summary()
+        trace_mode_name = 'pred' if data_manager.shard_id is None else 'pred_shard{}'.format(data_manager.shard_id)
+        profiler.export_chrome_trace(cfg.get_forward_trace_path(trace_mode_name, epoch_num))
 
     pred_end = time.time()
     logger.info("------------ Total prediction time: {:.4f}s. -------------".format(pred_end - pred_start))
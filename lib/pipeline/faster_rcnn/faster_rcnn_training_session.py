@@ -1,17 +1,23 @@
+import contextlib
 import logging
 import time
 
 import torch
 import torch.nn as nn
 from torch.autograd.variable import Variable
+from torch.nn.parallel import DistributedDataParallel
 
 from pipeline.faster_rcnn.ckpt_utils import save_session_to_ckpt
+from model.utils.forward_profiler import ForwardProfiler
+from model.utils.mixed_precision import autocast, create_grad_scaler
 from model.utils.net_utils import decay_lr_in_optimizer, clip_gradient
+from utils.distributed import barrier, get_world_size, is_distributed, is_main_process
 
 logger = logging.getLogger(__name__)
 
 
-def run_training_session(data_manager, model, create_optimizer_fn, cfg, train_logger, first_epoch=0):
+def run_training_session(data_manager, model, create_optimizer_fn, cfg, train_logger, first_epoch=0,
+                         grad_scaler_state=None):
     logger.info("--->>> Starting training session...")
     model.train()
 
@@ -33,12 +39,32 @@ def run_training_session(data_manager, model, create_optimizer_fn, cfg, train_lo
     trainable_params = get_trainable_params()
     optimizer = create_optimizer_fn(trainable_params)
 
-    if cfg.mGPUs:
-        model = nn.DataParallel(model)
-    if cfg.CUDA:
-        model.cuda()
+    logger.info("Training in {} precision.".format(cfg.TRAIN.precision))
+    grad_scaler = create_grad_scaler(cfg.TRAIN.precision, cfg.CUDA)
+    if grad_scaler_state is not None and grad_scaler is not None:
+        grad_scaler.load_state_dict(grad_scaler_state)
+
+    profiler = ForwardProfiler(model, cfg.CUDA).attach() if cfg.profile_forward else None
+    if is_distributed():
+        # one process per device, the gradients are averaged over the processes in the backward pass
+        if cfg.CUDA:
+            model.cuda()
+        model = DistributedDataParallel(model, device_ids=[torch.cuda.current_device()] if cfg.CUDA else None)
+    else:
+        if cfg.mGPUs:
+            if cfg.TRAIN.feature_cache_dir:
+                # DataParallel would give every replica the cache keys of the whole batch
+                raise ValueError("TRAIN.feature_cache_dir is not supported with mGPUs, "
+                                 "use distributed training instead.")
+            model = nn.DataParallel(model)
+        if cfg.CUDA:
+            model.cuda()
     iters_per_epoch = data_manager.iters_per_epoch
+    accumulation_steps = cfg.TRAIN.accumulation_steps
+    logger.info("Accumulating the gradients of {} batches per optimizer step (effective batch size {}).".format(
+        accumulation_steps, accumulation_steps * cfg.TRAIN.batch_size * get_world_size()))
 
+    model.zero_grad()
     aggregated_stats = {}
     for epoch in range(first_epoch, cfg.TRAIN.max_epochs + 1):
         decay_lr_in_optimizer(epoch, cfg.TRAIN.lr_decay_step + 1, optimizer, cfg.TRAIN.GAMMA)
@@ -46,59 +72,99 @@ def run_training_session(data_manager, model, create_optimizer_fn, cfg, train_lo
         epoch_start_time = aggregation_start_time = time.time()
         data_manager.prepare_iter_for_new_epoch()
         for step in range(iters_per_epoch):
-            batch_outputs = _train_on_batch(data_manager, model, optimizer, cfg)
+            # the optimizer steps at the end of every accumulation group, which never spans two epochs so that
+            # the learning rate decay applies to whole groups
+            group_start = step - step % accumulation_steps
+            group_size = min(accumulation_steps, iters_per_epoch - group_start)
+            is_last_in_group = step == group_start + group_size - 1
+            batch_outputs = _train_on_batch(data_manager, model, optimizer, cfg, grad_scaler,
+                                            group_size, is_last_in_group)
             aggregated_stats = _aggregate_stats(aggregated_stats, batch_outputs['batch_metrics'], cfg.TRAIN.disp_interval)
 
             if step % cfg.TRAIN.disp_interval == 0 and step > 0:
-                aggregation_end_time = time.time()
-                time_per_sample = (aggregation_end_time - aggregation_start_time) / cfg.TRAIN.disp_interval
-                logged_string = _write_stats_to_logger(
-                    train_logger=train_logger,
-                    metrics=aggregated_stats,
-                    time_per_sample=time_per_sample,
-                    epoch=epoch, step=step, iters_per_epoch=iters_per_epoch)
-                logger.info(logged_string)
+                # in distributed training the stats of the first process are logged
+                if is_main_process():
+                    aggregation_end_time = time.time()
+                    time_per_sample = (aggregation_end_time - aggregation_start_time) / cfg.TRAIN.disp_interval
+                    logged_string = _write_stats_to_logger(
+                        train_logger=train_logger,
+                        metrics=aggregated_stats,
+                        time_per_sample=time_per_sample,
+                        epoch=epoch, step=step, iters_per_epoch=iters_per_epoch)
+                    logger.info(logged_string)
+                    if profiler is not None:
+                        profiler.log_summary(train_logger, epoch * iters_per_epoch + step)
+                if profiler is not None:
+                    profiler.reset()
                 aggregated_stats = {}
                 aggregation_start_time = time.time()
 
         epoch_end_time = time.time()
         epoch_duration_hrs = (epoch_end_time - epoch_start_time) / 3600
         logger.info("----------- Finished epoch {0} in {1:.3f} hrs. -----------".format(epoch, epoch_duration_hrs))
+        if profiler is not None and is_main_process():
+            profiler.export_chrome_trace(cfg.get_forward_trace_path('train', epoch))
 
-        save_session_to_ckpt(model, optimizer, cfg, epoch)
+        # all the processes hold the same weights, so only the first one writes them
+        if is_main_process():
+            save_session_to_ckpt(model, optimizer, cfg, epoch, grad_scaler)
+        barrier()
 
 
-def _train_on_batch(data_manager, model, optimizer, cfg):
+def _train_on_batch(data_manager, model, optimizer, cfg, grad_scaler=None, accumulation_steps=1, do_step=True):
+    """Forward and backward pass of one batch, the gradients are accumulated until do_step."""
     im_data, im_info, gt_boxes, num_boxes = next(data_manager)
-
-    model.zero_grad()
-    rois, cls_prob, bbox_pred, rpn_loss_cls, rpn_loss_bbox, RCNN_loss_cls, RCNN_loss_bbox, rois_label = \
-        model(im_data, im_info, gt_boxes, num_boxes)
-
-    batch_metrics = {'loss_rpn_cls': rpn_loss_cls.mean(),
-                    'loss_rpn_box': rpn_loss_bbox.mean(),
-                    'loss_rcnn_cls': RCNN_loss_cls.mean(),
-                    'loss_rcnn_box':  RCNN_loss_bbox.mean()}
-
-    batch_metrics['loss'] = torch.cat(list(batch_metrics.values())).sum()
-
-    batch_metrics['fg_cnt'] = torch.sum(rois_label.data.ne(0))
-    batch_metrics['bg_cnt'] = rois_label.data.numel() - batch_metrics['fg_cnt']
-
-    batch_outputs = {
-        'rois': rois,
-        'rois_label': rois_label,
-        'cls_prob': cls_prob,
-        'bbox_pred': bbox_pred,
-        'batch_metrics': batch_metrics
-        }
-
-    optimizer.zero_grad()
-    batch_metrics['loss'].backward()
-
-    if cfg.TRAIN.CLIP_GRADIENTS:
-        clip_gradient(model, cfg.TRAIN.CLIP_GRADIENTS)
-    optimizer.step()
+    cache_keys = data_manager.batch_keys if cfg.TRAIN.feature_cache_dir else None
+    is_scaled = grad_scaler is not None and grad_scaler.is_enabled()
+
+    # DistributedDataParallel only needs to average the gradients over the processes before the optimizer step
+    is_accumulating = not do_step and isinstance(model, DistributedDataParallel)
+    with model.no_sync() if is_accumulating else contextlib.ExitStack():
+        # the losses are computed in fp32 in any precision
+        with autocast(cfg.TRAIN.precision, cfg.CUDA):
+            rois, cls_prob, bbox_pred, rpn_loss_cls, rpn_loss_bbox, RCNN_loss_cls, RCNN_loss_bbox, rois_label = \
+                model(im_data, im_info, gt_boxes, num_boxes, cache_keys)
+
+        batch_metrics = {'loss_rpn_cls': rpn_loss_cls.mean(),
+                        'loss_rpn_box': rpn_loss_bbox.mean(),
+                        'loss_rcnn_cls': RCNN_loss_cls.mean(),
+                        'loss_rcnn_box':  RCNN_loss_bbox.mean()}
+
+        # stacked rather than concatenated, the newer versions of pytorch reduce the losses to 0-dim tensors
+        batch_metrics['loss'] = torch.stack(list(batch_metrics.values())).sum()
+
+        batch_metrics['fg_cnt'] = torch.sum(rois_label.data.ne(0))
+        batch_metrics['bg_cnt'] = rois_label.data.numel() - batch_metrics['fg_cnt']
+
+        batch_outputs = {
+            'rois': rois,
+            'rois_label': rois_label,
+            'cls_prob': cls_prob,
+            'bbox_pred': bbox_pred,
+            'batch_metrics': batch_metrics
+            }
+
+        # the accumulated gradient is the gradient of the mean loss of the group, the logged loss is not scaled
+        loss = batch_metrics['loss'] / accumulation_steps
+        if is_scaled:
+            grad_scaler.scale(loss).backward()
+        else:
+            loss.backward()
+
+    if do_step:
+        if is_scaled:
+            if cfg.TRAIN.CLIP_GRADIENTS:
+                # the gradients are clipped at their true scale
+                grad_scaler.unscale_(optimizer)
+                clip_gradient(model, cfg.TRAIN.CLIP_GRADIENTS)
+            # skips the step when the gradients overflowed, and adapts the loss scale
+            grad_scaler.step(optimizer)
+            grad_scaler.update()
+        else:
+            if cfg.TRAIN.CLIP_GRADIENTS:
+                clip_gradient(model, cfg.TRAIN.CLIP_GRADIENTS)
+            optimizer.step()
+        model.zero_grad()
 
     return batch_outputs
 
@@ -0,0 +1,53 @@
+import logging
+
+import numpy as np
+import os
+from numpy.lib.format import open_memmap
+
+logger = logging.getLogger(__name__)
+
+_BBOX_COORDS_FILE = 'bbox_coords.npy'
+_CLS_PROBS_FILE = 'cls_probs.npy'
+_IS_WRITTEN_FILE = 'is_written.npy'
+
+
+class RawPredsWriter(object):
+    """Streams raw predictions to memory-mapped .npy files inside preds_dir_path.
+
+    The files are preallocated on disk, so memory use does not depend on the number of images,
+    and everything written up to the last flush survives a crash in the middle of the run.
+    """
+
+    def __init__(self, preds_dir_path, num_images, num_rois, num_coords, num_classes):
+        os.makedirs(preds_dir_path, exist_ok=True)
+        self.output_path = preds_dir_path
+        self._bbox_coords = open_memmap(os.path.join(preds_dir_path, _BBOX_COORDS_FILE), mode='w+',
+                                        dtype=np.float32, shape=(num_images, num_rois, num_coords))
+        self._cls_probs = open_memmap(os.path.join(preds_dir_path, _CLS_PROBS_FILE), mode='w+',
+                                      dtype=np.float32, shape=(num_images, num_rois, num_classes))
+        self._is_written = open_memmap(os.path.join(preds_dir_path, _IS_WRITTEN_FILE), mode='w+',
+                                       dtype=np.bool_, shape=(num_images,))
+
+    def write(self, im_idxs, bbox_coords, cls_probs):
+        self._bbox_coords[im_idxs, ...] = bbox_coords.cpu().numpy()
+        self._cls_probs[im_idxs, ...] = cls_probs.cpu().numpy()
+        self._is_written[im_idxs] = True
+
+    def flush(self):
+        self._bbox_coords.flush()
+        self._cls_probs.flush()
+        self._is_written.flush()
+
+    def close(self):
+        self.flush()
+        del self._bbox_coords, self._cls_probs, self._is_written
+
+
+def load_raw_preds(preds_dir_path):
+    """Returns read-only memory-mapped views of the raw predictions written by RawPredsWriter."""
+    is_written = np.load(os.path.join(preds_dir_path, _IS_WRITTEN_FILE), mmap_mode='r')
+    if not is_written.all():
+        raise ValueError('Raw predictions in {} are incomplete: {}/{} images were written.'.format(
+            preds_dir_path, int(is_written.sum()), len(is_written)))
+    return {'bbox_coords': np.load(os.path.join(preds_dir_path, _BBOX_COORDS_FILE), mmap_mode='r'),
+            'cls_probs': np.load(os.path.join(preds_dir_path, _CLS_PROBS_FILE), mmap_mode='r')}
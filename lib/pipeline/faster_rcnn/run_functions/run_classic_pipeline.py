@@ -1,19 +1,27 @@
 import logging
+import multiprocessing
 
+import os
 import torch
 from functools import partial
 
 from data_manager.classic_detection.classic_data_manager import ClassicDataManager
 from data_manager.data_manager_abstract import Mode
+from data_manager.roi_data_layer.image_cache import is_image_cache_enabled
 from loggers.tensorbord_logger import TensorBoardLogger
 from model.feature_extractors.feature_extractor_duo import create_duo_from_ckpt
 from model.meta_architecture.faster_rcnn import FasterRCNN
+from model.utils.feature_cache import FeatureCache, get_cache_namespace
 from model.utils.misc_utils import get_epoch_num_from_ckpt
+from pipeline.faster_rcnn.ckpt_utils import load_session_from_ckpt
 from pipeline.faster_rcnn.faster_rcnn_evaluation import faster_rcnn_evaluation
-from pipeline.faster_rcnn.faster_rcnn_postprocessing import faster_rcnn_postprocessing
+from pipeline.faster_rcnn.faster_rcnn_postprocessing import faster_rcnn_postprocessing, merge_shard_detections
 from pipeline.faster_rcnn.faster_rcnn_prediction import faster_rcnn_prediction
 from pipeline.faster_rcnn.faster_rcnn_training_session import run_training_session
 from pipeline.faster_rcnn.faster_rcnn_visualization import faster_rcnn_visualization
+from utils.distributed import broadcast_object, check_distributed_support, cleanup_distributed, init_distributed, \
+    is_launched_with_env, is_main_process
+from utils.logging import set_root_logger
 
 
 logger = logging.getLogger(__name__)
@@ -27,26 +35,93 @@ def create_and_train_with_err_handling(cfg):
         raise e
 
 
-def create_and_train(cfg):
+def create_and_train(cfg, rank=0, world_size=1):
     logger.info("--->>> Starting training...\n"
                 "With config:\n {}".format(cfg))
 
+    # processes launched by torchrun load the config (and draw its seed) on their own
+    sampler_seed = broadcast_object(cfg.get_state_dict().get('USER_CHOSEN_SEED') or 0)
     train_data_manager = ClassicDataManager(
         mode=Mode.TRAIN, imdb_name=cfg.imdb_name, num_workers=cfg.NUM_WORKERS, is_cuda=cfg.CUDA, cfg=cfg,
-        batch_size=cfg.TRAIN.batch_size)
-
-    train_logger = TensorBoardLogger(cfg.output_path)
-
-    feature_extractor_duo = create_duo_from_ckpt(
-        cfg.net, cfg.net_variant, frozen_blocks=cfg.TRAIN.frozen_blocks,
-        pretrained_model_path=cfg.TRAIN.get("pretrained_model_path", None))
-
-    model = FasterRCNN.create_with_random_normal_init(feature_extractor_duo, cfg,
-                                                      num_classes=train_data_manager.num_classes)
-
-    create_optimizer_fn = partial(torch.optim.SGD, momentum=cfg.TRAIN.MOMENTUM)
-
-    run_training_session(train_data_manager, model, create_optimizer_fn, cfg, train_logger, cfg.TRAIN.start_epoch)
+        batch_size=cfg.TRAIN.batch_size, num_replicas=world_size, rank=rank, sampler_seed=sampler_seed)
+
+    train_logger = TensorBoardLogger(cfg.output_path) if is_main_process() else None
+
+    if cfg.TRAIN.resume:
+        model, create_optimizer_fn, loaded_cfg, last_performed_epoch, grad_scaler_state = load_session_from_ckpt(
+            cfg.get_last_ckpt_path(), cfg.TRAIN.checkpointed_stages)
+        # a resumed session trains in the precision it was started with, from its last loss scale
+        cfg.TRAIN.precision = loaded_cfg.TRAIN.precision
+        first_epoch = last_performed_epoch + 1
+    else:
+        feature_extractor_duo = create_duo_from_ckpt(
+            cfg.net, cfg.net_variant, frozen_blocks=cfg.TRAIN.frozen_blocks,
+            pretrained_model_path=cfg.TRAIN.get("pretrained_model_path", None))
+        feature_extractor_duo.set_checkpointed_stages(cfg.TRAIN.checkpointed_stages)
+
+        model = FasterRCNN.create_with_random_normal_init(feature_extractor_duo, cfg,
+                                                          num_classes=train_data_manager.num_classes)
+        create_optimizer_fn = partial(torch.optim.SGD, momentum=cfg.TRAIN.MOMENTUM)
+        grad_scaler_state = None
+        first_epoch = cfg.TRAIN.start_epoch
+    if cfg.TRAIN.feature_cache_dir:
+        model.set_feature_cache(create_feature_cache(cfg))
+
+    run_training_session(train_data_manager, model, create_optimizer_fn, cfg, train_logger, first_epoch,
+                         grad_scaler_state)
+
+
+def create_feature_cache(cfg):
+    # features computed by a different backbone or from differently preprocessed images go to another directory.
+    # The images read from the image cache are stored as image_cache_dtype (e.g. rounded to uint8)
+    image_cache_dtype = cfg.image_cache_dtype if is_image_cache_enabled(cfg) else None
+    namespace = get_cache_namespace(cfg.net, cfg.net_variant, cfg.TRAIN.frozen_blocks,
+                                    cfg.TRAIN.get("pretrained_model_path", None), cfg.PIXEL_MEANS.tolist(),
+                                    list(cfg.TRAIN.SCALES), cfg.TRAIN.MAX_SIZE, image_cache_dtype)
+    return FeatureCache(os.path.join(cfg.TRAIN.feature_cache_dir, namespace),
+                        max_bytes=int(cfg.TRAIN.feature_cache_max_gb * 1024 ** 3))
+
+
+def create_and_train_distributed(cfg):
+    """Trains with DistributedDataParallel, one process per device.
+
+    When launched by torchrun (on one or several nodes) this process is one of the training processes,
+    otherwise cfg.dist_num_local_processes training processes are spawned on this machine.
+    """
+    # fails here rather than in every spawned process
+    check_distributed_support()
+    if is_launched_with_env():
+        _create_and_train_process(int(os.environ['LOCAL_RANK']), cfg, int(os.environ['RANK']),
+                                  int(os.environ['WORLD_SIZE']))
+        return
+
+    world_size = cfg.dist_num_local_processes
+    logger.info("--->>> Spawning {} training processes.".format(world_size))
+    os.environ.setdefault('MASTER_ADDR', cfg.dist_master_addr)
+    os.environ.setdefault('MASTER_PORT', str(cfg.dist_master_port))
+    # spawn rather than fork, CUDA can not be re-initialized in a forked process
+    ctx = multiprocessing.get_context('spawn')
+    processes = [ctx.Process(target=_create_and_train_process, args=(rank, cfg, rank, world_size))
+                 for rank in range(world_size)]
+    for p in processes:
+        p.start()
+    for p in processes:
+        p.join()
+    failed_ranks = [rank for rank, p in enumerate(processes) if p.exitcode != 0]
+    if failed_ranks:
+        raise RuntimeError("Training processes {} failed.".format(failed_ranks))
+
+
+def _create_and_train_process(local_rank, cfg, rank, world_size):
+    set_root_logger(cfg.get_log_path(), process_name='rank {}'.format(rank))
+    init_distributed(cfg, rank, world_size, local_rank)
+    try:
+        create_and_train(cfg, rank, world_size)
+    except Exception as e:
+        logger.error("Unexpected error in training process {}: ".format(rank), exc_info=True)
+        raise e
+    finally:
+        cleanup_distributed()
 
 
 def pred_eval_with_err_handling(cfg):
@@ -64,19 +139,87 @@ def pred_eval(cfg):
                 "Last detected epoch: {},\n"
                 "Reading from ckpt: {},\n"
                 "Config:\n {}".format(epoch_num, ckpt_path, cfg))
-    model, _ = FasterRCNN.create_from_ckpt(ckpt_path)
-    model.cuda()
-    data_manager = ClassicDataManager(mode=Mode.INFER,
-                                      imdb_name=cfg.imdbval_name,
-                                      num_workers=cfg.NUM_WORKERS,
-                                      is_cuda=cfg.CUDA,
-                                      batch_size=cfg.TRAIN.batch_size,
-                                      cfg=cfg)
+    if cfg.TEST.num_shards > 1:
+        if cfg.TEST.shard_id is not None:
+            predict_and_postprocess(cfg, ckpt_path, epoch_num, shard_id=cfg.TEST.shard_id)
+            return
+        predict_and_postprocess_shards_in_local_processes(cfg, ckpt_path, epoch_num)
+        data_manager = create_infer_data_manager(cfg)
+        merge_shard_detections(data_manager, cfg, epoch_num)
+    else:
+        data_manager = predict_and_postprocess(cfg, ckpt_path, epoch_num)
+
+    faster_rcnn_evaluation(data_manager, cfg, epoch_num)
+
+    faster_rcnn_visualization(data_manager, cfg, epoch_num)
+
+
+def merge_eval_with_err_handling(cfg):
+    try:
+        merge_eval(cfg)
+    except Exception as e:
+        logger.error("Unexpected error: ", exc_info=True)
+        raise e
 
-    faster_rcnn_prediction(data_manager, model, cfg, epoch_num)
 
-    faster_rcnn_postprocessing(data_manager, model, cfg, epoch_num)
+def merge_eval(cfg):
+    """Evaluates the detections of cfg.TEST.num_shards shards that were predicted separately (e.g. on several machines)."""
+    epoch_num = get_epoch_num_from_ckpt(cfg.get_last_ckpt_path())
+    logger.info("--->>> Starting merge-evaluation of {} shards for epoch: {}.".format(cfg.TEST.num_shards, epoch_num))
+    data_manager = create_infer_data_manager(cfg)
+    merge_shard_detections(data_manager, cfg, epoch_num)
 
     faster_rcnn_evaluation(data_manager, cfg, epoch_num)
 
     faster_rcnn_visualization(data_manager, cfg, epoch_num)
+
+
+def create_infer_data_manager(cfg, shard_id=None):
+    return ClassicDataManager(mode=Mode.INFER,
+                              imdb_name=cfg.imdbval_name,
+                              num_workers=cfg.NUM_WORKERS,
+                              is_cuda=cfg.CUDA,
+                              batch_size=cfg.TEST.batch_size,
+                              cfg=cfg,
+                              shard_id=shard_id)
+
+
+def predict_and_postprocess(cfg, ckpt_path, epoch_num, shard_id=None):
+    if shard_id is not None:
+        logger.info("--->>> Predicting shard {}/{}.".format(shard_id, cfg.TEST.num_shards))
+    model, _ = FasterRCNN.create_from_ckpt(ckpt_path)
+    if cfg.CUDA:
+        model.cuda()
+    data_manager = create_infer_data_manager(cfg, shard_id)
+
+    faster_rcnn_prediction(data_manager, model, cfg, epoch_num)
+
+    if not cfg.TEST.fuse_postprocessing:
+        faster_rcnn_postprocessing(data_manager, model, cfg, epoch_num)
+
+    return data_manager
+
+
+def predict_and_postprocess_shards_in_local_processes(cfg, ckpt_path, epoch_num):
+    # spawn rather than fork, CUDA can not be re-initialized in a forked process
+    ctx = multiprocessing.get_context('spawn')
+    processes = [ctx.Process(target=_predict_and_postprocess_shard, args=(cfg, ckpt_path, epoch_num, shard_id))
+                 for shard_id in range(cfg.TEST.num_shards)]
+    for p in processes:
+        p.start()
+    for p in processes:
+        p.join()
+    failed_shards = [shard_id for shard_id, p in enumerate(processes) if p.exitcode != 0]
+    if failed_shards:
+        raise RuntimeError("Prediction of shards {} failed.".format(failed_shards))
+
+
+def _predict_and_postprocess_shard(cfg, ckpt_path, epoch_num, shard_id):
+    set_root_logger(cfg.get_log_path(), process_name='shard {}'.format(shard_id))
+    if cfg.CUDA:
+        torch.cuda.set_device(shard_id % torch.cuda.device_count())
+    try:
+        predict_and_postprocess(cfg, ckpt_path, epoch_num, shard_id)
+    except Exception as e:
+        logger.error("Unexpected error in shard {}: ".format(shard_id), exc_info=True)
+        raise e
@@ -118,6 +118,12 @@ ext_modules = [
         extra_compile_args={'gcc': ["-Wno-cpp", "-Wno-unused-function"]},
         include_dirs=[numpy_include]
     ),
+    Extension(
+        "model.meta_architecture.nms.cython_nms",
+        sources=["model/meta_architecture/nms/cpu_nms.pyx"],
+        extra_compile_args={'gcc': ["-Wno-cpp", "-Wno-unused-function"]},
+        include_dirs=[numpy_include]
+    ),
     Extension(
         'pycocotools._mask',
         sources=['data_manager/classic_detection/datasets/pycocotools/maskApi.c',
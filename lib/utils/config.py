@@ -16,6 +16,15 @@ from easydict import EasyDict as edict
 logger = logging.getLogger(__name__)
 
 
+def _convert_deprecated_keys(cfg):
+    # the raw predictions became a directory of .npy files, named by raw_preds_dir_format
+    if 'raw_preds_file_format' in cfg:
+        raw_preds_file_format = cfg.pop('raw_preds_file_format')
+        cfg['raw_preds_dir_format'] = os.path.splitext(raw_preds_file_format)[0]
+        logger.warning("raw_preds_file_format is deprecated, use raw_preds_dir_format instead "
+                       "(set to '{}').".format(cfg['raw_preds_dir_format']))
+
+
 class ConfigProvider(dict):
     def __init__(self):
         super(ConfigProvider, self).__init__()
@@ -50,6 +59,7 @@ class ConfigProvider(dict):
         self._cfg['DEDUP_BOXES'] = float(self._cfg['DEDUP_BOXES_numerator']) / float(self._cfg['DEDUP_BOXES_denominator'])
 
     def create_from_dict(self, cfg):
+        _convert_deprecated_keys(cfg)
         cfg['start_run_time_str'] = strftime("%Y_%b_%d_%H_%M", gmtime())
 
         cfg['PIXEL_MEANS'] = np.array(cfg['PIXEL_MEANS'])
@@ -108,18 +118,27 @@ class ConfigProvider(dict):
         
         return latest_file
 
-    def get_preds_path(self, epoch_num):
-        file_name = self.raw_preds_file_format.format(epoch_num)
-        path = os.path.join(self.output_path, file_name)
-        os.makedirs(os.path.dirname(path), exist_ok=True)
-        return path
+    def get_preds_path(self, epoch_num, shard_id=None):
+        dir_name = self.raw_preds_dir_format.format(epoch_num)
+        if shard_id is not None:
+            dir_name += self.shard_suffix_format.format(shard_id)
+        dir_path = os.path.join(self.output_path, dir_name)
+        os.makedirs(dir_path, exist_ok=True)
+        return dir_path
 
-    def get_postprocessed_detections_path(self, epoch_num):
+    def get_postprocessed_detections_path(self, epoch_num, shard_id=None):
         file_name = self.postprocessed_file_format.format(epoch_num)
+        if shard_id is not None:
+            file_name, ext = os.path.splitext(file_name)
+            file_name += self.shard_suffix_format.format(shard_id) + ext
         path = os.path.join(self.output_path, file_name)
         os.makedirs(os.path.dirname(path), exist_ok=True)
         return path
 
+    def get_forward_trace_path(self, mode_name, epoch_num):
+        file_name = self.forward_trace_file_format.format(mode_name, epoch_num)
+        return os.path.join(self.output_path, file_name)
+
     def get_evals_dir_path(self, epoch_num):
         dir_name = self.evals_dir_format.format(epoch_num)
         dir_path = os.path.join(self.output_path, dir_name)
@@ -149,3 +168,10 @@ class ConfigProvider(dict):
 
     def get_state_dict(self):
         return self._cfg
+
+    def __getstate__(self):
+        # lets the config be sent to spawned processes, __getattr__ would otherwise recurse before _cfg is set
+        return self._cfg
+
+    def __setstate__(self, state):
+        self._cfg = state
@@ -0,0 +1,74 @@
+import logging
+
+import os
+import torch
+import torch.distributed as dist
+from torch.nn.parallel import DistributedDataParallel
+
+logger = logging.getLogger(__name__)
+
+# set by torchrun (or any launcher using the env:// convention) in every process it starts
+_LAUNCHER_ENV_VARS = ['RANK', 'WORLD_SIZE', 'LOCAL_RANK']
+
+
+def is_launched_with_env():
+    return all(v in os.environ for v in _LAUNCHER_ENV_VARS)
+
+
+def check_distributed_support():
+    """Raises if this version of pytorch lacks what the distributed training uses (see the README)."""
+    missing = []
+    if not hasattr(dist, 'is_available') or not dist.is_available():
+        missing.append('torch.distributed')
+    if not hasattr(dist, 'broadcast_object_list'):
+        missing.append('torch.distributed.broadcast_object_list')
+    if not hasattr(DistributedDataParallel, 'no_sync'):
+        missing.append('DistributedDataParallel.no_sync')
+    if missing:
+        raise RuntimeError("Distributed training needs pytorch >= 1.10, pytorch {} lacks {}".format(
+            torch.__version__, ', '.join(missing)))
+
+
+def is_distributed():
+    # is_initialized is not in the older versions of pytorch, which can't train distributed anyway
+    return hasattr(dist, 'is_initialized') and dist.is_available() and dist.is_initialized()
+
+
+def get_rank():
+    return dist.get_rank() if is_distributed() else 0
+
+
+def get_world_size():
+    return dist.get_world_size() if is_distributed() else 1
+
+
+def is_main_process():
+    return get_rank() == 0
+
+
+def init_distributed(cfg, rank, world_size, local_rank):
+    """Joins the process group of the training, and binds the process to its GPU when running on CUDA."""
+    if cfg.CUDA:
+        torch.cuda.set_device(local_rank)
+    dist.init_process_group(backend=cfg.dist_backend, init_method=cfg.dist_init_method,
+                            rank=rank, world_size=world_size)
+    logger.info("Process {}/{} joined the {} process group.".format(rank, world_size, cfg.dist_backend))
+
+
+def cleanup_distributed():
+    if is_distributed():
+        dist.destroy_process_group()
+
+
+def broadcast_object(obj, src=0):
+    """Returns obj of process src in all the processes."""
+    if not is_distributed():
+        return obj
+    objs = [obj]
+    dist.broadcast_object_list(objs, src=src)
+    return objs[0]
+
+
+def barrier():
+    if is_distributed():
+        dist.barrier()
@@ -1,23 +1,29 @@
 import logging
 
 
-def set_root_logger(log_path):
+def set_root_logger(log_path, process_name=None):
+    """Logs to the console and appends to log_path. process_name (e.g. the rank of a training process) prefixes
+    every line, together with the pid in the log file, when several processes log to the same file."""
     logging.shutdown()  # clearing up logging in case it was already initialized
     logger = logging.getLogger()
     logger.setLevel(logging.INFO)
 
+    # the handlers of a previous call are replaced, e.g. when a launched training process names itself
+    for h in list(logger.handlers):
+        if type(h) in (logging.StreamHandler, logging.FileHandler):
+            logger.removeHandler(h)
+
+    prefix = '[{}] '.format(process_name) if process_name is not None else ''
     console = logging.StreamHandler()
-    formatter_console = logging.Formatter(fmt='%(message)s',
+    formatter_console = logging.Formatter(fmt=prefix + '%(message)s',
                                           datefmt=None,
                                           style='%')
     console.setFormatter(formatter_console)
     logger.addHandler(console)
 
-    for h in logger.handlers:
-        if type(h) == logging.FileHandler:
-            logger.removeHandler(h)
     file = logging.FileHandler(filename=log_path, mode='a', encoding='utf-8')
-    formatter_file = logging.Formatter(fmt='%(asctime)s - %(levelname)s - %(name)s\n\t%(message)s\n',
+    file_prefix = prefix + '(pid %(process)d) - ' if process_name is not None else ''
+    formatter_file = logging.Formatter(fmt='%(asctime)s - ' + file_prefix + '%(levelname)s - %(name)s\n\t%(message)s\n',
                                        datefmt=None,
                                        style='%')
     file.setFormatter(formatter_file)
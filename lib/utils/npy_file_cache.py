@@ -0,0 +1,150 @@
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import os
+
+logger = logging.getLogger(__name__)
+
+_ENTRY_EXT = '.npy'
+
+
+class NpyFileCache(object):
+    """On-disk cache of arrays, one .npy file per key, read back memory mapped.
+
+    The total size of the files is capped at max_bytes, the least recently used entries are evicted first.
+    The recency of an entry is the modification time of its file, so it is kept across runs. Several processes may
+    share the directory: entries written by the others are picked up, and entries they evicted are misses.
+    Every process only accounts for the entries it has seen, so together they may exceed max_bytes for a while.
+    """
+
+    def __init__(self, cache_dir, max_bytes):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.num_hits = 0
+        self.num_misses = 0
+        self._lock = threading.Lock()
+        # file name -> size in bytes, least recently used first
+        self._entries = OrderedDict()
+        self._total_bytes = 0
+
+        existing_files = []
+        for file_name in os.listdir(cache_dir):
+            if file_name.endswith(_ENTRY_EXT):
+                file_stat = os.stat(os.path.join(cache_dir, file_name))
+                existing_files.append((file_stat.st_mtime, file_name, file_stat.st_size))
+        for _, file_name, size in sorted(existing_files):
+            self._add_entry(file_name, size)
+        self._evict()
+        logger.info("Cache at {} holds {} entries ({:.2f} GB of {:.2f} GB).".format(
+            cache_dir, len(self._entries), self._total_bytes / 1024. ** 3, max_bytes / 1024. ** 3))
+
+    def __getstate__(self):
+        # lets the cache be sent to spawned (e.g. data loader worker) processes
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _get_file_name(key):
+        return hashlib.sha1(key.encode('utf-8')).hexdigest() + _ENTRY_EXT
+
+    def _add_entry(self, file_name, size):
+        self._total_bytes += size - self._entries.pop(file_name, 0)
+        self._entries[file_name] = size
+
+    def _remove_entry(self, file_name):
+        self._total_bytes -= self._entries.pop(file_name, 0)
+
+    def _evict(self):
+        while self._total_bytes > self.max_bytes and self._entries:
+            file_name, size = self._entries.popitem(last=False)
+            self._total_bytes -= size
+            try:
+                os.remove(os.path.join(self.cache_dir, file_name))
+            except OSError:
+                pass  # already evicted by another process
+
+    def get(self, key):
+        """The cached array of key, or None."""
+        file_name = self._get_file_name(key)
+        path = os.path.join(self.cache_dir, file_name)
+        try:
+            array = np.array(np.load(path, mmap_mode='r'))
+            os.utime(path, None)
+        except (IOError, OSError, ValueError):
+            with self._lock:
+                self._remove_entry(file_name)
+                self.num_misses += 1
+            return None
+        with self._lock:
+            self._add_entry(file_name, os.path.getsize(path))
+            self.num_hits += 1
+        return array
+
+    def put(self, key, array):
+        if array.nbytes > self.max_bytes:
+            return
+        file_name = self._get_file_name(key)
+        path = os.path.join(self.cache_dir, file_name)
+        # written to a temporary file first, so that readers never see a partial entry
+        tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+        with open(tmp_path, 'wb') as f:
+            np.save(f, array)
+        os.replace(tmp_path, path)
+        with self._lock:
+            self._add_entry(file_name, os.path.getsize(path))
+            self._evict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def total_bytes(self):
+        return self._total_bytes
+
+
+class RamCache(object):
+    """In-memory LRU cache of arrays, capped at max_bytes. Every process holds its own entries."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.num_hits = 0
+        self.num_misses = 0
+        self._entries = OrderedDict()
+        self._total_bytes = 0
+
+    def get(self, key):
+        array = self._entries.get(key)
+        if array is None:
+            self.num_misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.num_hits += 1
+        return array
+
+    def put(self, key, array):
+        if array.nbytes > self.max_bytes:
+            return
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self._total_bytes -= previous.nbytes
+        self._entries[key] = array
+        self._total_bytes += array.nbytes
+        while self._total_bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._total_bytes -= evicted.nbytes
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def total_bytes(self):
+        return self._total_bytes
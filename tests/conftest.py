@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the library is imported the way the demos import it, with the lib directory on the path
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'lib'))
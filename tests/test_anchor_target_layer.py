@@ -0,0 +1,87 @@
+import numpy as np
+import pytest
+import torch
+
+from model.meta_architecture.rpn.anchor_target_layer import _subsample_labels, _unmap
+
+
+def _subsample_labels_loop(labels, label, max_nums):
+    """The per-image sampling _subsample_labels replaced, with the labels of every image permuted in numpy."""
+    for i in range(labels.size(0)):
+        inds = torch.nonzero(labels[i] == label).view(-1)
+        if inds.numel() > max_nums[i]:
+            rand_num = torch.from_numpy(np.random.permutation(inds.size(0))).long()
+            disable_inds = inds[rand_num[:inds.size(0) - max_nums[i]]]
+            labels[i][disable_inds] = -1
+
+
+def _unmap_one(data, count, inds, batch_size, fill=0):
+    """The _unmap that _unmap replaced, one tensor at a time."""
+    if data.dim() == 2:
+        ret = torch.Tensor(batch_size, count).fill_(fill).type_as(data)
+        ret[:, inds] = data
+    else:
+        ret = torch.Tensor(batch_size, count, data.size(2)).fill_(fill).type_as(data)
+        ret[:, inds, :] = data
+    return ret
+
+
+def _random_labels(rng, batch_size, num_anchors):
+    return torch.from_numpy(rng.choice([-1, 0, 1], size=(batch_size, num_anchors), p=[0.5, 0.3, 0.2])).float()
+
+
+@pytest.mark.parametrize('seed', range(20))
+@pytest.mark.parametrize('label', [0, 1])
+def test_subsample_labels_keeps_as_many_labels_as_the_loop(seed, label):
+    rng = np.random.RandomState(seed)
+    labels = _random_labels(rng, batch_size=3, num_anchors=rng.randint(1, 200))
+    max_nums = torch.from_numpy(rng.randint(0, 60, 3)).long()
+    expected = labels.clone()
+    np.random.seed(seed)
+    _subsample_labels_loop(expected, label, max_nums)
+    sampled = labels.clone()
+    torch.manual_seed(seed)
+    _subsample_labels(sampled, label, max_nums)
+
+    # the samples differ, the random numbers come from different generators, but not what is sampled from
+    assert torch.equal((sampled == label).long().sum(1), (expected == label).long().sum(1))
+    # only the labels of the sampled class are disabled
+    assert torch.equal(sampled[labels != label], labels[labels != label])
+    assert torch.equal((sampled == label) | (sampled == -1), (labels == label) | (labels == -1))
+    # the labels are only subsampled when there are too many of them
+    for i in range(labels.size(0)):
+        if (labels[i] == label).long().sum() <= max_nums[i]:
+            assert torch.equal(sampled[i], labels[i])
+
+
+def test_subsample_labels_samples_uniformly():
+    torch.manual_seed(0)
+    num_candidates, max_num, num_trials = 10, 3, 4000
+    counts = torch.zeros(num_candidates)
+    for _ in range(num_trials):
+        labels = torch.ones(1, num_candidates)
+        _subsample_labels(labels, 1, torch.LongTensor([max_num]))
+        counts += (labels[0] == 1).float()
+    frequencies = counts / num_trials
+    assert (frequencies - max_num / float(num_candidates)).abs().max() < 0.03
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_unmap_equals_unmapping_one_tensor_at_a_time(seed):
+    rng = np.random.RandomState(seed)
+    batch_size, count = 2, 50
+    inds = torch.from_numpy(np.sort(rng.choice(count, rng.randint(1, count), replace=False))).long()
+    labels = _random_labels(rng, batch_size, inds.numel())
+    bbox_targets = torch.from_numpy(rng.randn(batch_size, inds.numel(), 4)).float()
+    bbox_inside_weights = torch.from_numpy(rng.rand(batch_size, inds.numel())).float()
+    bbox_outside_weights = torch.from_numpy(rng.rand(batch_size, inds.numel())).float()
+
+    unmapped = _unmap((labels, bbox_targets, bbox_inside_weights, bbox_outside_weights), (-1, 0, 0, 0), count, inds)
+
+    expected = [_unmap_one(labels, count, inds, batch_size, fill=-1),
+                _unmap_one(bbox_targets, count, inds, batch_size, fill=0),
+                _unmap_one(bbox_inside_weights, count, inds, batch_size, fill=0),
+                _unmap_one(bbox_outside_weights, count, inds, batch_size, fill=0)]
+    for data, expected_data in zip(unmapped, expected):
+        assert data.size() == expected_data.size()
+        assert torch.equal(data, expected_data)
@@ -0,0 +1,71 @@
+import numpy as np
+import pytest
+
+try:
+    from data_manager.classic_detection.classic_data_manager import DistributedDBSampler
+except ImportError as e:
+    # the data manager imports the whole data pipeline (OpenCV, the built extensions, etc.)
+    pytest.skip(str(e), allow_module_level=True)
+
+
+def _batches_per_rank(train_size, batch_size, num_replicas, seed=0, epoch=0):
+    batches = []
+    for rank in range(num_replicas):
+        sampler = DistributedDBSampler(train_size, batch_size, num_replicas, rank, seed)
+        sampler.set_epoch(epoch)
+        positions = [int(p) for p in sampler]
+        assert len(positions) == len(sampler)
+        batches.append([tuple(positions[i:i + batch_size]) for i in range(0, len(positions), batch_size)])
+    return batches
+
+
+@pytest.mark.parametrize('num_replicas', [2, 4])
+def test_ranks_get_disjoint_batches(num_replicas):
+    train_size, batch_size = 8 * num_replicas * 3 + 1, 3  # the leftover image is dropped
+    batches = _batches_per_rank(train_size, batch_size, num_replicas)
+
+    all_batches = [b for rank_batches in batches for b in rank_batches]
+    assert len(set(all_batches)) == len(all_batches)
+    all_positions = sorted(p for b in all_batches for p in b)
+    assert all_positions == list(range(train_size - 1))
+    assert len({len(rank_batches) for rank_batches in batches}) == 1
+
+
+def test_batches_are_repeated_to_even_out_the_ranks():
+    train_size, batch_size, num_replicas = 10, 2, 3
+    batches = _batches_per_rank(train_size, batch_size, num_replicas)
+
+    assert [len(rank_batches) for rank_batches in batches] == [2, 2, 2]
+    all_batches = [b for rank_batches in batches for b in rank_batches]
+    assert len(set(all_batches)) == 5
+    for rank_batches in batches:
+        assert len(set(rank_batches)) == len(rank_batches)
+
+
+def test_batches_group_images_of_similar_aspect_ratio():
+    # the data loader positions index the roidb sorted by aspect ratio (ratio_index), so a batch of consecutive
+    # positions that starts on a multiple of the batch size holds the images of the closest ratios
+    train_size, batch_size, num_replicas = 24, 4, 2
+    ratio_list = np.sort(np.random.RandomState(0).uniform(0.5, 2., train_size))
+    batches = _batches_per_rank(train_size, batch_size, num_replicas)
+
+    for rank_batches in batches:
+        for batch in rank_batches:
+            assert batch[0] % batch_size == 0
+            assert list(batch) == list(range(batch[0], batch[0] + batch_size))
+            ratios = ratio_list[list(batch)]
+            other_ratios = np.delete(ratio_list, list(batch))
+            assert not np.any((other_ratios > ratios.min()) & (other_ratios < ratios.max()))
+
+
+def test_ranks_agree_on_the_order_of_every_epoch():
+    first_epoch = _batches_per_rank(40, 2, 2, seed=3, epoch=0)
+    assert _batches_per_rank(40, 2, 2, seed=3, epoch=0) == first_epoch
+    second_epoch = _batches_per_rank(40, 2, 2, seed=3, epoch=1)
+    assert second_epoch != first_epoch
+    assert not set(second_epoch[0]) & set(second_epoch[1])
+
+
+def test_too_few_images_for_a_batch():
+    with pytest.raises(ValueError):
+        DistributedDBSampler(3, 4, 2, 0)
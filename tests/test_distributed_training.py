@@ -0,0 +1,164 @@
+import os
+
+import numpy as np
+import pytest
+import torch
+import torch.multiprocessing as mp
+import torch.nn as nn
+import torch.nn.functional as F
+import yaml
+from torch.utils.data import DataLoader, Dataset
+
+from utils import distributed
+try:
+    distributed.check_distributed_support()
+except RuntimeError as e:
+    pytest.skip(str(e), allow_module_level=True)
+
+from data_manager.data_manager_abstract import DataManager, Mode
+from pipeline.faster_rcnn.faster_rcnn_training_session import run_training_session
+from utils.config import ConfigProvider
+
+try:
+    from data_manager.classic_detection.classic_data_manager import DistributedDBSampler
+except ImportError as e:
+    # the data manager imports the whole data pipeline (OpenCV, the built extensions, etc.)
+    pytest.skip(str(e), allow_module_level=True)
+
+WORLD_SIZE = 2
+NUM_CLASSES = 3
+IM_SIZE = 16
+
+
+def _create_tiny_roidb(num_images):
+    rng = np.random.RandomState(0)
+    roidb = []
+    for i in range(num_images):
+        x1, y1 = rng.randint(0, IM_SIZE // 2, 2)
+        roidb.append({'boxes': np.array([[x1, y1, x1 + IM_SIZE // 2 - 1, y1 + IM_SIZE // 2 - 1]], dtype=np.float32),
+                      'gt_classes': np.array([1 + i % (NUM_CLASSES - 1)]),
+                      'pixels': rng.uniform(-1, 1, (3, IM_SIZE, IM_SIZE)).astype(np.float32)})
+    return roidb
+
+
+class _TinyRoidbDataset(Dataset):
+    def __init__(self, roidb):
+        self.roidb = roidb
+
+    def __getitem__(self, index):
+        entry = self.roidb[index]
+        gt_boxes = np.hstack((entry['boxes'], entry['gt_classes'][:, np.newaxis].astype(np.float32)))
+        return (torch.from_numpy(entry['pixels']), torch.FloatTensor([IM_SIZE, IM_SIZE, 1.]),
+                torch.from_numpy(gt_boxes), len(entry['boxes']))
+
+    def __len__(self):
+        return len(self.roidb)
+
+
+class _TinyDataManager(DataManager):
+    """Serves the tiny roidb in the batches DistributedDBSampler gives to this rank, as ClassicDataManager does."""
+    def __init__(self, roidb, batch_size, rank):
+        super(_TinyDataManager, self).__init__(Mode.TRAIN, is_cuda=False)
+        sampler = DistributedDBSampler(len(roidb), batch_size, WORLD_SIZE, rank)
+        self.iters_per_epoch = sampler.num_batches_per_replica
+        self._data_loader = DataLoader(_TinyRoidbDataset(roidb), batch_size=batch_size, sampler=sampler)
+        self._num_images = len(roidb)
+
+    def transform_data_tensors(self, data):
+        return data[0], data[1], data[2], data[3]
+
+    def __len__(self):
+        return self._num_images
+
+    @property
+    def num_classes(self):
+        return NUM_CLASSES
+
+    @property
+    def classes(self):
+        return list(range(NUM_CLASSES))
+
+    @property
+    def num_images(self):
+        return self._num_images
+
+    @property
+    def data_loader(self):
+        return self._data_loader
+
+
+class _TinyDetector(nn.Module):
+    """Has the inputs and outputs of FasterRCNN, whose roi poolers are not built for the versions of pytorch
+    that train distributed."""
+    cfg_params = {}
+
+    def __init__(self):
+        super(_TinyDetector, self).__init__()
+        self.base = nn.Conv2d(3, 4, 3, padding=1)
+        self.cls_score = nn.Linear(4, NUM_CLASSES)
+        self.bbox_pred = nn.Linear(4, 4)
+
+    def forward(self, im_data, im_info, gt_boxes, num_boxes, cache_keys=None):
+        features = self.base(im_data).mean(3).mean(2)
+        cls_score = self.cls_score(features)
+        bbox_pred = self.bbox_pred(features)
+        rois_label = gt_boxes[:, 0, 4].long()
+        loss_cls = F.cross_entropy(cls_score, rois_label)
+        loss_bbox = F.smooth_l1_loss(bbox_pred, gt_boxes[:, 0, :4] / IM_SIZE)
+        return gt_boxes[:, :1, :4], F.softmax(cls_score, 1), bbox_pred, loss_cls, loss_bbox, loss_cls, loss_bbox, \
+            rois_label
+
+
+def _create_cfg(output_dir):
+    with open(os.path.join(os.path.dirname(distributed.__file__), 'defaults.yml'), 'r') as f:
+        cfg_dict = yaml.safe_load(f)
+    cfg_dict.update({'DATA_DIR': output_dir, 'OUTPUT_DIR': output_dir, 'EXPERIMENT_NAME': 'ddp_smoke',
+                     'USER_CHOSEN_SEED': 1, 'CUDA': False, 'dist_backend': 'gloo',
+                     'dist_init_method': 'file://' + os.path.join(output_dir, 'dist_init')})
+    cfg_dict['TRAIN'].update({'start_epoch': 1, 'max_epochs': 1, 'batch_size': 1, 'LEARNING_RATE': 0.1})
+    cfg = ConfigProvider()
+    cfg.create_from_dict(cfg_dict)
+    return cfg
+
+
+def _train_process(rank, cfg, roidb):
+    distributed.init_distributed(cfg, rank, WORLD_SIZE, rank)
+    try:
+        torch.manual_seed(0)
+        model = _TinyDetector()
+        torch.save(model.state_dict(), os.path.join(cfg.output_path, 'init_rank{}.pth'.format(rank)))
+        data_manager = _TinyDataManager(roidb, cfg.TRAIN.batch_size, rank)
+        assert data_manager.iters_per_epoch == 1
+        run_training_session(data_manager, model, lambda params: torch.optim.SGD(params, momentum=0.), cfg,
+                             train_logger=None, first_epoch=cfg.TRAIN.start_epoch)
+        torch.save(model.state_dict(), os.path.join(cfg.output_path, 'trained_rank{}.pth'.format(rank)))
+    finally:
+        distributed.cleanup_distributed()
+
+
+def _load_ckpt(path):
+    # the checkpoint holds the config, which the newer versions of pytorch don't unpickle by default
+    try:
+        return torch.load(path, weights_only=False)
+    except TypeError:
+        return torch.load(path)
+
+
+def test_one_iteration_with_two_gloo_ranks(tmpdir):
+    cfg = _create_cfg(str(tmpdir))
+    # one image for every rank
+    mp.spawn(_train_process, args=(cfg, _create_tiny_roidb(WORLD_SIZE)), nprocs=WORLD_SIZE)
+
+    init = [torch.load(os.path.join(cfg.output_path, 'init_rank{}.pth'.format(r))) for r in range(WORLD_SIZE)]
+    trained = [torch.load(os.path.join(cfg.output_path, 'trained_rank{}.pth'.format(r))) for r in range(WORLD_SIZE)]
+    for key in trained[0]:
+        # the ranks trained on different images and stay in sync, with the averaged gradients
+        assert not torch.equal(trained[0][key], init[0][key])
+        for r in range(1, WORLD_SIZE):
+            assert torch.allclose(trained[r][key], trained[0][key])
+
+    # only the first rank writes the checkpoint
+    ckpt = _load_ckpt(cfg.get_ckpt_path(cfg.TRAIN.max_epochs))
+    assert ckpt['last_performed_epoch'] == cfg.TRAIN.max_epochs
+    for key, value in trained[0].items():
+        assert torch.equal(ckpt['model'][key], value)
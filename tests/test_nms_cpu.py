@@ -0,0 +1,109 @@
+import numpy as np
+import pytest
+import torch
+
+from model.meta_architecture.nms.nms_cpu import _batched_nms_numpy, _nms_numpy
+
+
+def _nms_reference(dets, thresh):
+    """The numpy NMS the compiled one replaced."""
+    x1 = dets[:, 0]
+    y1 = dets[:, 1]
+    x2 = dets[:, 2]
+    y2 = dets[:, 3]
+    scores = dets[:, 4]
+
+    areas = (x2 - x1 + 1) * (y2 - y1 + 1)
+    order = scores.argsort()[::-1]
+
+    keep = []
+    while order.size > 0:
+        i = order.item(0)
+        keep.append(i)
+        xx1 = np.maximum(x1[i], x1[order[1:]])
+        yy1 = np.maximum(y1[i], y1[order[1:]])
+        xx2 = np.minimum(x2[i], x2[order[1:]])
+        yy2 = np.minimum(y2[i], y2[order[1:]])
+
+        w = np.maximum(0.0, xx2 - xx1 + 1)
+        h = np.maximum(0.0, yy2 - yy1 + 1)
+        inter = w * h
+        ovr = inter / (areas[i] + areas[order[1:]] - inter)
+
+        inds = np.where(ovr <= thresh)[0]
+        order = order[inds + 1]
+
+    return np.array(keep, dtype=np.int64)
+
+
+def _batched_nms_reference(dets, idxs, thresh):
+    """NMS of every class on its own, as the postprocessing did before the class-aware NMS, in descending score."""
+    keep = np.concatenate([np.flatnonzero(idxs == idx)[_nms_reference(dets[idxs == idx], thresh)]
+                           for idx in np.unique(idxs)])
+    return keep[np.argsort(-dets[keep, 4])]
+
+
+def _random_dets(rng, num_boxes, num_distinct_scores=None):
+    """Clustered boxes, so that NMS suppresses some. Scores are drawn from num_distinct_scores values for ties."""
+    centers = rng.uniform(50, 450, (max(1, num_boxes // 8), 2))[rng.randint(0, max(1, num_boxes // 8), num_boxes)]
+    centers += rng.normal(0, 10, centers.shape)
+    sizes = rng.uniform(20, 80, (num_boxes, 2))
+    if num_distinct_scores is None:
+        scores = rng.permutation(num_boxes) / float(num_boxes) + rng.uniform(0, 0.5 / num_boxes, num_boxes)
+    else:
+        scores = rng.randint(0, num_distinct_scores, num_boxes) / float(num_distinct_scores)
+    dets = np.hstack((centers - sizes / 2, centers + sizes / 2, scores[:, np.newaxis]))
+    return np.ascontiguousarray(dets, dtype=np.float32)
+
+
+@pytest.mark.parametrize('seed', range(30))
+@pytest.mark.parametrize('thresh', [0.3, 0.7])
+def test_numpy_nms_matches_the_reference(seed, thresh):
+    rng = np.random.RandomState(seed)
+    dets = _random_dets(rng, rng.randint(1, 300))
+    assert np.array_equal(_nms_numpy(dets, thresh), _nms_reference(dets, thresh))
+
+
+@pytest.mark.parametrize('seed', range(30))
+def test_numpy_batched_nms_matches_nms_per_class(seed):
+    rng = np.random.RandomState(seed)
+    dets = _random_dets(rng, rng.randint(1, 300))
+    idxs = rng.randint(0, 5, len(dets)).astype(np.int64)
+    assert np.array_equal(_batched_nms_numpy(dets, idxs, 0.5), _batched_nms_reference(dets, idxs, 0.5))
+
+
+def test_no_boxes():
+    dets = np.zeros((0, 5), dtype=np.float32)
+    assert len(_nms_numpy(dets, 0.5)) == 0
+    assert len(_batched_nms_numpy(dets, np.zeros(0, dtype=np.int64), 0.5)) == 0
+
+
+class TestCompiledNMS(object):
+    """The compiled NMS keeps the same boxes in the same order as the numpy fallback, ties of scores included."""
+    @pytest.fixture(autouse=True)
+    def cython_nms(self):
+        return pytest.importorskip('model.meta_architecture.nms.cython_nms')
+
+    @pytest.mark.parametrize('seed', range(30))
+    @pytest.mark.parametrize('num_distinct_scores', [None, 5])
+    def test_cpu_nms(self, cython_nms, seed, num_distinct_scores):
+        rng = np.random.RandomState(seed)
+        dets = _random_dets(rng, rng.randint(1, 300), num_distinct_scores)
+        assert np.array_equal(cython_nms.cpu_nms(dets, 0.5), _nms_numpy(dets, 0.5))
+
+    @pytest.mark.parametrize('seed', range(30))
+    @pytest.mark.parametrize('num_distinct_scores', [None, 5])
+    def test_cpu_batched_nms(self, cython_nms, seed, num_distinct_scores):
+        rng = np.random.RandomState(seed)
+        dets = _random_dets(rng, rng.randint(1, 300), num_distinct_scores)
+        idxs = rng.randint(0, 5, len(dets)).astype(np.int64)
+        assert np.array_equal(cython_nms.cpu_batched_nms(dets, idxs, 0.5), _batched_nms_numpy(dets, idxs, 0.5))
+
+    def test_batched_nms_cpu(self, cython_nms):
+        from model.meta_architecture.nms.nms_cpu import batched_nms_cpu
+        rng = np.random.RandomState(0)
+        dets = _random_dets(rng, 100, num_distinct_scores=5)
+        idxs = rng.randint(0, 5, len(dets)).astype(np.int64)
+        keep = batched_nms_cpu(torch.from_numpy(dets), torch.from_numpy(idxs), 0.5)
+        assert keep.type() == 'torch.IntTensor'
+        assert np.array_equal(keep.numpy(), _batched_nms_numpy(dets, idxs, 0.5))
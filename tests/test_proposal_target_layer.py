@@ -0,0 +1,253 @@
+import numpy as np
+import pytest
+import torch
+from easydict import EasyDict as edict
+
+from model.meta_architecture.rpn.bbox_transform import bbox_overlaps_batch, bbox_transform_batch
+from model.meta_architecture.rpn.proposal_target_layer_cascade import _ProposalTargetLayer
+
+NUM_CLASSES = 4
+IM_SIZE = 200.
+
+
+def _create_cfg(batch_size):
+    return edict({'TRAIN': {'BATCH_SIZE': batch_size,
+                            'FG_FRACTION': 0.25,
+                            'FG_THRESH': 0.5,
+                            'BG_THRESH_HI': 0.5,
+                            'BG_THRESH_LO': 0.1,
+                            'BBOX_INSIDE_WEIGHTS': [1.0, 1.0, 1.0, 1.0],
+                            'BBOX_NORMALIZE_TARGETS_PRECOMPUTED': True,
+                            'BBOX_NORMALIZE_MEANS': [0.0, 0.0, 0.0, 0.0],
+                            'BBOX_NORMALIZE_STDS': [0.1, 0.1, 0.2, 0.2]}})
+
+
+class _LoopProposalTargetLayer(_ProposalTargetLayer):
+    """The per-image sampling and regression labels the batched ones replaced, with the RoIs of every image
+    sampled in numpy."""
+    def _get_bbox_regression_labels_pytorch(self, bbox_target_data, labels_batch, num_classes):
+        batch_size = labels_batch.size(0)
+        rois_per_image = labels_batch.size(1)
+        clss = labels_batch
+        bbox_targets = bbox_target_data.new(batch_size, rois_per_image, 4).zero_()
+        bbox_inside_weights = bbox_target_data.new(bbox_targets.size()).zero_()
+
+        for b in range(batch_size):
+            if clss[b].sum() == 0:
+                continue
+            inds = torch.nonzero(clss[b] > 0).view(-1)
+            for i in range(inds.numel()):
+                ind = inds[i]
+                bbox_targets[b, ind, :] = bbox_target_data[b, ind, :]
+                bbox_inside_weights[b, ind, :] = self.BBOX_INSIDE_WEIGHTS
+
+        return bbox_targets, bbox_inside_weights
+
+    def _sample_rois_pytorch(self, all_rois, gt_boxes, fg_rois_per_image, rois_per_image, num_classes):
+        overlaps = bbox_overlaps_batch(all_rois, gt_boxes)
+
+        max_overlaps, gt_assignment = torch.max(overlaps, 2)
+
+        batch_size = overlaps.size(0)
+
+        offset = torch.arange(0, batch_size)*gt_boxes.size(1)
+        offset = offset.view(-1, 1).type_as(gt_assignment) + gt_assignment
+
+        labels = gt_boxes[:, :, 4].contiguous().view(-1)[offset.view(-1)].view(batch_size, -1)
+
+        labels_batch = labels.new(batch_size, rois_per_image).zero_()
+        rois_batch = all_rois.new(batch_size, rois_per_image, 5).zero_()
+        gt_rois_batch = all_rois.new(batch_size, rois_per_image, 5).zero_()
+        for i in range(batch_size):
+            fg_inds = torch.nonzero(max_overlaps[i] >= self.cfg.TRAIN.FG_THRESH).view(-1)
+            fg_num_rois = fg_inds.numel()
+
+            bg_inds = torch.nonzero((max_overlaps[i] < self.cfg.TRAIN.BG_THRESH_HI) &
+                                    (max_overlaps[i] >= self.cfg.TRAIN.BG_THRESH_LO)).view(-1)
+            bg_num_rois = bg_inds.numel()
+
+            if fg_num_rois > 0 and bg_num_rois > 0:
+                fg_rois_per_this_image = min(fg_rois_per_image, fg_num_rois)
+                rand_num = torch.from_numpy(np.random.permutation(fg_num_rois)).type_as(gt_boxes).long()
+                fg_inds = fg_inds[rand_num[:fg_rois_per_this_image]]
+
+                bg_rois_per_this_image = rois_per_image - fg_rois_per_this_image
+                rand_num = np.floor(np.random.rand(bg_rois_per_this_image) * bg_num_rois)
+                rand_num = torch.from_numpy(rand_num).type_as(gt_boxes).long()
+                bg_inds = bg_inds[rand_num]
+            elif fg_num_rois > 0 and bg_num_rois == 0:
+                rand_num = np.floor(np.random.rand(rois_per_image) * fg_num_rois)
+                rand_num = torch.from_numpy(rand_num).type_as(gt_boxes).long()
+                fg_inds = fg_inds[rand_num]
+                fg_rois_per_this_image = rois_per_image
+                bg_inds = bg_inds[:0]
+            elif bg_num_rois > 0 and fg_num_rois == 0:
+                rand_num = np.floor(np.random.rand(rois_per_image) * bg_num_rois)
+                rand_num = torch.from_numpy(rand_num).type_as(gt_boxes).long()
+                bg_inds = bg_inds[rand_num]
+                fg_inds = fg_inds[:0]
+                fg_rois_per_this_image = 0
+            else:
+                raise ValueError("bg_num_rois = 0 and fg_num_rois = 0, this should not happen!")
+
+            keep_inds = torch.cat([fg_inds, bg_inds], 0)
+
+            labels_batch[i].copy_(labels[i][keep_inds])
+            if fg_rois_per_this_image < rois_per_image:
+                labels_batch[i][fg_rois_per_this_image:] = 0
+
+            rois_batch[i] = all_rois[i][keep_inds]
+            rois_batch[i, :, 0] = i
+
+            gt_rois_batch[i] = gt_boxes[i][gt_assignment[i][keep_inds]]
+
+        bbox_target_data = self._compute_targets_pytorch(rois_batch[:, :, 1:5], gt_rois_batch[:, :, :4])
+
+        bbox_targets, bbox_inside_weights = \
+            self._get_bbox_regression_labels_pytorch(bbox_target_data, labels_batch, num_classes)
+
+        return labels_batch, rois_batch, bbox_targets, bbox_inside_weights
+
+
+def _jitter(rng, boxes, num, max_shift):
+    picked = boxes[rng.randint(0, len(boxes), num)]
+    jittered = picked + rng.uniform(-max_shift, max_shift, picked.shape) * \
+        np.tile(picked[:, 2:4] - picked[:, 0:2] + 1, 2)
+    return np.clip(jittered, 0, IM_SIZE - 1)
+
+
+def _create_inputs(rng, batch_size, num_gt, num_fg_like, num_bg_like, num_padded_gt=0):
+    """Proposals close to the gt boxes (mostly fg), further from them (mostly bg) and anywhere."""
+    gt_boxes = np.zeros((batch_size, num_gt + num_padded_gt, 5), dtype=np.float32)
+    all_rois = []
+    for i in range(batch_size):
+        x1y1 = rng.uniform(0, IM_SIZE / 2, (num_gt, 2))
+        wh = rng.uniform(20, IM_SIZE / 2, (num_gt, 2))
+        gt_boxes[i, :num_gt, :4] = np.hstack((x1y1, x1y1 + wh))
+        gt_boxes[i, :num_gt, 4] = rng.randint(1, NUM_CLASSES, num_gt)
+        x1y1 = rng.uniform(0, IM_SIZE - 20, (5, 2))
+        proposals = np.vstack((_jitter(rng, gt_boxes[i, :num_gt, :4], num_fg_like, 0.1),
+                               _jitter(rng, gt_boxes[i, :num_gt, :4], num_bg_like, 0.6),
+                               np.hstack((x1y1, x1y1 + rng.uniform(1, 20, (5, 2))))))
+        all_rois.append(np.hstack((np.full((len(proposals), 1), i), proposals)))
+    return torch.from_numpy(np.stack(all_rois)).float(), torch.from_numpy(gt_boxes), \
+        torch.LongTensor([num_gt] * batch_size)
+
+
+def _candidates(cfg, all_rois, gt_boxes):
+    gt_rois = gt_boxes.new(gt_boxes.size()).zero_()
+    gt_rois[:, :, 1:5] = gt_boxes[:, :, :4]
+    candidates = torch.cat([all_rois, gt_rois], 1)
+    max_overlaps, _ = torch.max(bbox_overlaps_batch(candidates, gt_boxes), 2)
+    is_fg = max_overlaps >= cfg.TRAIN.FG_THRESH
+    is_bg = (max_overlaps < cfg.TRAIN.BG_THRESH_HI) & (max_overlaps >= cfg.TRAIN.BG_THRESH_LO)
+    return candidates, is_fg, is_bg
+
+
+def _check_sample(cfg, all_rois, gt_boxes, outputs):
+    """Checks what any sample of the RoIs should satisfy, returns the number of fg RoIs of every image."""
+    rois, labels, bbox_targets, bbox_inside_weights, bbox_outside_weights = outputs
+    batch_size, rois_per_image = labels.size()
+    fg_rois_per_image = int(np.round(cfg.TRAIN.FG_FRACTION * rois_per_image))
+    candidates, is_fg, is_bg = _candidates(cfg, all_rois, gt_boxes)
+
+    overlaps = bbox_overlaps_batch(rois, gt_boxes)
+    max_overlaps, gt_assignment = torch.max(overlaps, 2)
+    num_fg = []
+    for i in range(batch_size):
+        assert (rois[i, :, 0] == i).all()
+        # every RoI is one of the candidates of the image
+        for roi in rois[i, :, 1:5]:
+            assert (candidates[i, :, 1:5] == roi).all(1).any()
+
+        is_fg_slot = labels[i] > 0
+        assert (max_overlaps[i][is_fg_slot] >= cfg.TRAIN.FG_THRESH).all()
+        assert torch.equal(labels[i][is_fg_slot], gt_boxes[i, :, 4][gt_assignment[i]][is_fg_slot])
+        bg_overlaps = max_overlaps[i][~is_fg_slot]
+        assert ((bg_overlaps < cfg.TRAIN.BG_THRESH_HI) & (bg_overlaps >= cfg.TRAIN.BG_THRESH_LO)).all()
+
+        num_fg_candidates, has_bg = int(is_fg[i].long().sum()), bool(is_bg[i].any())
+        num_fg.append(int(is_fg_slot.long().sum()))
+        if has_bg:
+            assert num_fg[i] == min(num_fg_candidates, fg_rois_per_image)
+            # the fg RoIs are sampled without replacement
+            assert len({tuple(roi.tolist()) for roi in rois[i][is_fg_slot]}) == num_fg[i]
+        else:
+            assert num_fg[i] == rois_per_image
+
+    targets = bbox_transform_batch(rois[:, :, 1:5], gt_boxes.gather(
+        1, gt_assignment.unsqueeze(2).expand(batch_size, rois_per_image, 5))[:, :, :4])
+    targets = (targets - torch.FloatTensor(cfg.TRAIN.BBOX_NORMALIZE_MEANS)) / \
+        torch.FloatTensor(cfg.TRAIN.BBOX_NORMALIZE_STDS)
+    is_fg_slot = (labels > 0).unsqueeze(2).expand_as(targets)
+    assert torch.allclose(bbox_targets[is_fg_slot], targets[is_fg_slot], atol=1e-5)
+    assert (bbox_targets[~is_fg_slot] == 0).all()
+    assert torch.equal(bbox_inside_weights, is_fg_slot.float())
+    assert torch.equal(bbox_outside_weights, is_fg_slot.float())
+    return num_fg
+
+
+def _sorted_rows(labels, rois, bbox_targets, image, mask):
+    rows = torch.cat([labels[image].unsqueeze(1), rois[image], bbox_targets[image]], 1)[mask]
+    return sorted(tuple(np.round(row.tolist(), 4)) for row in rows)
+
+
+def _run_both(cfg, all_rois, gt_boxes, num_boxes, seed):
+    np.random.seed(seed)
+    expected = _LoopProposalTargetLayer(NUM_CLASSES, cfg)(all_rois.clone(), gt_boxes.clone(), num_boxes)
+    torch.manual_seed(seed)
+    outputs = _ProposalTargetLayer(NUM_CLASSES, cfg)(all_rois.clone(), gt_boxes.clone(), num_boxes)
+    return expected, outputs
+
+
+@pytest.mark.parametrize('seed', range(10))
+@pytest.mark.parametrize('num_fg_like, num_bg_like', [(40, 60), (3, 60), (10, 0)])
+def test_sampling_matches_the_loop(seed, num_fg_like, num_bg_like):
+    rng = np.random.RandomState(seed)
+    cfg = _create_cfg(batch_size=32)
+    all_rois, gt_boxes, num_boxes = _create_inputs(rng, batch_size=2, num_gt=3, num_fg_like=num_fg_like,
+                                                   num_bg_like=num_bg_like, num_padded_gt=seed % 3)
+    expected, outputs = _run_both(cfg, all_rois, gt_boxes, num_boxes, seed)
+
+    # the samples differ, the random numbers come from different generators, but not what they satisfy
+    assert _check_sample(cfg, all_rois, gt_boxes, outputs) == _check_sample(cfg, all_rois, gt_boxes, expected)
+
+    # when all the fg RoIs of an image are sampled, they are the same ones (in another order)
+    _, is_fg, is_bg = _candidates(cfg, all_rois, gt_boxes)
+    fg_rois_per_image = int(np.round(cfg.TRAIN.FG_FRACTION * cfg.TRAIN.BATCH_SIZE))
+    for i in range(all_rois.size(0)):
+        if is_bg[i].any() and int(is_fg[i].long().sum()) <= fg_rois_per_image:
+            assert _sorted_rows(outputs[1], outputs[0], outputs[2], i, outputs[1][i] > 0) == \
+                _sorted_rows(expected[1], expected[0], expected[2], i, expected[1][i] > 0)
+
+
+def test_sampling_matches_the_loop_without_randomness():
+    # a single bg candidate per image and fewer fg candidates than fg slots leave nothing to chance
+    cfg = _create_cfg(batch_size=16)
+    gt_boxes = torch.FloatTensor([[[10, 10, 60, 60, 1], [100, 100, 180, 150, 3]],
+                                  [[20, 30, 90, 100, 2], [0, 0, 0, 0, 0]]])
+    all_rois = torch.FloatTensor([[[0, 12, 12, 62, 58], [0, 30, 10, 80, 60], [0, 150, 10, 160, 20]],
+                                  [[1, 22, 28, 88, 104], [1, 60, 70, 130, 140], [1, 25, 30, 90, 100]]])
+    expected, outputs = _run_both(cfg, all_rois, gt_boxes, torch.LongTensor([2, 1]), seed=0)
+
+    _check_sample(cfg, all_rois, gt_boxes, outputs)
+    for i in range(all_rois.size(0)):
+        everything = outputs[1][i] > -1
+        assert _sorted_rows(outputs[1], outputs[0], outputs[2], i, everything) == \
+            _sorted_rows(expected[1], expected[0], expected[2], i, everything)
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_bbox_regression_labels_match_the_loop(seed):
+    rng = np.random.RandomState(seed)
+    cfg = _create_cfg(batch_size=16)
+    bbox_target_data = torch.from_numpy(rng.randn(3, 16, 4)).float()
+    labels = torch.from_numpy(rng.randint(0, NUM_CLASSES, (3, 16))).float()
+    labels[1] = 0
+
+    expected = _LoopProposalTargetLayer(NUM_CLASSES, cfg)._get_bbox_regression_labels_pytorch(
+        bbox_target_data, labels, NUM_CLASSES)
+    outputs = _ProposalTargetLayer(NUM_CLASSES, cfg)._get_bbox_regression_labels_pytorch(
+        bbox_target_data, labels, NUM_CLASSES)
+    for data, expected_data in zip(outputs, expected):
+        assert torch.equal(data, expected_data)